@@ -29,8 +29,12 @@ sys.path.append(directory)
 
 import imp
 import parameters
+import prefetch
 
 imp.reload(parameters)
+imp.reload(prefetch)
+
+from prefetch import RunPrefetcher
 
 dictionary = parameters.load_input_file(filename)
 
@@ -86,6 +90,14 @@ if dictionary.get('mask-file') is not None:
     mask_file = os.path.join(vanadium_directory, dictionary['mask-file'])
 else:
     mask_file = None
+
+prefetch_lookahead = dictionary.get('prefetch-lookahead')
+if prefetch_lookahead is None:
+    prefetch_lookahead = 0
+
+prefetch_memory = dictionary.get('prefetch-memory')
+if prefetch_memory is None:
+    prefetch_memory = 70
     
 N_ws_bkg = dictionary['n-runs']
 if N_ws_bkg % 2 == 0:
@@ -130,6 +142,50 @@ if instrument == 'CORELLI':
 else:
     det_size = [rect.xpixels(),rect.ypixels()]
 
+def load_bank(r, b, ws, charge, instrument, ipts, detector_calibration, mask_file, k_min, k_max, k_step):
+
+    LoadEventNexus(Filename='/SNS/{}/IPTS-{}/nexus/{}_{}.nxs.h5'.format(instrument,ipts,instrument,r),
+                   BankName='bank{}'.format(b),
+                   SingleBankPixelsOnly=True,
+                   OutputWorkspace=ws,
+                   LoadMonitors=False,
+                   LoadLogs=False)
+
+    AddSampleLog(Workspace=ws,
+                 LogName='gd_prtn_chrg',
+                 LogText=str(charge),
+                 LogType='Number',
+                 NumberType='Double')
+
+    NormaliseByCurrent(InputWorkspace=ws,
+                       OutputWorkspace=ws)
+
+    DeleteLog(Workspace=ws, Name='gd_prtn_chrg')
+
+    if mtd.doesExist('tube_table'):
+        ApplyCalibration(Workspace=ws, CalibrationTable='tube_table')
+
+    if detector_calibration is not None:
+        ext = os.path.splitext(detector_calibration)[1]
+        if ext == '.xml':
+            LoadParameterFile(Workspace=ws,
+                              Filename=os.path.join(calibration_directory, detector_calibration))
+        else:
+            LoadIsawDetCal(InputWorkspace=ws,
+                           Filename=os.path.join(calibration_directory, detector_calibration))
+
+    if mask_file is not None:
+        MaskDetectors(Workspace=ws, MaskedWorkspace='mask')
+
+    ConvertUnits(InputWorkspace=ws, 
+                 OutputWorkspace=ws,
+                 Target='Momentum')
+
+    Rebin(InputWorkspace=ws,
+          OutputWorkspace=ws,
+          Params='{},{},{}'.format(k_min,k_step,k_max),
+          PreserveEvents=True)
+
 def background(all_banks, proc, outname, dbgdir, tube_calibration, detector_calibration, mask_file, runs, instrument, ipts, banks, det_size, N_ws_bkg, cols, rows, k_min, k_max, k_step):
 
     if tube_calibration is not None:
@@ -180,48 +236,16 @@ def background(all_banks, proc, outname, dbgdir, tube_calibration, detector_cali
 
     for bind, b in enumerate(all_banks):
 
-        for rind, r in enumerate(runs):
-            LoadEventNexus(Filename='/SNS/{}/IPTS-{}/nexus/{}_{}.nxs.h5'.format(instrument,ipts,instrument,r),
-                           BankName='bank{}'.format(b),
-                           SingleBankPixelsOnly=True,
-                           OutputWorkspace='{}_{}'.format(instrument,r),
-                           LoadMonitors=False,
-                           LoadLogs=False)
-
-            AddSampleLog(Workspace='{}_{}'.format(instrument,r),
-                         LogName='gd_prtn_chrg',
-                         LogText=str(pc[rind]),
-                         LogType='Number',
-                         NumberType='Double')
-
-            NormaliseByCurrent(InputWorkspace='{}_{}'.format(instrument,r),
-                               OutputWorkspace='{}_{}'.format(instrument,r))
-
-            DeleteLog(Workspace='{}_{}'.format(instrument,r), Name='gd_prtn_chrg')
-
-            if mtd.doesExist('tube_table'):
-                ApplyCalibration(Workspace='{}_{}'.format(instrument,r), CalibrationTable='tube_table')
-
-            if detector_calibration is not None:
-                ext = os.path.splitext(detector_calibration)[1]
-                if ext == '.xml':
-                    LoadParameterFile(Workspace='{}_{}'.format(instrument,r),
-                                      Filename=os.path.join(calibration_directory, detector_calibration))
-                else:
-                    LoadIsawDetCal(InputWorkspace='{}_{}'.format(instrument,r),
-                                   Filename=os.path.join(calibration_directory, detector_calibration))
-
-            if mask_file is not None:
-                MaskDetectors(Workspace='{}_{}'.format(instrument,r), MaskedWorkspace='mask')
-
-            ConvertUnits(InputWorkspace='{}_{}'.format(instrument,r), 
-                         OutputWorkspace='{}_{}'.format(instrument,r),
-                         Target='Momentum')
-
-            Rebin(InputWorkspace='{}_{}'.format(instrument,r),
-                  OutputWorkspace='{}_{}'.format(instrument,r),
-                  Params='{},{},{}'.format(k_min,k_step,k_max),
-                  PreserveEvents=True)
+        charges = dict(zip(runs, pc))
+
+        prefetcher = RunPrefetcher(lambda r, ws: load_bank(r, b, ws, charges[r], instrument, ipts, detector_calibration, mask_file, k_min, k_max, k_step),
+                                   runs, lambda r: '{}_{}'.format(instrument,r), prefetch_lookahead, prefetch_memory)
+
+        for r in prefetcher:
+            pass
+
+        if prefetch_lookahead > 0:
+            prefetcher.write_report(os.path.join(dbgdir,'{}_prefetch_p{}_bank{}.txt'.format(instrument,proc,b)))
 
         ws_ev = GroupWorkspaces(InputWorkspaces=','.join(['{}_{}'.format(instrument,r) for r in runs]))
 
@@ -28,8 +28,12 @@ sys.path.append(directory)
 
 import imp
 import parameters
+import prefetch
 
 imp.reload(parameters)
+imp.reload(prefetch)
+
+from prefetch import RunPrefetcher
 
 dictionary = parameters.load_input_file(filename)
 
@@ -90,6 +94,58 @@ N_ws_bkg = dictionary['n-runs']
 if N_ws_bkg % 2 == 0:
     N_ws_bkg += 1
 
+prefetch_lookahead = dictionary.get('prefetch-lookahead')
+if prefetch_lookahead is None:
+    prefetch_lookahead = 0
+
+prefetch_memory = dictionary.get('prefetch-memory')
+if prefetch_memory is None:
+    prefetch_memory = 70
+
+def load_order(windows):
+
+    loaded, order = set(), []
+
+    for runs_to_merge in windows:
+        for run_to_merge in runs_to_merge:
+            if run_to_merge not in loaded:
+                loaded.add(run_to_merge)
+                order.append(run_to_merge)
+        loaded.discard(runs_to_merge[0])
+
+    return order
+
+def load_run(r, ws, instrument, ipts, detector_calibration, mask_file, k_min, k_max, k_step):
+
+    LoadEventNexus(Filename='/SNS/{}/IPTS-{}/nexus/{}_{}.nxs.h5'.format(instrument,ipts,instrument,r),
+                   OutputWorkspace=ws,
+                   LoadMonitors=False,
+                   LoadLogs=False)
+
+    if mtd.doesExist('tube_table'):
+        ApplyCalibration(Workspace=ws, CalibrationTable='tube_table')
+
+    if detector_calibration is not None:
+        ext = os.path.splitext(detector_calibration)[1]
+        if ext == '.xml':
+            LoadParameterFile(Workspace=ws,
+                              Filename=os.path.join(calibration_directory, detector_calibration))
+        else:
+            LoadIsawDetCal(InputWorkspace=ws,
+                           Filename=os.path.join(calibration_directory, detector_calibration))
+
+    if mask_file is not None:
+        MaskDetectors(Workspace=ws, MaskedWorkspace='mask')
+
+    ConvertUnits(InputWorkspace=ws, 
+                 OutputWorkspace=ws,
+                 Target='Momentum')
+
+    Rebin(InputWorkspace=ws,
+          OutputWorkspace=ws,
+          Params='{},{},{}'.format(k_min,k_step,k_max),
+          PreserveEvents=True)
+
 def background(runs, proc, all_runs, outname, outdir, dbgdir, tube_calibration, detector_calibration, mask_file, instrument, ipts, banks, det_size, N_ws_bkg, cols, rows, k_min, k_max, k_step):
 
     LoadEmptyInstrument(InstrumentName=instrument, OutputWorkspace=instrument)
@@ -110,44 +166,18 @@ def background(runs, proc, all_runs, outname, outdir, dbgdir, tube_calibration,
 
     n_runs = len(all_runs)
 
-    for r in runs:
+    windows = [[all_runs[(all_runs.tolist().index(r)+window)%n_runs] for window in range(-N_ws_bkg//2+1,N_ws_bkg//2+1)] for r in runs]
 
-        ind = all_runs.tolist().index(r)
+    prefetcher = RunPrefetcher(lambda r, ws: load_run(r, ws, instrument, ipts, detector_calibration, mask_file, k_min, k_max, k_step),
+                               load_order(windows), lambda r: '{}_{}'.format(instrument,r), prefetch_lookahead, prefetch_memory)
 
-        runs_to_merge = [all_runs[(ind+window)%n_runs] for window in range(-N_ws_bkg//2+1,N_ws_bkg//2+1)]
+    for r, runs_to_merge in zip(runs, windows):
 
         for run_to_merge in runs_to_merge:
 
             if not mtd.doesExist('{}_{}'.format(instrument,run_to_merge)):
 
-                LoadEventNexus(Filename='/SNS/{}/IPTS-{}/nexus/{}_{}.nxs.h5'.format(instrument,ipts,instrument,run_to_merge),
-                               OutputWorkspace='{}_{}'.format(instrument,run_to_merge),
-                               LoadMonitors=False,
-                               LoadLogs=False)
-
-                if mtd.doesExist('tube_table'):
-                    ApplyCalibration(Workspace='{}_{}'.format(instrument,run_to_merge), CalibrationTable='tube_table')
-
-                if detector_calibration is not None:
-                    ext = os.path.splitext(detector_calibration)[1]
-                    if ext == '.xml':
-                        LoadParameterFile(Workspace='{}_{}'.format(instrument,run_to_merge),
-                                          Filename=os.path.join(calibration_directory, detector_calibration))
-                    else:
-                        LoadIsawDetCal(InputWorkspace='{}_{}'.format(instrument,run_to_merge),
-                                       Filename=os.path.join(calibration_directory, detector_calibration))
-
-                if mask_file is not None:
-                    MaskDetectors(Workspace='{}_{}'.format(instrument,run_to_merge), MaskedWorkspace='mask')
-
-                ConvertUnits(InputWorkspace='{}_{}'.format(instrument,run_to_merge), 
-                             OutputWorkspace='{}_{}'.format(instrument,run_to_merge),
-                             Target='Momentum')
-
-                Rebin(InputWorkspace='{}_{}'.format(instrument,run_to_merge),
-                      OutputWorkspace='{}_{}'.format(instrument,run_to_merge),
-                      Params='{},{},{}'.format(k_min,k_step,k_max),
-                      PreserveEvents=True)
+                prefetcher.load(run_to_merge)
 
         ws_ev = GroupWorkspaces(InputWorkspaces=','.join(['{}_{}'.format(instrument,run_to_merge) for run_to_merge in runs_to_merge]))
 
@@ -162,6 +192,11 @@ def background(runs, proc, all_runs, outname, outdir, dbgdir, tube_calibration,
         DeleteWorkspace('ws_bkg')
         DeleteWorkspace('{}_{}'.format(instrument,runs_to_merge[0]))
 
+    prefetcher.shutdown()
+
+    if prefetch_lookahead > 0:
+        prefetcher.write_report(os.path.join(dbgdir, '{}_prefetch_p{}.txt'.format(instrument,proc)))
+
 if __name__ == '__main__':
 
     LoadEmptyInstrument(InstrumentName=instrument, OutputWorkspace=instrument)
@@ -28,8 +28,15 @@ sys.path.append(directory)
 
 import imp
 import parameters
+import prefetch
+import event_index
 
 imp.reload(parameters)
+imp.reload(prefetch)
+imp.reload(event_index)
+
+from prefetch import RunPrefetcher
+from event_index import EventIndex
 
 dictionary = parameters.load_input_file(filename)
 
@@ -90,6 +97,64 @@ N_ws_bkg = dictionary['n-runs']
 if N_ws_bkg % 2 == 0:
     N_ws_bkg += 1
 
+prefetch_lookahead = dictionary.get('prefetch-lookahead')
+if prefetch_lookahead is None:
+    prefetch_lookahead = 0
+
+prefetch_memory = dictionary.get('prefetch-memory')
+if prefetch_memory is None:
+    prefetch_memory = 70
+
+cache_directory = dictionary.get('cache-directory')
+
+run_index = EventIndex(os.path.join(cache_directory, 'events')) if cache_directory is not None else None
+
+def load_order(windows):
+
+    loaded, order = set(), []
+
+    for runs_to_merge in windows:
+        for run_to_merge in runs_to_merge:
+            if run_to_merge not in loaded:
+                loaded.add(run_to_merge)
+                order.append(run_to_merge)
+        loaded.discard(runs_to_merge[0])
+
+    return order
+
+def load_bank(r, b, ws, instrument, ipts, detector_calibration, mask_file, k_min, k_max, k_step):
+
+    LoadEventNexus(Filename='/SNS/{}/IPTS-{}/nexus/{}_{}.nxs.h5'.format(instrument,ipts,instrument,r),
+                   OutputWorkspace=ws,
+                   BankName='bank{}'.format(b),
+                   SingleBankPixelsOnly=True,
+                   LoadMonitors=False,
+                   LoadLogs=False)
+
+    if mtd.doesExist('tube_table'):
+        ApplyCalibration(Workspace=ws, CalibrationTable='tube_table')
+
+    if detector_calibration is not None:
+        ext = os.path.splitext(detector_calibration)[1]
+        if ext == '.xml':
+            LoadParameterFile(Workspace=ws,
+                              Filename=os.path.join(calibration_directory, detector_calibration))
+        else:
+            LoadIsawDetCal(InputWorkspace=ws,
+                           Filename=os.path.join(calibration_directory, detector_calibration))
+
+    if mask_file is not None:
+        MaskDetectors(Workspace=ws, MaskedWorkspace='mask')
+
+    ConvertUnits(InputWorkspace=ws, 
+                 OutputWorkspace=ws,
+                 Target='Momentum')
+
+    Rebin(InputWorkspace=ws,
+          OutputWorkspace=ws,
+          Params='{},{},{}'.format(k_min,k_step,k_max),
+          PreserveEvents=True)
+
 def background(runs, proc, all_banks, all_runs, outname, outdir, dbgdir, tube_calibration, detector_calibration, mask_file, instrument, ipts, banks, det_size, N_ws_bkg, cols, rows, k_min, k_max, k_step):
 
     LoadEmptyInstrument(InstrumentName=instrument, OutputWorkspace=instrument)
@@ -113,49 +178,27 @@ def background(runs, proc, all_banks, all_runs, outname, outdir, dbgdir, tube_ca
 
     for i, b in enumerate(all_banks):
 
+        windows = []
+
         for r in runs:
 
             ind = all_runs.tolist().index(r)
 
             if boundary == 'wrap':
-                runs_to_merge = [all_runs[(ind+window)%n_runs] for window in range(-N_ws_bkg//2+1,N_ws_bkg//2+1)]
+                windows.append([all_runs[(ind+window)%n_runs] for window in range(-N_ws_bkg//2+1,N_ws_bkg//2+1)])
             else:
-                runs_to_merge = [all_runs[np.min([np.max([0,ind+window]),n_runs-1])] for window in range(-N_ws_bkg//2+1,N_ws_bkg//2+1)]
+                windows.append([all_runs[np.min([np.max([0,ind+window]),n_runs-1])] for window in range(-N_ws_bkg//2+1,N_ws_bkg//2+1)])
+
+        prefetcher = RunPrefetcher(lambda r, ws: load_bank(r, b, ws, instrument, ipts, detector_calibration, mask_file, k_min, k_max, k_step),
+                                   load_order(windows), lambda r: '{}_{}'.format(instrument,r), prefetch_lookahead, prefetch_memory)
+
+        for r, runs_to_merge in zip(runs, windows):
 
             for run_to_merge in runs_to_merge:
 
                 if not mtd.doesExist('{}_{}'.format(instrument,run_to_merge)):
 
-                    LoadEventNexus(Filename='/SNS/{}/IPTS-{}/nexus/{}_{}.nxs.h5'.format(instrument,ipts,instrument,run_to_merge),
-                                   OutputWorkspace='{}_{}'.format(instrument,run_to_merge),
-                                   BankName='bank{}'.format(b),
-                                   SingleBankPixelsOnly=True,
-                                   LoadMonitors=False,
-                                   LoadLogs=False)
-
-                    if mtd.doesExist('tube_table'):
-                        ApplyCalibration(Workspace='{}_{}'.format(instrument,run_to_merge), CalibrationTable='tube_table')
-
-                    if detector_calibration is not None:
-                        ext = os.path.splitext(detector_calibration)[1]
-                        if ext == '.xml':
-                            LoadParameterFile(Workspace='{}_{}'.format(instrument,run_to_merge),
-                                              Filename=os.path.join(calibration_directory, detector_calibration))
-                        else:
-                            LoadIsawDetCal(InputWorkspace='{}_{}'.format(instrument,run_to_merge),
-                                           Filename=os.path.join(calibration_directory, detector_calibration))
-
-                    if mask_file is not None:
-                        MaskDetectors(Workspace='{}_{}'.format(instrument,run_to_merge), MaskedWorkspace='mask')
-
-                    ConvertUnits(InputWorkspace='{}_{}'.format(instrument,run_to_merge), 
-                                 OutputWorkspace='{}_{}'.format(instrument,run_to_merge),
-                                 Target='Momentum')
-
-                    Rebin(InputWorkspace='{}_{}'.format(instrument,run_to_merge),
-                          OutputWorkspace='{}_{}'.format(instrument,run_to_merge),
-                          Params='{},{},{}'.format(k_min,k_step,k_max),
-                          PreserveEvents=True)
+                    prefetcher.load(run_to_merge)
 
             ws_ev = GroupWorkspaces(InputWorkspaces=','.join(['{}_{}'.format(instrument,run_to_merge) for run_to_merge in runs_to_merge]))
 
@@ -172,6 +215,11 @@ def background(runs, proc, all_banks, all_runs, outname, outdir, dbgdir, tube_ca
             DeleteWorkspace('ws_bkg')
             DeleteWorkspace('{}_{}'.format(instrument,runs_to_merge[0]))
 
+        prefetcher.shutdown()
+
+        if prefetch_lookahead > 0:
+            prefetcher.write_report(os.path.join(dbgdir, '{}_prefetch_p{}_bank{}.txt'.format(instrument,proc,b)))
+
         DeleteWorkspace('ws_ev')
 
 def merge(runs, banks):
@@ -285,6 +333,19 @@ if __name__ == '__main__':
 
     DeleteWorkspace(instrument)
 
+    group_banks = all_banks
+
+    if run_index is not None:
+
+        filenames = ['/SNS/{}/IPTS-{}/nexus/{}_{}.nxs.h5'.format(instrument,ipts,instrument,r) for r in run_nos]
+
+        with multiprocessing.get_context('spawn').Pool(processes=n_proc) as pool:
+            pool.map(run_index.get, filenames)
+            pool.close()
+            pool.join()
+
+        all_banks = [b for b in all_banks if np.any([len(run_index.banks(filename, [b])) > 0 for filename in filenames])]
+
     args = [all_banks, run_nos, outname, outdir, dbgdir, tube_calibration, detector_calibration, mask_file, instrument, ipts, banks, det_size, N_ws_bkg, cols, rows, k_min, k_max, k_step]
 
     split_runs = [split.tolist() for split in np.array_split(run_nos, n_proc)]
@@ -315,6 +376,6 @@ if __name__ == '__main__':
         pool.close()
         pool.join()
 
-    for i, bank in enumerate(all_banks):
+    for i, bank in enumerate(group_banks):
 
          os.remove(os.path.join(dbgdir,'{}_group_bank_{}_{}x{}.xml'.format(instrument,bank,rows,cols)))
\ No newline at end of file
@@ -0,0 +1,24 @@
+from mantid.geometry import CrystalStructure
+
+import time
+
+from peak import PeakDictionary
+
+def fit_model(model, lattice, structure, material, families, schur=False):
+
+    start = time.time()
+
+    peak_dictionary = PeakDictionary(*lattice)
+
+    constants, hm, atoms = structure
+
+    peak_dictionary.hm = hm
+    peak_dictionary.cs = CrystalStructure(constants, hm, atoms)
+
+    peak_dictionary.set_material_info(*material)
+
+    r, g, s, U, mu, phi, a, b, c, e, chi_sq = peak_dictionary.fit_extinction(model, schur, families)
+
+    R1, wR2 = peak_dictionary.extinction_agreement(r, g, s, U, mu, phi, a, b, c, e, model, families)
+
+    return r, g, s, U, mu, phi, a, b, c, e, chi_sq, R1, wR2, time.time()-start
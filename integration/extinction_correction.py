@@ -5,7 +5,9 @@ import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 from itertools import cycle
 
-import sys, os, re
+import sys, os, re, time
+
+import multiprocess as multiprocessing
 
 directory = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(directory)
@@ -16,9 +18,11 @@ sys.path.append(directory)
 import parameters
 
 import peak
+import extinction
 import imp
 
 imp.reload(peak)
+imp.reload(extinction)
 
 from peak import PeakDictionary, PeakStatistics
 
@@ -32,351 +36,412 @@ _, filename, *ub_twin_list =  sys.argv
 
 #filename = '/SNS/CORELLI/IPTS-23019/shared/Yb3Al5O12/Yb3Al5O12_v0725_split_crop.inp'
 
-CreateSampleWorkspace(OutputWorkspace='sample')
+if __name__ == '__main__':
+
+    CreateSampleWorkspace(OutputWorkspace='sample')
 
-dictionary = parameters.load_input_file(filename)
+    dictionary = parameters.load_input_file(filename)
 
-a = dictionary['a']
-b = dictionary['b']
-c = dictionary['c']
-alpha = dictionary['alpha']
-beta = dictionary['beta']
-gamma = dictionary['gamma']
+    a = dictionary['a']
+    b = dictionary['b']
+    c = dictionary['c']
+    alpha = dictionary['alpha']
+    beta = dictionary['beta']
+    gamma = dictionary['gamma']
 
-adaptive_scale = dictionary.get('adaptive-scale')
-scale_factor = dictionary.get('scale-factor')
+    adaptive_scale = dictionary.get('adaptive-scale')
+    scale_factor = dictionary.get('scale-factor')
 
-if scale_factor is None:
-    scale_factor = 1
+    if scale_factor is None:
+        scale_factor = 1
 
-group = dictionary['group']
+    group = dictionary['group']
 
-pgs = [pg.replace(' ', '') for pg in PointGroupFactory.getAllPointGroupSymbols()]
-sgs = [sg.replace(' ', '') for sg in SpaceGroupFactory.getAllSpaceGroupSymbols()]
+    pgs = [pg.replace(' ', '') for pg in PointGroupFactory.getAllPointGroupSymbols()]
+    sgs = [sg.replace(' ', '') for sg in SpaceGroupFactory.getAllSpaceGroupSymbols()]
 
-sg = None
-pg = None
+    sg = None
+    pg = None
 
-if type(group) is int:
-    sg = SpaceGroupFactory.subscribedSpaceGroupSymbols(group)[0]
-elif group in pgs:
-    pg = PointGroupFactory.createPointGroup(PointGroupFactory.getAllPointGroupSymbols()[pgs.index(group)]).getPointGroup().getHMSymbol()
-elif group in sgs:
-    sg = SpaceGroupFactory.createSpaceGroup(SpaceGroupFactory.getAllSpaceGroupSymbols()[sgs.index(group)]).getHMSymbol()
+    if type(group) is int:
+        sg = SpaceGroupFactory.subscribedSpaceGroupSymbols(group)[0]
+    elif group in pgs:
+        pg = PointGroupFactory.createPointGroup(PointGroupFactory.getAllPointGroupSymbols()[pgs.index(group)]).getPointGroup().getHMSymbol()
+    elif group in sgs:
+        sg = SpaceGroupFactory.createSpaceGroup(SpaceGroupFactory.getAllSpaceGroupSymbols()[sgs.index(group)]).getHMSymbol()
 
-if sg is not None:
-    pg = PointGroupFactory.createPointGroupFromSpaceGroup(SpaceGroupFactory.createSpaceGroup(sg))
+    if sg is not None:
+        pg = PointGroupFactory.createPointGroupFromSpaceGroup(SpaceGroupFactory.createSpaceGroup(sg))
 
-if dictionary.get('chemical-formula') is not None:
-    chemical_formula = ''.join([' '+item if item.isalpha() else item for item in re.findall(r'[A-Za-z]+|\d+', dictionary['chemical-formula'])]).lstrip(' ')
-else:
-    chemical_formula = None
+    if dictionary.get('chemical-formula') is not None:
+        chemical_formula = ''.join([' '+item if item.isalpha() else item for item in re.findall(r'[A-Za-z]+|\d+', dictionary['chemical-formula'])]).lstrip(' ')
+    else:
+        chemical_formula = None
 
-z_parameter = dictionary['z-parameter']
-sample_mass = dictionary['sample-mass']
-vanadium_mass = dictionary.get('vanadium-mass')
+    z_parameter = dictionary['z-parameter']
+    sample_mass = dictionary['sample-mass']
+    vanadium_mass = dictionary.get('vanadium-mass')
 
-if vanadium_mass is None:
-    vanadium_mass = 0
+    if vanadium_mass is None:
+        vanadium_mass = 0
 
-facility, instrument = parameters.set_instrument(dictionary['instrument'])
-ipts = dictionary['ipts']
+    facility, instrument = parameters.set_instrument(dictionary['instrument'])
+    ipts = dictionary['ipts']
 
-working_directory = '/{}/{}/IPTS-{}/shared/'.format(facility,instrument,ipts)
-shared_directory = '/{}/{}/shared/'.format(facility,instrument)
+    working_directory = '/{}/{}/IPTS-{}/shared/'.format(facility,instrument,ipts)
+    shared_directory = '/{}/{}/shared/'.format(facility,instrument)
 
-if dictionary['ub-file'] is not None:
-    ub_file = os.path.join(working_directory, dictionary['ub-file'])
-    if '*' in ub_file:
-        ub_file = [ub_file.replace('*', str(run)) for run in run_nos]
-else:
-    ub_file = None
+    if dictionary['ub-file'] is not None:
+        ub_file = os.path.join(working_directory, dictionary['ub-file'])
+        if '*' in ub_file:
+            ub_file = [ub_file.replace('*', str(run)) for run in run_nos]
+    else:
+        ub_file = None
 
-directory = os.path.dirname(os.path.abspath(filename))
-outname = dictionary['name']
+    directory = os.path.dirname(os.path.abspath(filename))
+    outname = dictionary['name']
 
-outdir = os.path.join(directory, outname)
-dbgdir = os.path.join(outdir, 'debug')
+    outdir = os.path.join(directory, outname)
+    dbgdir = os.path.join(outdir, 'debug')
 
-mod_vector_1 = dictionary['modulation-vector-1']
-mod_vector_2 = dictionary['modulation-vector-2']
-mod_vector_3 = dictionary['modulation-vector-3']
-max_order = dictionary['max-order']
-cross_terms = dictionary['cross-terms']
+    mod_vector_1 = dictionary['modulation-vector-1']
+    mod_vector_2 = dictionary['modulation-vector-2']
+    mod_vector_3 = dictionary['modulation-vector-3']
+    max_order = dictionary['max-order']
+    cross_terms = dictionary['cross-terms']
 
-if not all([a,b,c,alpha,beta,gamma]):
-    if ub_file is not None:
-        if type(ub_file) is list:
-            LoadIsawUB(InputWorkspace='sample', Filename=ub_file[0])
-        else:
-            LoadIsawUB(InputWorkspace='sample', Filename=ub_file)
-        a = mtd['sample'].sample().getOrientedLattice().a()
-        b = mtd['sample'].sample().getOrientedLattice().b()
-        c = mtd['sample'].sample().getOrientedLattice().c()
-        alpha = mtd['sample'].sample().getOrientedLattice().alpha()
-        beta = mtd['sample'].sample().getOrientedLattice().beta()
-        gamma = mtd['sample'].sample().getOrientedLattice().gamma()
+    if not all([a,b,c,alpha,beta,gamma]):
+        if ub_file is not None:
+            if type(ub_file) is list:
+                LoadIsawUB(InputWorkspace='sample', Filename=ub_file[0])
+            else:
+                LoadIsawUB(InputWorkspace='sample', Filename=ub_file)
+            a = mtd['sample'].sample().getOrientedLattice().a()
+            b = mtd['sample'].sample().getOrientedLattice().b()
+            c = mtd['sample'].sample().getOrientedLattice().c()
+            alpha = mtd['sample'].sample().getOrientedLattice().alpha()
+            beta = mtd['sample'].sample().getOrientedLattice().beta()
+            gamma = mtd['sample'].sample().getOrientedLattice().gamma()
 
-scale_constant = 1e+4
+    scale_constant = 1e+4
 
-scale = np.loadtxt(os.path.join(outdir, 'scale.txt'))
+    scale = np.loadtxt(os.path.join(outdir, 'scale.txt'))
 
-cif_file = dictionary.get('cif-file')
+    cif_file = dictionary.get('cif-file')
 
-peak_dictionary = PeakDictionary(a, b, c, alpha, beta, gamma)
+    schur_extinction = dictionary.get('schur-extinction')
 
-if cif_file is not None:
-    peak_dictionary.load_cif(os.path.join(working_directory, cif_file))
+    if schur_extinction is None:
+        schur_extinction = False
 
-peak_dictionary.set_satellite_info(mod_vector_1, mod_vector_2, mod_vector_3, max_order)
-peak_dictionary.set_material_info(chemical_formula, z_parameter, sample_mass)
-peak_dictionary.set_scale_constant(scale_constant)
+    extinction_processes = dictionary.get('extinction-processes')
 
-peak_dictionary.load(os.path.join(outdir, outname+'.pkl'))
-#peak_dictionary.load(os.path.join(outdir, outname+'_corr.pkl'))
+    if extinction_processes is None:
+        extinction_processes = 1
 
-LoadIsawUB(InputWorkspace='cws', Filename=os.path.join(outdir, outname+'_cal.mat'))
+    peak_dictionary = PeakDictionary(a, b, c, alpha, beta, gamma)
 
-peak_dictionary.recalculate_hkl()
+    if cif_file is not None:
+        peak_dictionary.load_cif(os.path.join(working_directory, cif_file))
 
-ub_twin_list = [os.path.join(directory, ub_twin) for ub_twin in ub_twin_list]
+    peak_dictionary.set_satellite_info(mod_vector_1, mod_vector_2, mod_vector_3, max_order)
+    peak_dictionary.set_material_info(chemical_formula, z_parameter, sample_mass)
+    peak_dictionary.set_scale_constant(scale_constant)
 
-for i, ub_twin in enumerate(ub_twin_list):
-    CloneWorkspace(InputWorkspace='iws', OutputWorkspace='iws{}'.format(i))
-    LoadIsawUB(InputWorkspace='iws{}'.format(i), Filename=ub_twin)
-    IndexPeaks(PeaksWorkspace='iws{}'.format(i), Tolerance=0.12)
+    peak_dictionary.load(os.path.join(outdir, outname+'.pkl'))
+    #peak_dictionary.load(os.path.join(outdir, outname+'_corr.pkl'))
 
-for pn in range(mtd['iws'].getNumberPeaks()-1,-1,-1):
+    LoadIsawUB(InputWorkspace='cws', Filename=os.path.join(outdir, outname+'_cal.mat'))
 
-    pk = mtd['iws'].getPeak(pn)
+    peak_dictionary.recalculate_hkl()
 
-    h, k, l = pk.getIntHKL()
-    m, n, p = pk.getIntMNP()
+    ub_twin_list = [os.path.join(directory, ub_twin) for ub_twin in ub_twin_list]
 
     for i, ub_twin in enumerate(ub_twin_list):
-        pk_twin = mtd['iws{}'.format(i)].getPeak(pn)
-        H, K, L = pk_twin.getHKL()
-        if not np.allclose([H,K,L],0):
-            h, k, l = 0, 0, 0
-            m, n, p = 0, 0, 0
+        CloneWorkspace(InputWorkspace='iws', OutputWorkspace='iws{}'.format(i))
+        LoadIsawUB(InputWorkspace='iws{}'.format(i), Filename=ub_twin)
+        IndexPeaks(PeaksWorkspace='iws{}'.format(i), Tolerance=0.12)
+
+    for pn in range(mtd['iws'].getNumberPeaks()-1,-1,-1):
+
+        pk = mtd['iws'].getPeak(pn)
+
+        h, k, l = pk.getIntHKL()
+        m, n, p = pk.getIntMNP()
+
+        for i, ub_twin in enumerate(ub_twin_list):
+            pk_twin = mtd['iws{}'.format(i)].getPeak(pn)
+            H, K, L = pk_twin.getHKL()
+            if not np.allclose([H,K,L],0):
+                h, k, l = 0, 0, 0
+                m, n, p = 0, 0, 0
+
+        dh, dk, dl = (m*np.array(mod_vector_1)+n*np.array(mod_vector_2)+p*np.array(mod_vector_3)).astype(float)
+
+        pk.setHKL(h+dh,k+dk,l+dl)
+        pk.setIntHKL(V3D(h,k,l))
+        pk.setIntMNP(V3D(m,n,p))
+
+    for pn in range(mtd['iws'].getNumberPeaks()-1,-1,-1):
+
+        pk = mtd['iws'].getPeak(pn)
+
+        h, k, l = pk.getIntHKL()
+        m, n, p = pk.getIntMNP()
+
+        if (np.array([h,k,l,m,n,p]) == 0).all():
+            mtd['iws'].removePeak(pn)
+
+    # peak_dictionary.clear_peaks()
+    # peak_dictionary.repopulate_workspaces()
+    # peak_dictionary.recalculate_hkl()
+
+    for key in peak_dictionary.peak_dict.keys():
+
+        peaks = peak_dictionary.peak_dict.get(key)
+
+        h, k, l, m, n, p = key
+
+        for peak in peaks:
+
+            scale = peak.get_ext_scale()
+
+            if len(scale) > 0:
+
+                scale *= 0
+                scale += 1
+
+                peak.set_ext_scale(scale)
+
+    models = ['primary', 'secondary, gaussian', 'secondary, lorentzian',
+              'secondary, gaussian type I', 'secondary, gaussian type II', 
+              'secondary, lorentzian type I', 'secondary, lorentzian type II']
 
-    dh, dk, dl = (m*np.array(mod_vector_1)+n*np.array(mod_vector_2)+p*np.array(mod_vector_3)).astype(float)
+    models = ['secondary, gaussian type I', 'secondary, gaussian type II', 
+              'secondary, lorentzian type I', 'secondary, lorentzian type II']
 
-    pk.setHKL(h+dh,k+dk,l+dl)
-    pk.setIntHKL(V3D(h,k,l))
-    pk.setIntMNP(V3D(m,n,p))
+    models = ['secondary, gaussian', 'secondary, lorentzian']
 
-for pn in range(mtd['iws'].getNumberPeaks()-1,-1,-1):
+    families = peak_dictionary.peak_families()
 
-    pk = mtd['iws'].getPeak(pn)
+    if extinction_processes > 1:
 
-    h, k, l = pk.getIntHKL()
-    m, n, p = pk.getIntMNP()
+        ol = peak_dictionary.iws.sample().getOrientedLattice()
 
-    if (np.array([h,k,l,m,n,p]) == 0).all():
-        mtd['iws'].removePeak(pn)
+        lattice = ol.a(), ol.b(), ol.c(), ol.alpha(), ol.beta(), ol.gamma()
 
-# peak_dictionary.clear_peaks()
-# peak_dictionary.repopulate_workspaces()
-# peak_dictionary.recalculate_hkl()
+        uc = peak_dictionary.cs.getUnitCell()
 
-for key in peak_dictionary.peak_dict.keys():
-
-    peaks = peak_dictionary.peak_dict.get(key)
+        constants = '{} {} {} {} {} {}'.format(uc.a(),uc.b(),uc.c(),uc.alpha(),uc.beta(),uc.gamma())
+        atoms = '; '.join(list(peak_dictionary.cs.getScatterers()))
 
-    h, k, l, m, n, p = key
+        structure = constants, peak_dictionary.hm, atoms
+        material = peak_dictionary.chemical_formula, peak_dictionary.z_parameter, peak_dictionary.sample_mass
 
-    for peak in peaks:
+        screen_args = [(model, lattice, structure, material, families, schur_extinction) for model in models]
 
-        scale = peak.get_ext_scale()
+        n_proc = min([extinction_processes, len(models), os.cpu_count()])
 
-        if len(scale) > 0:
+        multiprocessing.set_start_method('spawn', force=True)
+        with multiprocessing.get_context('spawn').Pool(processes=n_proc) as pool:
+            results = pool.starmap(extinction.fit_model, screen_args)
+            pool.close()
+            pool.join()
 
-            scale *= 0
-            scale += 1
+    else:
 
-            peak.set_ext_scale(scale)
+        results = []
 
-models = ['primary', 'secondary, gaussian', 'secondary, lorentzian',
-          'secondary, gaussian type I', 'secondary, gaussian type II', 
-          'secondary, lorentzian type I', 'secondary, lorentzian type II']
+        for model in models:
 
-models = ['secondary, gaussian type I', 'secondary, gaussian type II', 
-          'secondary, lorentzian type I', 'secondary, lorentzian type II']
+            start = time.time()
 
-models = ['secondary, gaussian', 'secondary, lorentzian']
+            r, g, scale, U, omega, phi, a, b, c, e, chi_sq = peak_dictionary.fit_extinction(model, schur_extinction, families)
 
-rs, gs, Us, scales, omegas, phis, As, Bs, Cs, Es, chi_sqs = [], [], [], [], [], [], [], [], [], [], []
+            R1, wR2 = peak_dictionary.extinction_agreement(r, g, scale, U, omega, phi, a, b, c, e, model, families)
 
-ext_file = open(os.path.join(outdir, 'extinction.txt'), 'w')
+            results.append((r, g, scale, U, omega, phi, a, b, c, e, chi_sq, R1, wR2, time.time()-start))
 
-for model in models:
+    rs, gs, Us, scales, omegas, phis, As, Bs, Cs, Es, chi_sqs = [], [], [], [], [], [], [], [], [], [], []
 
-    r, g, scale, U, omega, phi, a, b, c, e, chi_sq = peak_dictionary.fit_extinction(model)
+    ext_file = open(os.path.join(outdir, 'extinction.txt'), 'w')
 
-    ext_file.write('model: {}\n'.format(model))
+    cmp_file = open(os.path.join(outdir, 'extinction_models.txt'), 'w')
+    cmp_file.write('{:40}{:>12}{:>10}{:>10}{:>10}\n'.format('model', 'chi^2', 'R1', 'wR2', 'time [s]'))
 
-    if r[0] > 0:
-        ext_file.write('crystallite size ')
-        for i in range(0,3):
-            ext_file.write('r{}: {:.4f} '.format(i+1,np.sqrt(1/r[i])/10000))
-        ext_file.write('micron\n')
-        ext_file.write('crystallite orientation ')
-        for i in range(3,6):
-            ext_file.write('p{}: {:.4f} '.format(i-2,np.rad2deg(r[i])))
-        ext_file.write('deg\n')
-    if g[0] > 0:
-        ext_file.write('mosaic parameter ')
-        for i in range(0,3):
-            ext_file.write('g{}: {:.4f} '.format(i+1,np.sqrt(1/g[i])))
-        ext_file.write('\n')
-        ext_file.write('mosaic orientation ')
-        for i in range(3,6):
-            ext_file.write('t{}: {:.4f} '.format(i-2,np.rad2deg(g[i])))
-        ext_file.write('deg\n')
+    for model, result in zip(models, results):
 
-#         if 'gaussian' in model:
-#             sig = np.rad2deg(1/(2*np.sqrt(np.pi)*g[i]))
-#             ext_file.write('mosaic angle s{}: {:.4f} deg\n'.format(i+1,sig))
-#         if 'lorentzian' in model:
-#             eta = np.rad2deg(1/(2*np.pi*g[i]))
-#             ext_file.write('mosaic angle e{}: {:.4f} deg\n'.format(i+1,eta))
+        r, g, scale, U, omega, phi, a, b, c, e, chi_sq, R1, wR2, wall_time = result
 
-    ext_file.write('Uiso: {:.4e} \n'.format(U))
-    ext_file.write('scale: {:.4e} \n'.format(scale))
-    ext_file.write('goniometer offset: {:.4f} deg \n'.format(np.rad2deg(omega)))
-    ext_file.write('sample offset: {:.4f} deg \n'.format(np.rad2deg(phi)))
-    ext_file.write('wavelength sensitivity: {:.4f} \n'.format(a))
-    ext_file.write('offcentering mean parameter: {:.4f} \n'.format(b))
-    ext_file.write('offcentering effective radius: {:.4f} \n'.format(c))
-    ext_file.write('eccentricity: {:.4f} \n'.format(e))
-    ext_file.write('chi^2: {:.4e} \n\n'.format(chi_sq))
+        cmp_file.write('{:40}{:12.4e}{:10.4f}{:10.4f}{:10.1f}\n'.format(model, chi_sq, R1, wR2, wall_time))
 
-    rs.append(r)
-    gs.append(g)
-    Us.append(U)
-    scales.append(scale)
-    omegas.append(omega)
-    phis.append(phi)
-    As.append(a)
-    Bs.append(b)
-    Cs.append(c)
-    Es.append(e)
-    chi_sqs.append(chi_sq)
+        ext_file.write('model: {}\n'.format(model))
 
-i = np.argmin(chi_sqs)
-model = models[i]
+        if r[0] > 0:
+            ext_file.write('crystallite size ')
+            for i in range(0,3):
+                ext_file.write('r{}: {:.4f} '.format(i+1,np.sqrt(1/r[i])/10000))
+            ext_file.write('micron\n')
+            ext_file.write('crystallite orientation ')
+            for i in range(3,6):
+                ext_file.write('p{}: {:.4f} '.format(i-2,np.rad2deg(r[i])))
+            ext_file.write('deg\n')
+        if g[0] > 0:
+            ext_file.write('mosaic parameter ')
+            for i in range(0,3):
+                ext_file.write('g{}: {:.4f} '.format(i+1,np.sqrt(1/g[i])))
+            ext_file.write('\n')
+            ext_file.write('mosaic orientation ')
+            for i in range(3,6):
+                ext_file.write('t{}: {:.4f} '.format(i-2,np.rad2deg(g[i])))
+            ext_file.write('deg\n')
 
-r, g = rs[i], gs[i]
+    #         if 'gaussian' in model:
+    #             sig = np.rad2deg(1/(2*np.sqrt(np.pi)*g[i]))
+    #             ext_file.write('mosaic angle s{}: {:.4f} deg\n'.format(i+1,sig))
+    #         if 'lorentzian' in model:
+    #             eta = np.rad2deg(1/(2*np.pi*g[i]))
+    #             ext_file.write('mosaic angle e{}: {:.4f} deg\n'.format(i+1,eta))
 
-message = ''
-lamda = 1 # Ang
- 
-# if 'secondary' in model and 'type' not in model:
-#     if g/(r/lamda) < 0.001:
-#         model += ' type I'
-#         message = 'r >> lambda g'
-#     elif (r/lamda)/g < 0.001:
-#         model += ' type II'
-#         message = 'r << lambda g'
+        ext_file.write('Uiso: {:.4e} \n'.format(U))
+        ext_file.write('scale: {:.4e} \n'.format(scale))
+        ext_file.write('goniometer offset: {:.4f} deg \n'.format(np.rad2deg(omega)))
+        ext_file.write('sample offset: {:.4f} deg \n'.format(np.rad2deg(phi)))
+        ext_file.write('wavelength sensitivity: {:.4f} \n'.format(a))
+        ext_file.write('offcentering mean parameter: {:.4f} \n'.format(b))
+        ext_file.write('offcentering effective radius: {:.4f} \n'.format(c))
+        ext_file.write('eccentricity: {:.4f} \n'.format(e))
+        ext_file.write('chi^2: {:.4e} \n\n'.format(chi_sq))
 
-ext_file.write('model: {} {}'.format(model,message))
-ext_file.close()
+        rs.append(r)
+        gs.append(g)
+        Us.append(U)
+        scales.append(scale)
+        omegas.append(omega)
+        phis.append(phi)
+        As.append(a)
+        Bs.append(b)
+        Cs.append(c)
+        Es.append(e)
+        chi_sqs.append(chi_sq)
 
-i = models.index(model)
+    cmp_file.close()
 
-r, g, s, U = rs[i], gs[i], scales[i], Us[i]
+    with PdfPages(os.path.join(outdir, 'extinction_models.pdf')) as pdf:
 
-uc = peak_dictionary.cs.getUnitCell()
+        for j, model in enumerate(models):
 
-a, b, c, alpha, beta, gamma = uc.a(), uc.b(), uc.c(), uc.alpha(), uc.beta(), uc.gamma()
+            X, Y, I, E, HKL, d_spacing = peak_dictionary.extinction_curves(rs[j], gs[j], scales[j], omegas[j], phis[j],
+                                                                           As[j], Bs[j], Cs[j], Es[j], model, Us[j], families)
+
+            fig, ax = plt.subplots(1, 1, num=2)
+
+            for k, (x, y, i, err) in enumerate(zip(X, Y, I, E)):
+
+                sort = np.argsort(x)
+
+                ax.errorbar(x[sort], i[sort], yerr=err[sort], linestyle='none', marker='o', color='C{}'.format(k%9))
+                ax.plot(x[sort], y[sort], linestyle='--', color='k', zorder=100)
+
+            ax.set_title('{}, $\chi^2$ = {:.4f}'.format(model, chi_sqs[j]))
+            ax.minorticks_on()
+            ax.set_xlabel(r'$x$')
+            ax.set_ylabel(r'$I$ [arb. unit]')
 
-constants = '{} {} {} {} {} {}'.format(a,b,c,alpha,beta,gamma)
+            pdf.savefig()
+            plt.close()
 
-scatterers = peak_dictionary.cs.getScatterers()
+    i = np.argmin(chi_sqs)
+    model = models[i]
 
-atoms = []
-for j, scatterer in enumerate(scatterers):
-    elm, x, y, z, occ, _ = scatterer.split(' ')
-    atoms.append(' '.join([elm,x,y,z,occ,str(U)]))
+    r, g = rs[i], gs[i]
 
-atoms = '; '.join(atoms)
+    message = ''
+    lamda = 1 # Ang
 
-peak_dictionary.cs = CrystalStructure(constants, peak_dictionary.hm, atoms)
+    # if 'secondary' in model and 'type' not in model:
+    #     if g/(r/lamda) < 0.001:
+    #         model += ' type I'
+    #         message = 'r >> lambda g'
+    #     elif (r/lamda)/g < 0.001:
+    #         model += ' type II'
+    #         message = 'r << lambda g'
 
-mu, phi, a, b, c, e = omegas[i], phis[i], As[i], Bs[i], Cs[i], Es[i]
+    ext_file.write('model: {} {}'.format(model,message))
+    ext_file.close()
 
-X, Y, I, E, HKL, d_spacing = peak_dictionary.extinction_curves(r, g, s, mu, phi, a, b, c, e, model)
+    i = models.index(model)
 
-with PdfPages(os.path.join(outdir, 'extinction.pdf')) as pdf:
+    r, g, s, U = rs[i], gs[i], scales[i], Us[i]
 
-    # fam_file = open(os.path.join(outdir, 'extinction_families.txt'), 'w')
+    uc = peak_dictionary.cs.getUnitCell()
 
-    marker = ['o', 's', '<']
-    markers = cycle(marker)
+    a, b, c, alpha, beta, gamma = uc.a(), uc.b(), uc.c(), uc.alpha(), uc.beta(), uc.gamma()
 
-    fig, ax = plt.subplots(1, 1, num=2)
+    constants = '{} {} {} {} {} {}'.format(a,b,c,alpha,beta,gamma)
 
-    for j, (x, y, i, err, hkl, d) in enumerate(zip(X, Y, I, E, HKL, d_spacing)):
+    scatterers = peak_dictionary.cs.getScatterers()
 
-        mark = next(markers)
-        sort = np.argsort(x)
+    atoms = []
+    for j, scatterer in enumerate(scatterers):
+        elm, x, y, z, occ, _ = scatterer.split(' ')
+        atoms.append(' '.join([elm,x,y,z,occ,str(U)]))
 
-        ax.errorbar(x[sort], i[sort], yerr=err[sort], linestyle='none', marker=mark, color='C{}'.format(j%9), label='({},{},{})'.format(*hkl[0]))
-        ax.plot(x[sort], y[sort], linestyle='--', color='k', zorder=100)
+    atoms = '; '.join(atoms)
 
-        # for factor, intensity, error, fit in zip(x[sort],i[sort],err[sort],y[sort]):
-        #
-        #    fam_file.write('{},{},{},{},{},{},{}\n'.format(*hkl,factor,intensity,error,fit))
+    peak_dictionary.cs = CrystalStructure(constants, peak_dictionary.hm, atoms)
 
-    # fam_file.close()
+    mu, phi, a, b, c, e = omegas[i], phis[i], As[i], Bs[i], Cs[i], Es[i]
 
-    ax.legend()
-    ax.set_yscale('linear')
-    ax.set_xlabel(r'$x$') #
-    ax.set_ylabel(r'$I$ [arb. unit]')
+    X, Y, I, E, HKL, d_spacing = peak_dictionary.extinction_curves(r, g, s, mu, phi, a, b, c, e, model, U, families)
 
-    xlim = ax.get_xlim()
-    ylim = ax.get_ylim()
+    with PdfPages(os.path.join(outdir, 'extinction.pdf')) as pdf:
 
-    #pdf.savefig()
-    #plt.close()
+        # fam_file = open(os.path.join(outdir, 'extinction_families.txt'), 'w')
 
-    marker = ['o', 's', '<']
-    markers = cycle(marker)
+        marker = ['o', 's', '<']
+        markers = cycle(marker)
 
-    for j, (x, y, i, err, hkl, d) in enumerate(zip(X, Y, I, E, HKL, d_spacing)):
+        fig, ax = plt.subplots(1, 1, num=2)
 
-        families = np.unique(hkl, axis=0)
+        for j, (x, y, i, err, hkl, d) in enumerate(zip(X, Y, I, E, HKL, d_spacing)):
 
-        mark = next(markers)
-        sort = np.argsort(x)
+            mark = next(markers)
+            sort = np.argsort(x)
 
-        fig, ax = plt.subplots(1, 1, num=3)
+            ax.errorbar(x[sort], i[sort], yerr=err[sort], linestyle='none', marker=mark, color='C{}'.format(j%9), label='({},{},{})'.format(*hkl[0]))
+            ax.plot(x[sort], y[sort], linestyle='--', color='k', zorder=100)
 
-        ax.errorbar(x[sort], i[sort], yerr=err[sort], linestyle='none', marker=mark, color='C{}'.format(j%9), label='({},{},{})'.format(*hkl[0]))
+            # for factor, intensity, error, fit in zip(x[sort],i[sort],err[sort],y[sort]):
+            #
+            #    fam_file.write('{},{},{},{},{},{},{}\n'.format(*hkl,factor,intensity,error,fit))
 
-        ax.plot(x[sort], y[sort], linestyle='--', color='k', zorder=100)
-        ax.set_title('d = {:.4} \u212B'.format(d))
+        # fam_file.close()
 
         ax.legend()
-        ax.minorticks_on()
         ax.set_yscale('linear')
-        ax.set_xlim(xlim)
-        ax.set_ylim(ylim)
         ax.set_xlabel(r'$x$') #
         ax.set_ylabel(r'$I$ [arb. unit]')
 
-        pdf.savefig()
-        plt.close()
+        xlim = ax.get_xlim()
+        ylim = ax.get_ylim()
 
-        for fam in families:
+        #pdf.savefig()
+        #plt.close()
 
-            fig, ax = plt.subplots(1, 1, num=3)
+        marker = ['o', 's', '<']
+        markers = cycle(marker)
 
-            mask = (np.array(hkl) == np.array(fam)).all(axis=1)
+        for j, (x, y, i, err, hkl, d) in enumerate(zip(X, Y, I, E, HKL, d_spacing)):
+
+            families = np.unique(hkl, axis=0)
+
+            mark = next(markers)
+            sort = np.argsort(x)
+
+            fig, ax = plt.subplots(1, 1, num=3)
 
-            ax.errorbar(x[mask], i[mask], yerr=err[mask], linestyle='none', marker=mark, color='C{}'.format(j%9), label='({},{},{})'.format(*fam))
+            ax.errorbar(x[sort], i[sort], yerr=err[sort], linestyle='none', marker=mark, color='C{}'.format(j%9), label='({},{},{})'.format(*hkl[0]))
 
             ax.plot(x[sort], y[sort], linestyle='--', color='k', zorder=100)
             ax.set_title('d = {:.4} \u212B'.format(d))
@@ -392,220 +457,242 @@ with PdfPages(os.path.join(outdir, 'extinction.pdf')) as pdf:
             pdf.savefig()
             plt.close()
 
-# peak_dictionary = PeakDictionary(a, b, c, alpha, beta, gamma)
-# 
-# if cif_file is not None:
-#     peak_dictionary.load_cif(os.path.join(working_directory, cif_file))
-# 
-# peak_dictionary.set_satellite_info(mod_vector_1, mod_vector_2, mod_vector_3, max_order)
-# peak_dictionary.set_material_info(chemical_formula, z_parameter, sample_mass)
-# peak_dictionary.set_scale_constant(scale_constant)
-# peak_dictionary.load(os.path.join(directory, outname+'.pkl'))
+            for fam in families:
 
-peak_dictionary.apply_extinction_correction(r, g, s, mu, phi, a, b, c, e, model=model, fname=os.path.join(outdir, 'extinction.txt'))
+                fig, ax = plt.subplots(1, 1, num=3)
 
-I, E, two_theta, omega, lamda, Tbar, hkl, F2, d_spacing, u_dir, d_dir = peak_dictionary.peak_families()
+                mask = (np.array(hkl) == np.array(fam)).all(axis=1)
 
-fig = plt.figure()
-ax1 = plt.subplot(121)
-ax2 = plt.subplot(122, projection='polar')
+                ax.errorbar(x[mask], i[mask], yerr=err[mask], linestyle='none', marker=mark, color='C{}'.format(j%9), label='({},{},{})'.format(*fam))
 
-x = np.linspace(-180,180,360)
-y = np.deg2rad(x)
+                ax.plot(x[sort], y[sort], linestyle='--', color='k', zorder=100)
+                ax.set_title('d = {:.4} \u212B'.format(d))
 
-wavelength = []
+                ax.legend()
+                ax.minorticks_on()
+                ax.set_yscale('linear')
+                ax.set_xlim(xlim)
+                ax.set_ylim(ylim)
+                ax.set_xlabel(r'$x$') #
+                ax.set_ylabel(r'$I$ [arb. unit]')
 
-for j, (i, err, w, wl) in enumerate(zip(I, E, omega, lamda)):
+                pdf.savefig()
+                plt.close()
 
-    ratios = peak_dictionary.beam_profile(w, wl, mu, phi, a, b, c, e)
+    # peak_dictionary = PeakDictionary(a, b, c, alpha, beta, gamma)
+    # 
+    # if cif_file is not None:
+    #     peak_dictionary.load_cif(os.path.join(working_directory, cif_file))
+    # 
+    # peak_dictionary.set_satellite_info(mod_vector_1, mod_vector_2, mod_vector_3, max_order)
+    # peak_dictionary.set_material_info(chemical_formula, z_parameter, sample_mass)
+    # peak_dictionary.set_scale_constant(scale_constant)
+    # peak_dictionary.load(os.path.join(directory, outname+'.pkl'))
 
-    v = np.rad2deg(w)
+    peak_dictionary.apply_extinction_correction(r, g, s, mu, phi, a, b, c, e, model=model, fname=os.path.join(outdir, 'extinction.txt'))
 
-    s1 = ax1.scatter(v, ratios, c=wl, s=1)
-    s2 = ax2.scatter(w, ratios, c=wl, s=1)
+    I, E, two_theta, omega, lamda, Tbar, hkl, F2, d_spacing, u_dir, d_dir = peak_dictionary.peak_families()
 
-    wavelength += wl.tolist()
+    fig = plt.figure()
+    ax1 = plt.subplot(121)
+    ax2 = plt.subplot(122, projection='polar')
 
-wl_min = np.min(wavelength)
-wl_max = np.max(wavelength)
+    x = np.linspace(-180,180,360)
+    y = np.deg2rad(x)
 
-s1.vmin = wl_min
-s2.vmin = wl_min
+    wavelength = []
 
-s1.vmax = wl_max
-s2.vmax = wl_max
+    for j, (i, err, w, wl) in enumerate(zip(I, E, omega, lamda)):
 
-low = peak_dictionary.beam_profile(y, wl_min, mu, phi, a, b, c, e)
-high = peak_dictionary.beam_profile(y, wl_max, mu, phi, a, b, c, e)
+        ratios = peak_dictionary.beam_profile(w, wl, mu, phi, a, b, c, e)
 
-ax1.plot(x, low, '--', color='r', lw=1)
-ax2.plot(y, low, '--', color='r', lw=1)
+        v = np.rad2deg(w)
 
-ax1.plot(x, high, ':', color='r', lw=1)
-ax2.plot(y, high, ':', color='r', lw=1)
+        s1 = ax1.scatter(v, ratios, c=wl, s=1)
+        s2 = ax2.scatter(w, ratios, c=wl, s=1)
 
-cb1 = fig.colorbar(s1, ax=ax1, orientation='horizontal')
-cb2 = fig.colorbar(s2, ax=ax2, orientation='horizontal')
+        wavelength += wl.tolist()
 
-cb1.ax.set_xlabel('Wavelength [ang.]')
-cb2.ax.set_xlabel('Wavelength [ang.]')
+    wl_min = np.min(wavelength)
+    wl_max = np.max(wavelength)
 
-cb1.ax.minorticks_on()
-cb2.ax.minorticks_on()
+    s1.vmin = wl_min
+    s2.vmin = wl_min
 
-ax1.grid(True)
-ax2.grid(True)
+    s1.vmax = wl_max
+    s2.vmax = wl_max
 
-ax1.minorticks_on()
-ax2.minorticks_on()
+    low = peak_dictionary.beam_profile(y, wl_min, mu, phi, a, b, c, e)
+    high = peak_dictionary.beam_profile(y, wl_max, mu, phi, a, b, c, e)
 
-ax1.set_xlabel('Goniometer angle')
-ax2.set_xlabel('Goniometer angle')
+    ax1.plot(x, low, '--', color='r', lw=1)
+    ax2.plot(y, low, '--', color='r', lw=1)
 
-ax1.set_ylabel('Ratio')
-ax2.set_ylabel('Ratio')
+    ax1.plot(x, high, ':', color='r', lw=1)
+    ax2.plot(y, high, ':', color='r', lw=1)
 
-fig.savefig(os.path.join(outdir, 'wobble.pdf'))
-plt.close()
+    cb1 = fig.colorbar(s1, ax=ax1, orientation='horizontal')
+    cb2 = fig.colorbar(s2, ax=ax2, orientation='horizontal')
 
-m, n, p = 0, 0, 0
+    cb1.ax.set_xlabel('Wavelength [ang.]')
+    cb2.ax.set_xlabel('Wavelength [ang.]')
 
-X, I, E = [], [], []
+    cb1.ax.minorticks_on()
+    cb2.ax.minorticks_on()
 
-for hkl in HKL:
+    ax1.grid(True)
+    ax2.grid(True)
 
-    x, i, err = [], [], []
+    ax1.minorticks_on()
+    ax2.minorticks_on()
 
-    h, k, l = hkl[0]
+    ax1.set_xlabel('Goniometer angle')
+    ax2.set_xlabel('Goniometer angle')
 
-    equivalents = pg.getEquivalents(V3D(h,k,l))[::-1]
+    ax1.set_ylabel('Ratio')
+    ax2.set_ylabel('Ratio')
 
-    for equivalent in equivalents:
+    fig.savefig(os.path.join(outdir, 'wobble.pdf'))
+    plt.close()
 
-        h, k, l = equivalent
+    m, n, p = 0, 0, 0
 
-        h, k, l = int(h), int(k), int(l)
+    X, I, E = [], [], []
 
-        key = h, k, l, m, n, p
+    for hkl in HKL:
 
-        peaks = peak_dictionary.peak_dict.get(key)
-
-        if peaks is not None:
+        x, i, err = [], [], []
 
-            for peak in peaks:
+        h, k, l = hkl[0]
 
-                lamdas = peak.get_wavelengths()
+        equivalents = pg.getEquivalents(V3D(h,k,l))[::-1]
 
-                intens = peak.get_intensity()
-                sig_intens = peak.get_intensity_error()
+        for equivalent in equivalents:
 
-                if len(intens) > 0:
+            h, k, l = equivalent
 
-                    x += lamdas.tolist()
+            h, k, l = int(h), int(k), int(l)
 
-                    i += intens.tolist()
-                    err += sig_intens.tolist()
+            key = h, k, l, m, n, p
 
-    X.append(np.array(x))
-    I.append(np.array(i))
-    E.append(np.array(err))
+            peaks = peak_dictionary.peak_dict.get(key)
 
-with PdfPages(os.path.join(outdir, 'extinction_correction.pdf')) as pdf:
+            if peaks is not None:
 
-    marker = ['o', 's', '<']
-    markers = cycle(marker)
+                for peak in peaks:
 
-    fig, ax = plt.subplots(1, 1, num=4)
+                    lamdas = peak.get_wavelengths()
 
-    for j, (x, i, err, hkl, d) in enumerate(zip(X, I, E, HKL, d_spacing)):
+                    intens = peak.get_intensity()
+                    sig_intens = peak.get_intensity_error()
 
-        mark = next(markers)
-        sort = np.argsort(x)
+                    if len(intens) > 0:
 
-        ax.errorbar(x[sort], i[sort], yerr=err[sort], linestyle='none', marker=mark, color='C{}'.format(j%9), label='({},{},{})'.format(*hkl[0]))
+                        x += lamdas.tolist()
 
-    ax.legend()
-    ax.set_yscale('linear')
-    ax.set_xlabel(r'$\lambda$ [$\AA$]')
-    ax.set_ylabel(r'$I$ [arb. unit]')
+                        i += intens.tolist()
+                        err += sig_intens.tolist()
 
-    xlim = ax.get_xlim()
-    ylim = ax.get_ylim()
+        X.append(np.array(x))
+        I.append(np.array(i))
+        E.append(np.array(err))
 
-    #pdf.savefig()
-    #plt.close()
+    with PdfPages(os.path.join(outdir, 'extinction_correction.pdf')) as pdf:
 
-    marker = ['o', 's', '<']
-    markers = cycle(marker)
+        marker = ['o', 's', '<']
+        markers = cycle(marker)
 
-    # ylim = ylim[0], 10000
+        fig, ax = plt.subplots(1, 1, num=4)
 
-    for j, (x, i, err, hkl, d) in enumerate(zip(X, I, E, HKL, d_spacing)):
+        for j, (x, i, err, hkl, d) in enumerate(zip(X, I, E, HKL, d_spacing)):
 
-        fig, ax = plt.subplots(1, 1, num=5)
+            mark = next(markers)
+            sort = np.argsort(x)
 
-        mark = next(markers)
-        sort = np.argsort(x)
-
-        ax.errorbar(x[sort], i[sort], yerr=err[sort], linestyle='none', marker=mark, color='C{}'.format(j%9), label='({},{},{})'.format(*hkl[0]))
-        ax.set_title('d = {:.4} \u212B'.format(d))
+            ax.errorbar(x[sort], i[sort], yerr=err[sort], linestyle='none', marker=mark, color='C{}'.format(j%9), label='({},{},{})'.format(*hkl[0]))
 
         ax.legend()
-        ax.minorticks_on()
         ax.set_yscale('linear')
-        ax.set_xlim(xlim)
-        ax.set_ylim(ylim)
         ax.set_xlabel(r'$\lambda$ [$\AA$]')
         ax.set_ylabel(r'$I$ [arb. unit]')
 
-        pdf.savefig()
-        plt.close()
+        xlim = ax.get_xlim()
+        ylim = ax.get_ylim()
+
+        #pdf.savefig()
+        #plt.close()
+
+        marker = ['o', 's', '<']
+        markers = cycle(marker)
+
+        # ylim = ylim[0], 10000
+
+        for j, (x, i, err, hkl, d) in enumerate(zip(X, I, E, HKL, d_spacing)):
 
-for i, ub_twin in enumerate(ub_twin_list):
-    CloneWorkspace(InputWorkspace='iws', OutputWorkspace='iws{}'.format(i))
-    LoadIsawUB(InputWorkspace='iws{}'.format(i), Filename=ub_twin)
-    IndexPeaks(PeaksWorkspace='iws{}'.format(i), Tolerance=0.12)
+            fig, ax = plt.subplots(1, 1, num=5)
 
-for pn in range(mtd['iws'].getNumberPeaks()-1,-1,-1):
+            mark = next(markers)
+            sort = np.argsort(x)
 
-    pk = mtd['iws'].getPeak(pn)
+            ax.errorbar(x[sort], i[sort], yerr=err[sort], linestyle='none', marker=mark, color='C{}'.format(j%9), label='({},{},{})'.format(*hkl[0]))
+            ax.set_title('d = {:.4} \u212B'.format(d))
 
-    h, k, l = pk.getIntHKL()
-    m, n, p = pk.getIntMNP()
+            ax.legend()
+            ax.minorticks_on()
+            ax.set_yscale('linear')
+            ax.set_xlim(xlim)
+            ax.set_ylim(ylim)
+            ax.set_xlabel(r'$\lambda$ [$\AA$]')
+            ax.set_ylabel(r'$I$ [arb. unit]')
+
+            pdf.savefig()
+            plt.close()
 
     for i, ub_twin in enumerate(ub_twin_list):
-        pk_twin = mtd['iws{}'.format(i)].getPeak(pn)
-        H, K, L = pk_twin.getHKL()
-        if not np.allclose([H,K,L],0):
-            h, k, l = 0, 0, 0
-            m, n, p = 0, 0, 0
+        CloneWorkspace(InputWorkspace='iws', OutputWorkspace='iws{}'.format(i))
+        LoadIsawUB(InputWorkspace='iws{}'.format(i), Filename=ub_twin)
+        IndexPeaks(PeaksWorkspace='iws{}'.format(i), Tolerance=0.12)
+
+    for pn in range(mtd['iws'].getNumberPeaks()-1,-1,-1):
+
+        pk = mtd['iws'].getPeak(pn)
+
+        h, k, l = pk.getIntHKL()
+        m, n, p = pk.getIntMNP()
+
+        for i, ub_twin in enumerate(ub_twin_list):
+            pk_twin = mtd['iws{}'.format(i)].getPeak(pn)
+            H, K, L = pk_twin.getHKL()
+            if not np.allclose([H,K,L],0):
+                h, k, l = 0, 0, 0
+                m, n, p = 0, 0, 0
+
+        dh, dk, dl = (m*np.array(mod_vector_1)+n*np.array(mod_vector_2)+p*np.array(mod_vector_3)).astype(float)
 
-    dh, dk, dl = (m*np.array(mod_vector_1)+n*np.array(mod_vector_2)+p*np.array(mod_vector_3)).astype(float)
+        pk.setHKL(h+dh,k+dk,l+dl)
+        pk.setIntHKL(V3D(h,k,l))
+        pk.setIntMNP(V3D(m,n,p))
 
-    pk.setHKL(h+dh,k+dk,l+dl)
-    pk.setIntHKL(V3D(h,k,l))
-    pk.setIntMNP(V3D(m,n,p))
+    for pn in range(mtd['iws'].getNumberPeaks()-1,-1,-1):
 
-for pn in range(mtd['iws'].getNumberPeaks()-1,-1,-1):
+        pk = mtd['iws'].getPeak(pn)
 
-    pk = mtd['iws'].getPeak(pn)
+        h, k, l = pk.getIntHKL()
+        m, n, p = pk.getIntMNP()
 
-    h, k, l = pk.getIntHKL()
-    m, n, p = pk.getIntMNP()
+        if (np.array([h,k,l,m,n,p]) == 0).all():
+            mtd['iws'].removePeak(pn)
 
-    if (np.array([h,k,l,m,n,p]) == 0).all():
-        mtd['iws'].removePeak(pn)
+    peak_dictionary.save_hkl(os.path.join(outdir, outname+'_w_ext.hkl'))
 
-peak_dictionary.save_hkl(os.path.join(outdir, outname+'_w_ext.hkl'))
+    peak_statistics = PeakStatistics(os.path.join(outdir, outname+'_w_abs.hkl'), peak_dictionary.hm)
+    peak_statistics.prune_outliers()
+    peak_statistics.write_statisics()
+    peak_statistics.write_intensity()
 
-peak_statistics = PeakStatistics(os.path.join(outdir, outname+'_w_abs.hkl'), peak_dictionary.hm)
-peak_statistics.prune_outliers()
-peak_statistics.write_statisics()
-peak_statistics.write_intensity()
+    peak_statistics = PeakStatistics(os.path.join(outdir, outname+'_w_ext.hkl'), peak_dictionary.hm)
+    peak_statistics.prune_outliers()
+    peak_statistics.write_statisics()
+    peak_statistics.write_intensity()
 
-peak_statistics = PeakStatistics(os.path.join(outdir, outname+'_w_ext.hkl'), peak_dictionary.hm)
-peak_statistics.prune_outliers()
-peak_statistics.write_statisics()
-peak_statistics.write_intensity()
- 
-# peak_dictionary.save(os.path.join(directory, outname+'_corr.pkl'))
\ No newline at end of file
+    # peak_dictionary.save(os.path.join(directory, outname+'_corr.pkl'))
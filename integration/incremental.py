@@ -0,0 +1,77 @@
+import os
+import json
+import hashlib
+
+import dill as pickle
+
+def fingerprint(*items):
+
+    return hashlib.sha1(pickle.dumps(items)).hexdigest()
+
+def file_fingerprint(filename):
+
+    if filename is None or not os.path.exists(filename):
+        return None
+
+    sha1 = hashlib.sha1()
+
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            sha1.update(chunk)
+
+    return sha1.hexdigest()
+
+class RegenerationManifest:
+
+    def __init__(self, filename):
+
+        self.filename = filename
+
+        self.__previous = {'inputs': {}, 'peaks': {}}
+
+        if os.path.exists(filename):
+            with open(filename, 'r') as f:
+                self.__previous = json.load(f)
+
+        self.__inputs = {}
+        self.__peaks = {}
+
+    def __key(self, key):
+
+        return ','.join([str(ind) for ind in key])
+
+    def inputs_changed(self, name, *values):
+
+        value = fingerprint(*values)
+
+        self.__inputs[name] = value
+
+        return self.__previous['inputs'].get(name) != value
+
+    def stale_peaks(self, peak_dict):
+
+        previous = self.__previous['peaks']
+
+        stale = []
+
+        for key, peaks in peak_dict.items():
+
+            value = fingerprint(*[peak.fingerprint() for peak in peaks])
+
+            self.__peaks[self.__key(key)] = value
+
+            if previous.get(self.__key(key)) != value:
+                stale.append(key)
+
+        return stale
+
+    def removed_peaks(self, peak_dict):
+
+        current = set([self.__key(key) for key in peak_dict.keys()])
+
+        return [key for key in self.__previous['peaks'].keys() if key not in current]
+
+    def save(self):
+
+        with open(self.filename, 'w') as f:
+            json.dump({'inputs': self.__inputs, 'peaks': self.__peaks}, f)
@@ -25,14 +25,16 @@ sys.path.append(directory)
 directory = os.path.abspath(os.path.join(directory, '..', 'reduction'))
 sys.path.append(directory)
 
-import merge, peak, parameters
+import merge, peak, parameters, pipeline, cache
 
 imp.reload(merge)
+imp.reload(pipeline)
 imp.reload(peak)
 imp.reload(parameters)
+imp.reload(cache)
 
 from peak import PeakDictionary, PeakStatistics
-from PyPDF2 import PdfFileMerger
+from cache import WorkspaceCache
 
 from mantid.kernel import V3D
 from mantid.geometry import PointGroupFactory, SpaceGroupFactory
@@ -131,6 +133,8 @@ if __name__ == '__main__':
     if vanadium_mass is None:
         vanadium_mass = 0
 
+    crystal_faces = dictionary.get('crystal-faces')
+
     facility, instrument = parameters.set_instrument(dictionary['instrument'])
     ipts = dictionary['ipts']
 
@@ -245,6 +249,24 @@ if __name__ == '__main__':
             beta = mtd['sample'].sample().getOrientedLattice().beta()
             gamma = mtd['sample'].sample().getOrientedLattice().gamma()
 
+    prefetch = dictionary.get('prefetch-lookahead')
+    if prefetch is None:
+        prefetch = 0
+
+    prefetch_memory = dictionary.get('prefetch-memory')
+    if prefetch_memory is None:
+        prefetch_memory = 70
+
+    cache_directory = dictionary.get('cache-directory')
+    cache_limit = dictionary.get('cache-limit')
+
+    q_index = dictionary.get('q-index')
+    if q_index is None:
+        q_index = False
+
+    md_cache = WorkspaceCache(cache_directory, instrument, tube_calibration, detector_calibration,
+                              mask_file, counts_file, spectrum_file)
+
     ref_dict = dictionary.get('peak-dictionary')
 
     merge.load_normalization_calibration(facility, instrument, spectrum_file, counts_file,
@@ -294,7 +316,7 @@ if __name__ == '__main__':
 
         args = [outdir, dbgdir, directory, facility, instrument, ipts, runs, ub_file, reflection_condition, min_d,
                 spectrum_file, counts_file, tube_calibration, detector_calibration, mask_file,
-                mod_vector_1, mod_vector_2, mod_vector_3, max_order, cross_terms, experiment, tmp]
+                mod_vector_1, mod_vector_2, mod_vector_3, max_order, cross_terms, experiment, tmp, prefetch, prefetch_memory, md_cache]
 
         join_args = [(split, i, outname+'_p{}'.format(i), *args) for i, split in enumerate(split_runs)]
 
@@ -458,6 +480,32 @@ if __name__ == '__main__':
     if cluster is None:
         cluster = False
 
+    pipeline_stages = dictionary.get('pipeline-stages')
+    if facility != 'SNS':
+        pipeline_stages = None
+
+    pipeline_buffer = dictionary.get('pipeline-buffer')
+    if pipeline_buffer is None:
+        pipeline_buffer = 64
+
+    deferred_plots = dictionary.get('deferred-plots')
+    if deferred_plots is None:
+        deferred_plots = False
+
+    render_plots = dictionary.get('render-plots')
+    if render_plots is None:
+        render_plots = True
+
+    report_policy = dictionary.get('report-policy')
+    if report_policy is None:
+        report_policy = 'all'
+
+    report_fraction = dictionary.get('report-fraction')
+    if report_fraction is None:
+        report_fraction = 0.05
+
+    report_hkl = dictionary.get('report-hkl')
+
     for r in runs:
 
         if min_d is not None:
@@ -599,6 +647,9 @@ if __name__ == '__main__':
     keys = [key_list[i] for i in sort]
     inds = [ind_list[i] for i in sort]
 
+    if pipeline_stages is not None:
+        n_load, n_bin, n_proc = pipeline_stages
+
     split_keys = [split.tolist() for split in np.array_split(keys, n_proc)]
     split_inds = [split.tolist() for split in np.array_split(inds, n_proc)]
 
@@ -611,7 +662,8 @@ if __name__ == '__main__':
             outdir, dbgdir, directory, facility, instrument, ipts, runs,
             split_angle, min_d, min_d_sat, sat_only, a, b, c, alpha, beta, gamma, reflection_condition,
             mod_vector_1, mod_vector_2, mod_vector_3, max_order, cross_terms,
-            chemical_formula, z_parameter, sample_mass, elastic, timing_offset, experiment, tmp, cluster]
+            chemical_formula, z_parameter, sample_mass, elastic, timing_offset, experiment, tmp, cluster,
+            prefetch, prefetch_memory, deferred_plots, report_policy, report_fraction, report_hkl, md_cache, q_index]
 
     join_args = [(split_key, split_ind, i, outname+'_p{}'.format(i), *args) for i, (split_key, split_ind) in enumerate(zip(split_keys,split_inds))]
 
@@ -623,79 +675,74 @@ if __name__ == '__main__':
 
     print('Spawning threads for integration')
     multiprocessing.set_start_method('spawn', force=True)
-    with multiprocessing.get_context('spawn').Pool(processes=n_proc) as pool:
-        pool.starmap(merge.integration_loop, join_args)
-        pool.close()
-        pool.join()
+    if pipeline_stages is None:
+        with multiprocessing.get_context('spawn').Pool(processes=n_proc) as pool:
+            pool.starmap(merge.integration_loop, join_args)
+            pool.close()
+            pool.join()
+    else:
+        norm_scale = {}
+
+        LoadNexus(Filename=filename+'_log.nxs', OutputWorkspace='log')
+        for j in range(mtd['log'].rowCount()):
+            r, scale = mtd['log'].row(j).values()
+            norm_scale[r] = scale
+
+        load_args = []
+        for i, (split_key, split_ind) in enumerate(zip(split_keys,split_inds)):
+            peak_args = []
+            for key, j in zip(split_key, split_ind):
+                pk = peak_dict[tuple(key)][j]
+                peak_args.append(merge.peak_load_args(facility, instrument, pk, norm_scale, split_angle, dbgdir, ipts, outname+'_p{}'.format(i),
+                                                      detector_calibration, elastic, timing_offset, experiment, tmp, md_cache, q_index))
+            load_args.append(peak_args)
+
+        calibration_args = (facility, instrument, spectrum_file, counts_file,
+                            tube_calibration, detector_calibration, mask_file, elastic)
+
+        wall_time, stage_stats = pipeline.run_pipeline(join_args, load_args, n_load, n_bin,
+                                                       os.path.join(dbgdir, tmp+'_staged'), calibration_args,
+                                                       pipeline_buffer, prefetch_memory)
+
+        with open(os.path.join(outdir, 'pipeline.txt'), 'w') as f:
+            f.write('# loaders, binners, fitters : {} {} {}\n'.format(n_load,n_bin,n_proc))
+            f.write('# wall time : {:.1f}\n'.format(wall_time))
+            f.write('# stage busy idle\n')
+            for stage in sorted(stage_stats.keys()):
+                f.write('{:12} {:10.1f} {:10.1f}\n'.format(stage,*stage_stats[stage]))
     print('Joining threads from integration')
 
+    md_cache.prune(cache_limit)
+
     config['MultiThreaded.MaxCores'] == 4
     os.environ.pop('OPENBLAS_NUM_THREADS', None)
     os.environ.pop('OMP_NUM_THREADS', None)
 
-    merger = PdfFileMerger()
-
-    for i in range(n_proc):
-        partfile = os.path.join(dbgdir, outname+'_p{}'.format(i)+'.pdf')
-        if os.path.exists(partfile):
-            merger.append(partfile)
-
-    merger.write(os.path.join(outdir, outname+'.pdf'))       
-    merger.close()
-
-    if os.path.exists(os.path.join(outdir, outname+'.pdf')):
-        for i in range(n_proc):
-            partfile = os.path.join(dbgdir, outname+'_p{}'.format(i)+'.pdf')
-            if os.path.exists(partfile):
-                os.remove(partfile)
-
-    merger = PdfFileMerger()
+    if prefetch > 0:
 
-    for i in range(n_proc):
-        partfile = os.path.join(dbgdir, 'rej_'+outname+'_p{}'.format(i)+'.pdf')
-        if os.path.exists(partfile):
-            merger.append(partfile)
-
-    merger.write(os.path.join(dbgdir, 'rejected.pdf'))       
-    merger.close()
+        prefetch_file = open(os.path.join(outdir, 'prefetch.txt'), 'w')
 
-    if os.path.exists(os.path.join(dbgdir, 'rejected.pdf')):
         for i in range(n_proc):
-            partfile = os.path.join(dbgdir, 'rej_'+outname+'_p{}'.format(i)+'.pdf')
+            partfile = os.path.join(dbgdir, outname+'_p{}'.format(i)+'_prefetch.txt')
             if os.path.exists(partfile):
+                prefetch_file.write('# process {}\n'.format(i))
+                tmp_file = open(partfile, 'r')
+                tmp_lines = tmp_file.readlines()
+                for tmp_line in tmp_lines:
+                    prefetch_file.write(tmp_line)
+                tmp_file.close()
                 os.remove(partfile)
 
-    merger = PdfFileMerger()
+        prefetch_file.close()
 
-    for i in range(n_proc):
-        partfile = os.path.join(dbgdir, 'ind_'+outname+'_p{}'.format(i)+'.pdf')
-        if os.path.exists(partfile):
-            merger.append(partfile)
-
-    merger.write(os.path.join(outdir, outname+'_individual.pdf'))       
-    merger.close()
-
-    if os.path.exists(os.path.join(outdir, outname+'_individual.pdf')):
-        for i in range(n_proc):
-            partfile = os.path.join(dbgdir, 'ind_'+outname+'_p{}'.format(i)+'.pdf')
-            if os.path.exists(partfile):
-                os.remove(partfile)
-
-    merger = PdfFileMerger()
-
-    for i in range(n_proc):
-        partfile = os.path.join(dbgdir, 'rej_ind_'+outname+'_p{}'.format(i)+'.pdf')
-        if os.path.exists(partfile):
-            merger.append(partfile)
-
-    merger.write(os.path.join(dbgdir, 'rejected_individual.pdf'))       
-    merger.close()
+    if deferred_plots and render_plots:
+        with multiprocessing.get_context('spawn').Pool(processes=n_proc) as pool:
+            pool.starmap(merge.render_report, [(dbgdir, outname+'_p{}'.format(i)) for i in range(n_proc)])
+            pool.close()
+            pool.join()
 
-    if os.path.exists(os.path.join(dbgdir, 'rejected_individual.pdf')):
-        for i in range(n_proc):
-            partfile = os.path.join(dbgdir, 'rej_ind_'+outname+'_p{}'.format(i)+'.pdf')
-            if os.path.exists(partfile):
-                os.remove(partfile)
+    if not deferred_plots or render_plots:
+        merge.merge_reports(outdir, dbgdir, outname, n_proc)
 
     for i in range(n_proc):
         tmp_peak_dict = peak_dictionary.load_dictionary(os.path.join(dbgdir, outname+'_p{}.pkl'.format(i)))
@@ -750,7 +797,10 @@ if __name__ == '__main__':
     absorption_file = os.path.join(outdir, 'absorption.txt')
 
     if chemical_formula is not None and z_parameter > 0 and sample_mass > 0:
-        peak_dictionary.apply_spherical_correction(vanadium_mass, fname=absorption_file)
+        if crystal_faces is not None:
+            peak_dictionary.apply_polyhedral_correction(crystal_faces, vanadium_mass, fname=absorption_file)
+        else:
+            peak_dictionary.apply_spherical_correction(vanadium_mass, fname=absorption_file)
         peak_dictionary.save_hkl(os.path.join(outdir, outname+'_w_abs.int'), adaptive_scale=False, scale=scale)
         peak_dictionary.save_reflections(os.path.join(outdir, outname+'_w_abs.hkl'), adaptive_scale=False, scale=scale)
 
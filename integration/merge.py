@@ -5,9 +5,13 @@ from mantid.geometry import Goniometer
 
 import os
 import re
-import glob
+import json
+import time
 import psutil
 import itertools
+import threading
+
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 import matplotlib.pyplot as plt
@@ -16,10 +20,12 @@ from scipy.stats import kstwobign
 import peak
 from peak import PeakEnvelope, PeakDictionary
 
-from PIL import Image
+from PyPDF2 import PdfFileMerger
 
-#from PyPDF2 import PdfFileMerger
-import img2pdf
+from prefetch import RunPrefetcher
+from cache import WorkspaceCache, file_key
+from event_index import EventIndex
+from q_index import QIndex, build_q_index, q_sample
 
 import fitting
 from fitting import Ellipsoid, Profile, Projection, LineCut, GaussianFit3D, SatelliteGaussianFit3D
@@ -90,6 +96,8 @@ def box_integrator(facility, instrument, runs, banks, indices, split_angle, Q0,
                    OutputDataWorkspace='tmpDataMD_{}'.format(j),
                    OutputNormalizationWorkspace='tmpNormMD_{}'.format(j))
 
+            index_data(omd, j, W)
+
         else:
 
             lamda = 1.486 if instrument == 'HB2C' else float(mtd[ows].getExperimentInfo(0).run().getProperty('wavelength').value)
@@ -500,6 +508,8 @@ def norm_integrator(facility, instrument, runs, banks, indices, split_angle, Q0,
                    OutputDataWorkspace='tmpDataMD_{}'.format(j),
                    OutputNormalizationWorkspace='tmpNormMD_{}'.format(j))
 
+            index_data(omd, j, W)
+
         else:
 
             lamda = 1.486 if instrument == 'HB2C' else float(mtd[ows].getExperimentInfo(0).run().getProperty('wavelength').value)
@@ -768,7 +778,7 @@ def load_normalization_calibration(facility, instrument, spectrum_file, counts_f
 def pre_integration(runs, proc, outname, outdir, dbgdir, directory, facility, instrument, ipts, all_runs, ub_file, reflection_condition, min_d,
                     spectrum_file, counts_file, tube_calibration, detector_calibration, mask_file,
                     mod_vector_1=[0,0,0], mod_vector_2=[0,0,0], mod_vector_3=[0,0,0],
-                    max_order=0, cross_terms=False, exp=None, tmp=None):
+                    max_order=0, cross_terms=False, exp=None, tmp=None, prefetch=0, prefetch_memory=70, cache=None):
 
     # peak centroid radius ---------------------------------------------------------
     centroid_radius = 0.125
@@ -793,6 +803,17 @@ def pre_integration(runs, proc, outname, outdir, dbgdir, directory, facility, in
         CreatePeaksWorkspace(InstrumentWorkspace='sa', NumberOfPeaks=0, OutputType='Peak', OutputWorkspace='tmp_ellip')
     else:
         CreatePeaksWorkspace(InstrumentWorkspace='van', NumberOfPeaks=0, OutputType='Peak', OutputWorkspace='tmp')
+
+    if facility == 'SNS' and not mtd.doesExist('pks'):
+        load_runs = [r for r in runs if not mtd.doesExist('{}_{}_pk'.format(instrument,r))]
+    else:
+        load_runs = []
+
+    if cache is None:
+        cache = WorkspaceCache(None)
+
+    prefetcher = RunPrefetcher(lambda r, ws: LoadEventNexus(Filename='/SNS/{}/IPTS-{}/nexus/{}_{}.nxs.h5'.format(instrument,ipts,instrument,r), OutputWorkspace=ws),
+                               load_runs, lambda r: '{}_{}'.format(instrument,r), prefetch, prefetch_memory)
        
     for i, r in enumerate(runs):
 
@@ -813,7 +834,7 @@ def pre_integration(runs, proc, outname, outdir, dbgdir, directory, facility, in
 
             if facility == 'SNS':
                 filename = '/SNS/{}/IPTS-{}/nexus/{}_{}.nxs.h5'.format(instrument,ipts,instrument,r)
-                LoadEventNexus(Filename=filename, OutputWorkspace=ows)
+                prefetcher.load(r)
 
                 if mtd.doesExist('sa'):
                     #MaskDetectors(Workspace=ows, MaskedWorkspace='mask')
@@ -873,28 +894,34 @@ def pre_integration(runs, proc, outname, outdir, dbgdir, directory, facility, in
                 #                                              dEAnalysisMode='Elastic',
                 #                                              Q3DFrames='Q')
 
-                min_vals, max_vals = ConvertToMDMinMaxLocal(InputWorkspace=ows,
-                                                             QDimensions='Q3D',
-                                                             dEAnalysisMode='Elastic',
-                                                             Q3DFrames='Q_sample',
-                                                             LorentzCorrection=False,
-                                                             Uproj='1,0,0',
-                                                             Vproj='0,1,0',
-                                                             Wproj='0,0,1')
-
-                # print(min_vals, max_vals)
-
-                ConvertToMD(InputWorkspace=ows,
-                            OutputWorkspace=omd,
-                            QDimensions='Q3D',
-                            dEAnalysisMode='Elastic',
-                            Q3DFrames='Q_sample',
-                            LorentzCorrection=False,
-                            MinValues=min_vals,
-                            MaxValues=max_vals,
-                            Uproj='1,0,0',
-                            Vproj='0,1,0',
-                            Wproj='0,0,1')
+                key = cache.key(filename, 'Q_sample', False, mtd.doesExist('sa'))
+
+                if not cache.load(key, omd):
+
+                    min_vals, max_vals = ConvertToMDMinMaxLocal(InputWorkspace=ows,
+                                                                 QDimensions='Q3D',
+                                                                 dEAnalysisMode='Elastic',
+                                                                 Q3DFrames='Q_sample',
+                                                                 LorentzCorrection=False,
+                                                                 Uproj='1,0,0',
+                                                                 Vproj='0,1,0',
+                                                                 Wproj='0,0,1')
+
+                    # print(min_vals, max_vals)
+
+                    ConvertToMD(InputWorkspace=ows,
+                                OutputWorkspace=omd,
+                                QDimensions='Q3D',
+                                dEAnalysisMode='Elastic',
+                                Q3DFrames='Q_sample',
+                                LorentzCorrection=False,
+                                MinValues=min_vals,
+                                MaxValues=max_vals,
+                                Uproj='1,0,0',
+                                Vproj='0,1,0',
+                                Wproj='0,0,1')
+
+                    cache.save(omd, key)
 
             else:
 
@@ -1592,6 +1619,11 @@ def pre_integration(runs, proc, outname, outdir, dbgdir, directory, facility, in
     if mtd.doesExist('md'):
         DeleteWorkspace('md')
 
+    prefetcher.shutdown()
+
+    if prefetch > 0:
+        prefetcher.write_report(os.path.join(dbgdir, outname+'_pre_prefetch.txt'))
+
     SaveNexus(InputWorkspace='run_info', Filename=os.path.join(dbgdir, outname+'_log.nxs'))
     SaveNexus(InputWorkspace='tmp_lean', Filename=os.path.join(dbgdir, outname+'_pk_lean.nxs'))
     SaveNexus(InputWorkspace='tmp', Filename=os.path.join(dbgdir, outname+'_pk.nxs'))
@@ -1608,8 +1640,204 @@ def pre_integration(runs, proc, outname, outdir, dbgdir, directory, facility, in
     if mtd.doesExist('van'):
         DeleteWorkspace('van')
  
+load_locks = {}
+load_locks_guard = threading.Lock()
+
+def workspace_lock(ws):
+
+    with load_locks_guard:
+        if load_locks.get(ws) is None:
+            load_locks[ws] = threading.RLock()
+        return load_locks[ws]
+
+class PartialLoadPrefetcher:
+
+    def __init__(self, lookahead=1, memory_limit=70):
+
+        self.lookahead = lookahead if lookahead is not None else 0
+        self.memory_limit = memory_limit if memory_limit is not None else 70
+
+        self.__executor = ThreadPoolExecutor(max_workers=1) if self.lookahead > 0 else None
+        self.__futures = {}
+
+        self.prefetch_time = 0
+        self.wait_time = 0
+        self.load_time = 0
+
+        self.n_prefetched = 0
+        self.n_skipped = 0
+
+    def __partial_load(self, args):
+
+        start = time.time()
+        partial_load(*args)
+        return time.time()-start
+
+    def prefetch(self, i, args):
+
+        if self.__executor is None or self.__futures.get(i) is not None:
+            return
+
+        if psutil.virtual_memory().percent > self.memory_limit:
+            self.n_skipped += 1
+            return
+
+        self.__futures[i] = self.__executor.submit(self.__partial_load, args)
+
+    def load(self, i, args):
+
+        future = self.__futures.pop(i, None)
+
+        if future is not None:
+            start = time.time()
+            try:
+                self.prefetch_time += future.result()
+                self.n_prefetched += 1
+            except Exception as e:
+                print('Prefetch of peak {} failed: {}'.format(i,e))
+            self.wait_time += time.time()-start
+
+        start = time.time()
+        partial_load(*args)
+        self.load_time += time.time()-start
+
+    def hidden_time(self):
+
+        return np.max([self.prefetch_time-self.wait_time, 0])
+
+    def shutdown(self):
+
+        if self.__executor is not None:
+            for future in self.__futures.values():
+                future.cancel()
+            self.__executor.shutdown(wait=True)
+            self.__futures = {}
+
+    def write_report(self, filename):
+
+        with open(filename, 'w') as f:
+            f.write('lookahead                  : {:12d}\n'.format(self.lookahead))
+            f.write('memory limit [%]           : {:12.1f}\n'.format(self.memory_limit))
+            f.write('prefetched peaks           : {:12d}\n'.format(self.n_prefetched))
+            f.write('skipped (memory) peaks     : {:12d}\n'.format(self.n_skipped))
+            f.write('prefetch load time [s]     : {:12.2f}\n'.format(self.prefetch_time))
+            f.write('prefetch wait time [s]     : {:12.2f}\n'.format(self.wait_time))
+            f.write('synchronous load time [s]  : {:12.2f}\n'.format(self.load_time))
+            f.write('hidden load time [s]       : {:12.2f}\n'.format(self.hidden_time()))
+
+def rotation(axis, angle):
+
+    t = np.deg2rad(angle)
+
+    if axis == 'y':
+        return np.array([[np.cos(t),0,np.sin(t)],[0,1,0],[-np.sin(t),0,np.cos(t)]])
+    else:
+        return np.array([[np.cos(t),-np.sin(t),0],[np.sin(t),np.cos(t),0],[0,0,1]])
+
+def build_run_q_index(basename, filename, event_index, phi, chi, omega):
+
+    k_range = [mtd['flux'].dataX(0).min(), mtd['flux'].dataX(0).max()] if mtd.doesExist('flux') else None
+
+    metadata = {'file': file_key(filename), 'angles': [phi, chi, omega], 'k': k_range}
+
+    if os.path.exists(basename+'.json'):
+        index = QIndex(basename)
+        if all([index.metadata.get(key) == value for key, value in json.loads(json.dumps(metadata)).items()]):
+            return index
+
+    if not os.path.exists(os.path.dirname(basename)):
+        os.makedirs(os.path.dirname(basename), exist_ok=True)
+
+    if not mtd.doesExist('sa_det'):
+        PreprocessDetectorsToMD(InputWorkspace='sa', OutputWorkspace='sa_det')
+
+    det = mtd['sa_det']
+
+    det_ids = np.array(det.column('DetectorID'))
+    l2 = np.array(det.column('L2'))
+    two_theta = np.array(det.column('TwoTheta'))
+    azimuthal = np.array(det.column('Azimuthal'))
+    det_mask = np.array(det.column('detMask')) > 0
+
+    l1 = mtd['sa'].spectrumInfo().l1()
+
+    sort = np.argsort(det_ids)
+
+    R = np.dot(rotation('y', omega), np.dot(rotation('z', chi), rotation('y', phi)))
+
+    Q, bank = [], []
+
+    for b, events in event_index.load_events(filename, None).items():
+
+        ind = np.searchsorted(det_ids, events['event_id'], sorter=sort)
+        ind = sort[np.clip(ind, 0, len(sort)-1)]
+
+        valid = (det_ids[ind] == events['event_id']) & ~det_mask[ind]
+
+        ind, tof = ind[valid], events['tof'][valid]
+
+        Q_sample, k = q_sample(tof, l1, l2[ind], two_theta[ind], azimuthal[ind], R)
+
+        if k_range is not None:
+            valid = (k >= k_range[0]) & (k <= k_range[1])
+            Q_sample = Q_sample[valid]
+
+        Q.append(Q_sample.astype(np.float32))
+        bank.append(np.full(len(Q_sample), b, dtype=np.int16))
+
+    if len(Q) > 0:
+        Q, bank = np.concatenate(Q), np.concatenate(bank)
+    else:
+        Q, bank = np.zeros((0,3), dtype=np.float32), np.zeros(0, dtype=np.int16)
+
+    build_q_index(basename, Q, bank, metadata)
+
+    return QIndex(basename)
+
+def index_data(omd, j, W):
+
+    run = mtd[omd].getExperimentInfo(0).run()
+
+    if not run.hasProperty('QIndex'):
+        return
+
+    banks = run.getProperty('QIndexBanks').value
+    banks = [int(bank) for bank in banks.split(',')] if banks != '' else None
+
+    ws = 'tmpDataMD_{}'.format(j)
+
+    dims = [mtd[ws].getDimension(d) for d in range(3)]
+    edges = [np.linspace(dim.getMinimum(), dim.getMaximum(), dim.getNBins()+1) for dim in dims]
+
+    corners = np.array(list(itertools.product(*[[edge[0], edge[-1]] for edge in edges])))
+
+    Q = np.dot(corners, np.linalg.inv(W))
+
+    Q = QIndex(run.getProperty('QIndex').value).query_box(Q.min(axis=0), Q.max(axis=0), banks)
+
+    data, _ = np.histogramdd(np.dot(Q, W), bins=edges)
+
+    mtd[ws].setSignalArray(data)
+    mtd[ws].setErrorSquaredArray(data)
+
+    DivideMD(LHSWorkspace=ws, RHSWorkspace='tmpNormMD_{}'.format(j), OutputWorkspace='normDataMD_{}'.format(j))
+
+def peak_load_args(facility, instrument, peak, norm_scale, split_angle, dbgdir, ipts, outname,
+                   detector_calibration, elastic, timing_offset, exp=None, tmp=None, cache=None, q_index=False):
+
+    return (facility, instrument, peak.get_run_numbers().tolist(),
+            peak.get_bank_numbers().tolist(), peak.get_peak_indices().tolist(),
+            peak.get_phi_angles(), peak.get_chi_angles(), peak.get_omega_angles(),
+            norm_scale, split_angle, dbgdir, ipts, outname,
+            detector_calibration, elastic, timing_offset, exp, tmp, cache, q_index)
+
 def partial_load(facility, instrument, runs, banks, indices, phi, chi, omega, norm_scale, split_angle,
-                 dbgdir, ipts, outname, detector_calibration, elastic, timing_offset, exp=None, tmp=None):
+                 dbgdir, ipts, outname, detector_calibration, elastic, timing_offset, exp=None, tmp=None, cache=None, q_index=False):
+
+    if cache is None:
+        cache = WorkspaceCache(None)
+
+    event_index = EventIndex(os.path.join(cache.directory, 'events')) if cache.directory is not None else None
 
     for r, b, i, p, c, o in zip(runs, banks, indices, phi, chi, omega):
 
@@ -1625,152 +1853,196 @@ def partial_load(facility, instrument, runs, banks, indices, phi, chi, omega, no
 
         omd = ows+'_md'
 
-        if facility == 'SNS':
+        with workspace_lock(ows):
 
-            if not mtd.doesExist(omd):
+            if facility == 'SNS':
 
-                filename = '/SNS/{}/IPTS-{}/nexus/{}_{}.nxs.h5'.format(instrument,ipts,instrument,r)
+                if not mtd.doesExist(omd):
 
-                if split_angle > 0:
+                    filename = '/SNS/{}/IPTS-{}/nexus/{}_{}.nxs.h5'.format(instrument,ipts,instrument,r)
+
+                    index_file = None
+
+                    if q_index and event_index is not None and not elastic and mtd.doesExist('sa'):
+                        index_file = os.path.join(cache.directory, 'q', '{}_{}'.format(instrument,r))
+
+                    key = cache.key(filename, 'Q_sample', False, split_angle > 0, b if split_angle > 0 else None, elastic, timing_offset,
+                                    norm_scale[r], p, c, o, mtd.doesExist('sa'), mtd.doesExist('flux'), index_file is not None)
+
+                    if index_file is not None:
+                        with workspace_lock(index_file):
+                            run_index = build_run_q_index(index_file, filename, event_index, p, c, o)
+
+                    if not cache.load(key, omd):
 
-                    if instrument == 'CORELLI':
                         banks_to_load = []
-                        for bind in range(-2,2+1):
-                            if b+bind >= 1 and b+bind <= 91:
-                                banks_to_load.append(b+bind)
-                        bank = ','.join(['bank{}'.format(bank) for bank in banks_to_load])
-                    else:
-                        bank = 'bank{}'.format(b)
-
-                    LoadEventNexus(Filename=filename, 
-                                   BankName=bank, 
-                                   SingleBankPixelsOnly=True,
-                                   Precount=True,
-                                   LoadLogs=False,
-                                   #FilterByTimeStop=60,
-                                   LoadNexusInstrumentXML=False,
-                                   OutputWorkspace=ows)
-
-                    if elastic:
-                        LoadNexusLogs(Workspace=ows, Filename=filename, AllowList='chopper4_TDC,BL9:Chop:Skf4:MotorSpeed')
-                        CopyInstrumentParameters(InputWorkspace=instrument, OutputWorkspace=ows)
-                        CorelliCrossCorrelate(InputWorkspace=ows, OutputWorkspace=ows, TimingOffset=timing_offset)
 
-                else:
+                        if split_angle > 0:
 
-                    LoadEventNexus(Filename=filename, 
-                                   LoadLogs=False,
-                                   LoadNexusInstrumentXML=False,
-                                   OutputWorkspace=ows)
+                            if instrument == 'CORELLI':
+                                banks_to_load = []
+                                for bind in range(-2,2+1):
+                                    if b+bind >= 1 and b+bind <= 91:
+                                        banks_to_load.append(b+bind)
+                            else:
+                                banks_to_load = [b]
 
-                pc = norm_scale[r]
+                            bank = ','.join(['bank{}'.format(bank) for bank in banks_to_load])
 
-                AddSampleLog(Workspace=ows,
-                             LogName='gd_prtn_chrg', 
-                             LogText=str(pc),
-                             LogType='Number',
-                             LogUnit='uA.hour',
-                             NumberType='Double')
+                            if event_index is not None:
+                                bank = event_index.bank_names(filename, banks_to_load) or bank
 
-                AddSampleLog(Workspace=ows,
-                             LogName='phi', 
-                             LogText=str(p),
-                             LogType='Number Series',
-                             LogUnit='degree',
-                             NumberType='Double')
+                            LoadEventNexus(Filename=filename, 
+                                           BankName=bank, 
+                                           SingleBankPixelsOnly=True,
+                                           Precount=True,
+                                           LoadLogs=False,
+                                           #FilterByTimeStop=60,
+                                           LoadNexusInstrumentXML=False,
+                                           MetaDataOnly=index_file is not None,
+                                           OutputWorkspace=ows)
 
-                AddSampleLog(Workspace=ows,
-                             LogName='chi', 
-                             LogText=str(c),
-                             LogType='Number Series',
-                             LogUnit='degree',
-                             NumberType='Double')
+                            if elastic:
+                                LoadNexusLogs(Workspace=ows, Filename=filename, AllowList='chopper4_TDC,BL9:Chop:Skf4:MotorSpeed')
+                                CopyInstrumentParameters(InputWorkspace=instrument, OutputWorkspace=ows)
+                                CorelliCrossCorrelate(InputWorkspace=ows, OutputWorkspace=ows, TimingOffset=timing_offset)
 
-                AddSampleLog(Workspace=ows,
-                             LogName='omega', 
-                             LogText=str(o),
-                             LogType='Number Series',
-                             LogUnit='degree',
-                             NumberType='Double')
+                        else:
 
-                if mtd.doesExist('sa'):
+                            LoadEventNexus(Filename=filename, 
+                                           LoadLogs=False,
+                                           LoadNexusInstrumentXML=False,
+                                           MetaDataOnly=index_file is not None,
+                                           OutputWorkspace=ows)
 
-                    if split_angle > 0:
-                        CopyInstrumentParameters(InputWorkspace='sa', OutputWorkspace=ows)
-                        if mtd.doesExist('tube_table'):
-                            ApplyCalibration(Workspace=ows, CalibrationTable='tube_table')
+                        if index_file is not None:
+
+                            AddSampleLog(Workspace=ows,
+                                         LogName='QIndex',
+                                         LogText=index_file,
+                                         LogType='String')
+
+                            AddSampleLog(Workspace=ows,
+                                         LogName='QIndexBanks',
+                                         LogText=','.join([str(bank) for bank in banks_to_load]),
+                                         LogType='String')
+
+                        pc = norm_scale[r]
+
+                        AddSampleLog(Workspace=ows,
+                                     LogName='gd_prtn_chrg', 
+                                     LogText=str(pc),
+                                     LogType='Number',
+                                     LogUnit='uA.hour',
+                                     NumberType='Double')
+
+                        AddSampleLog(Workspace=ows,
+                                     LogName='phi', 
+                                     LogText=str(p),
+                                     LogType='Number Series',
+                                     LogUnit='degree',
+                                     NumberType='Double')
+
+                        AddSampleLog(Workspace=ows,
+                                     LogName='chi', 
+                                     LogText=str(c),
+                                     LogType='Number Series',
+                                     LogUnit='degree',
+                                     NumberType='Double')
+
+                        AddSampleLog(Workspace=ows,
+                                     LogName='omega', 
+                                     LogText=str(o),
+                                     LogType='Number Series',
+                                     LogUnit='degree',
+                                     NumberType='Double')
+
+                        if mtd.doesExist('sa'):
+
+                            if split_angle > 0:
+                                CopyInstrumentParameters(InputWorkspace='sa', OutputWorkspace=ows)
+                                if mtd.doesExist('tube_table'):
+                                    ApplyCalibration(Workspace=ows, CalibrationTable='tube_table')
 
-                    else:
-                        if detector_calibration is not None:
-                            ext = os.path.splitext(detector_calibration)[1]
-                            if ext == '.xml':
-                                LoadParameterFile(Workspace=ows, Filename=detector_calibration)
                             else:
-                                LoadIsawDetCal(InputWorkspace=ows, Filename=detector_calibration)
+                                if detector_calibration is not None:
+                                    ext = os.path.splitext(detector_calibration)[1]
+                                    if ext == '.xml':
+                                        LoadParameterFile(Workspace=ows, Filename=detector_calibration)
+                                    else:
+                                        LoadIsawDetCal(InputWorkspace=ows, Filename=detector_calibration)
 
-                    MaskDetectors(Workspace=ows, MaskedWorkspace='mask')
+                            MaskDetectors(Workspace=ows, MaskedWorkspace='mask')
 
-                SetGoniometer(Workspace=ows, Goniometers='Universal')
+                        SetGoniometer(Workspace=ows, Goniometers='Universal')
 
-                if mtd.doesExist('flux'):
+                        if mtd.doesExist('flux'):
 
-                    ConvertUnits(InputWorkspace=ows, OutputWorkspace=ows, EMode='Elastic', Target='Momentum')
+                            ConvertUnits(InputWorkspace=ows, OutputWorkspace=ows, EMode='Elastic', Target='Momentum')
 
-                    CropWorkspaceForMDNorm(InputWorkspace=ows,
-                                           XMin=mtd['flux'].dataX(0).min(),
-                                           XMax=mtd['flux'].dataX(0).max(),
-                                           OutputWorkspace=ows)
+                            CropWorkspaceForMDNorm(InputWorkspace=ows,
+                                                   XMin=mtd['flux'].dataX(0).min(),
+                                                   XMax=mtd['flux'].dataX(0).max(),
+                                                   OutputWorkspace=ows)
 
-                min_vals, max_vals = ConvertToMDMinMaxLocal(InputWorkspace=ows,
-                                                             QDimensions='Q3D',
-                                                             dEAnalysisMode='Elastic',
-                                                             Q3DFrames='Q_sample',
-                                                             LorentzCorrection=False,
-                                                             Uproj='1,0,0',
-                                                             Vproj='0,1,0',
-                                                             Wproj='0,0,1')
-
-                # if np.isinf(min_vals).any() or np.isinf(max_vals).any():
-                #     min_vals, max_vals = [-20,-20,-20], [20,20,20]
-                #min_vals, max_vals = [-20,-20,-20], [20,20,20]
-
-                ConvertToMD(InputWorkspace=ows,
-                            OutputWorkspace=omd,
-                            QDimensions='Q3D',
-                            dEAnalysisMode='Elastic',
-                            Q3DFrames='Q_sample',
-                            LorentzCorrection=False,
-                            PreprocDetectorsWS='-',
-                            MinValues=min_vals,
-                            MaxValues=max_vals,
-                            Uproj='1,0,0',
-                            Vproj='0,1,0',
-                            Wproj='0,0,1')
-
-                RecalculateTrajectoriesExtents(InputWorkspace=omd,
-                                               OutputWorkspace=omd)
-
-                DeleteWorkspace(ows)
+                        if index_file is not None:
 
-        else:
+                            min_vals, max_vals = run_index.metadata['min'], run_index.metadata['max']
 
-            if not mtd.doesExist(ows):
+                        else:
 
-                filename = '{}/{}/{}.nxs'.format(dbgdir, tmp, ows)
-                LoadMD(Filename=filename, OutputWorkspace=ows)
-                filename = '{}/{}/{}.nxs'.format(dbgdir, tmp, 'van_'+ows)
-                LoadMD(Filename=filename, OutputWorkspace='van_'+ows)
+                            min_vals, max_vals = ConvertToMDMinMaxLocal(InputWorkspace=ows,
+                                                                         QDimensions='Q3D',
+                                                                         dEAnalysisMode='Elastic',
+                                                                         Q3DFrames='Q_sample',
+                                                                         LorentzCorrection=False,
+                                                                         Uproj='1,0,0',
+                                                                         Vproj='0,1,0',
+                                                                         Wproj='0,0,1')
+
+                        # if np.isinf(min_vals).any() or np.isinf(max_vals).any():
+                        #     min_vals, max_vals = [-20,-20,-20], [20,20,20]
+                        #min_vals, max_vals = [-20,-20,-20], [20,20,20]
+
+                        ConvertToMD(InputWorkspace=ows,
+                                    OutputWorkspace=omd,
+                                    QDimensions='Q3D',
+                                    dEAnalysisMode='Elastic',
+                                    Q3DFrames='Q_sample',
+                                    LorentzCorrection=False,
+                                    PreprocDetectorsWS='-',
+                                    MinValues=min_vals,
+                                    MaxValues=max_vals,
+                                    Uproj='1,0,0',
+                                    Vproj='0,1,0',
+                                    Wproj='0,0,1')
+
+                        RecalculateTrajectoriesExtents(InputWorkspace=omd,
+                                                       OutputWorkspace=omd)
+
+                        cache.save(omd, key)
+
+                        DeleteWorkspace(ows)
 
-                if instrument == 'HB3A':
-                    SetGoniometer(Workspace=ows,
-                                  Axis0='omega,0,1,0,-1',
-                                  Axis1='chi,0,0,1,-1',
-                                  Axis2='phi,0,1,0,-1',
-                                  Average=False)
-                else:
-                    SetGoniometer(Workspace=ows,
-                                  Axis0='s1,0,1,0,1',
-                                  Average=False)
+            else:
+
+                if not mtd.doesExist(ows):
+
+                    filename = '{}/{}/{}.nxs'.format(dbgdir, tmp, ows)
+                    LoadMD(Filename=filename, OutputWorkspace=ows)
+                    filename = '{}/{}/{}.nxs'.format(dbgdir, tmp, 'van_'+ows)
+                    LoadMD(Filename=filename, OutputWorkspace='van_'+ows)
+
+                    if instrument == 'HB3A':
+                        SetGoniometer(Workspace=ows,
+                                      Axis0='omega,0,1,0,-1',
+                                      Axis1='chi,0,0,1,-1',
+                                      Axis2='phi,0,1,0,-1',
+                                      Average=False)
+                    else:
+                        SetGoniometer(Workspace=ows,
+                                      Axis0='s1,0,1,0,1',
+                                      Average=False)
 
 def partial_cleanup(runs, banks, indices, facility, instrument, split_angle, runs_banks, run_keys, bank_keys, bank_group, key, exp=None):
 
@@ -1806,12 +2078,14 @@ def partial_cleanup(runs, banks, indices, facility, instrument, split_angle, run
 
             if split_angle > 0:
                 if len(peak_keys) == 0 or psutil.virtual_memory().percent > 85:
-                    if mtd.doesExist(omd):
-                        DeleteWorkspace(omd)
+                    with workspace_lock(ows):
+                        if mtd.doesExist(omd):
+                            DeleteWorkspace(omd)
             else:
                 if len(run_key_list) == 0 or psutil.virtual_memory().percent > 85:
-                    if mtd.doesExist(omd):
-                        DeleteWorkspace(omd)
+                    with workspace_lock(ows):
+                        if mtd.doesExist(omd):
+                            DeleteWorkspace(omd)
 
             # if len(key_list) == 0:
             #     MaskBTP(Workspace='sa', Bank=b)
@@ -1823,10 +2097,11 @@ def partial_cleanup(runs, banks, indices, facility, instrument, split_angle, run
 
         else:
 
-            if mtd.doesExist(ows):
-                DeleteWorkspace(ows)
-            if mtd.doesExist('van_'+ows):
-                DeleteWorkspace('van_'+ows)
+            with workspace_lock(ows):
+                if mtd.doesExist(ows):
+                    DeleteWorkspace(ows)
+                if mtd.doesExist('van_'+ows):
+                    DeleteWorkspace('van_'+ows)
 
     return runs_banks, run_keys, bank_keys
 
@@ -1835,7 +2110,9 @@ def integration_loop(keys, inds, proc, outname, ref_dict, int_list, filename, bo
                      outdir, dbgdir, directory, facility, instrument, ipts, runs,
                      split_angle, min_d, min_d_sat, sat_only, a, b, c, alpha, beta, gamma, reflection_condition,
                      mod_vector_1, mod_vector_2, mod_vector_3, max_order, cross_terms,
-                     chemical_formula, z_parameter, sample_mass, elastic, timing_offset, experiment, tmp, cluster):
+                     chemical_formula, z_parameter, sample_mass, elastic, timing_offset, experiment, tmp, cluster,
+                     prefetch=0, prefetch_memory=70, defer_plots=False,
+                     report_policy='all', report_fraction=0.05, report_hkl=None, cache=None, q_index=False, binner=None):
 
     if elastic:
         LoadEmptyInstrument(InstrumentName='CORELLI', OutputWorkspace='CORELLI')
@@ -1977,6 +2254,18 @@ def integration_loop(keys, inds, proc, outname, ref_dict, int_list, filename, bo
     peak_envelope = PeakEnvelope()
     peak_envelope.show_plots(False)
 
+    if defer_plots:
+        payload_file = os.path.join(dbgdir, '{}_plots.pkl'.format(outname))
+        if os.path.exists(payload_file):
+            os.remove(payload_file)
+        peak_envelope.defer_plots(payload_file)
+
+    archive_file = os.path.join(dbgdir, '{}_archive.pkl'.format(outname))
+    if os.path.exists(archive_file):
+        os.remove(archive_file)
+
+    peak_envelope.report_policy(report_policy, report_fraction, report_hkl, archive_file)
+
     DeleteWorkspace('tmp')
 
     norm_scale = {}
@@ -2101,6 +2390,13 @@ def integration_loop(keys, inds, proc, outname, ref_dict, int_list, filename, bo
 
     reason = '   no/ok  '
 
+    if binner is None:
+        prefetcher = PartialLoadPrefetcher(prefetch, prefetch_memory)
+        box_integrate, norm_integrate = box_integrator, norm_integrator
+    else:
+        prefetcher = PartialLoadPrefetcher(0)
+        box_integrate, norm_integrate = binner.box_integrator, binner.norm_integrator
+
     for i, (key, j) in enumerate(zip(keys,inds)):
 
         key = tuple(key)
@@ -2190,9 +2486,20 @@ def integration_loop(keys, inds, proc, outname, ref_dict, int_list, filename, bo
 
         if not remove:
 
-            partial_load(facility, instrument, runs, banks, indices,
-                         phi, chi, omega, norm_scale, split_angle,
-                         dbgdir, ipts, outname, detector_calibration, elastic, timing_offset, experiment, tmp)
+            load_args = peak_load_args(facility, instrument, peak, norm_scale, split_angle, dbgdir, ipts, outname,
+                                       detector_calibration, elastic, timing_offset, experiment, tmp, cache, q_index)
+
+            if binner is None:
+                prefetcher.load(i, load_args)
+            else:
+                binner.load(load_args)
+
+            for i_next in range(i+1, np.min([i+1+prefetcher.lookahead, len(keys)])):
+
+                next_peak = peak_dict[tuple(keys[i_next])][inds[i_next]]
+
+                prefetcher.prefetch(i_next, peak_load_args(facility, instrument, next_peak, norm_scale, split_angle, dbgdir, ipts, outname,
+                                                           detector_calibration, elastic, timing_offset, experiment, tmp, cache, q_index))
 
             rot = True if facility == 'HFIR' else False
 
@@ -2213,7 +2520,7 @@ def integration_loop(keys, inds, proc, outname, ref_dict, int_list, filename, bo
             print(delta_Q0)
             print(n)
 
-            Q, Qx, Qy, Qz, data, norm, mask = box_integrator(facility, instrument, runs, banks, indices, split_angle, Q0, delta_Q0, n, u, v, key,
+            Q, Qx, Qy, Qz, data, norm, mask = box_integrate(facility, instrument, runs, banks, indices, split_angle, Q0, delta_Q0, n, u, v, key,
                                                              binsize=binsize, radius=radius, exp=experiment, close=close)
 
             if not close:
@@ -2366,7 +2673,7 @@ def integration_loop(keys, inds, proc, outname, ref_dict, int_list, filename, bo
 
                 Q0, W, D = ellip.ellipsoid()
 
-                Q, Qx, Qy, Qz, data, norm, mask = box_integrator(facility, instrument, runs, banks, indices, split_angle, Q0, delta_Q0, n, u, v, key,
+                Q, Qx, Qy, Qz, data, norm, mask = box_integrate(facility, instrument, runs, banks, indices, split_angle, Q0, delta_Q0, n, u, v, key,
                                                                  binsize=binsize, radius=radius, exp=experiment, close=close)
 
                 ellip.recenter(Q0)
@@ -2557,12 +2864,12 @@ def integration_loop(keys, inds, proc, outname, ref_dict, int_list, filename, bo
             wls = pk.get_wavelengths()
             ind = np.arange(len(wls))
 
-            pk_env = os.path.join(dbgdir, '{}_{:05d}_{:03d}.png'.format(outname,i,j))
-            ex_env = os.path.join(dbgdir, 'rej_{}_{:05d}_{:03d}.png'.format(outname,i,j))
+            pk_env = os.path.join(dbgdir, '{}.pdf'.format(outname))
+            ex_env = os.path.join(dbgdir, 'rej_{}.pdf'.format(outname))
 
             if not remove:
 
-                Q_bin, Q_rot, Q_radii, Q_scales, signal, error, data_norm, pk_bkg, cntrs = norm_integrator(facility, instrument, runs, banks, indices, split_angle,
+                Q_bin, Q_rot, Q_radii, Q_scales, signal, error, data_norm, pk_bkg, cntrs = norm_integrate(facility, instrument, runs, banks, indices, split_angle,
                                                                                                            Q1, delta_Q1, D1, W1, bins=bins, exp=experiment, close=close)
 
                 dQ1_extents, dQ2_extents, Qp_extents = Q_bin
@@ -2669,7 +2976,7 @@ def integration_loop(keys, inds, proc, outname, ref_dict, int_list, filename, bo
 
                     if not remove:
 
-                        Q_bin, Q_rot, Q_radii, Q_scales, signal, error, data_norm, pk_bkg, cntrs = norm_integrator(facility, instrument, runs, banks, indices, split_angle,
+                        Q_bin, Q_rot, Q_radii, Q_scales, signal, error, data_norm, pk_bkg, cntrs = norm_integrate(facility, instrument, runs, banks, indices, split_angle,
                                                                                                                    Q1, np.zeros(3), D1, W1, bins=[13,13,13], exp=experiment, close=False)
 
                         dQ1_extents, dQ2_extents, Qp_extents = Q_bin
@@ -2791,8 +3098,8 @@ def integration_loop(keys, inds, proc, outname, ref_dict, int_list, filename, bo
                     try_ind = True
                     reason = '   no/ok  '
 
-                    pk_env = os.path.join(dbgdir, 'ind_{}_{:05d}_{:03d}_{:03d}.png'.format(outname,i,j,ind_k))
-                    ex_env = os.path.join(dbgdir, 'rej_ind_{}_{:05d}_{:03d}_{:03d}.png'.format(outname,i,j,ind_k))
+                    pk_env = os.path.join(dbgdir, 'ind_{}.pdf'.format(outname))
+                    ex_env = os.path.join(dbgdir, 'rej_ind_{}.pdf'.format(outname))
 
                     Q2, W2, D2 = Q1.copy(), W1.copy(), D1.copy()
                     Q2_sigs = Q1_sigs.copy()
@@ -2819,7 +3126,7 @@ def integration_loop(keys, inds, proc, outname, ref_dict, int_list, filename, bo
                     iteration = 0
                     while iteration < 2 and try_ind:
 
-                        Q_bin, Q_rot, Q_radii, Q_scales, signal, error, data_norm, pk_bkg, cntrs = norm_integrator(facility, instrument, [ind_run], [ind_bank], [ind_index], split_angle,
+                        Q_bin, Q_rot, Q_radii, Q_scales, signal, error, data_norm, pk_bkg, cntrs = norm_integrate(facility, instrument, [ind_run], [ind_bank], [ind_index], split_angle,
                                                                                                                    Q2, np.zeros(3), D2, W2, bins=[13,13,13], exp=experiment, close=False)
 
                         dQ1_extents, dQ2_extents, Qp_extents = Q_bin
@@ -2988,8 +3295,8 @@ def integration_loop(keys, inds, proc, outname, ref_dict, int_list, filename, bo
                         H, K, L = peak_dictionary.get_hkl(h, k, l, m, n, p)
                         d = peak_dictionary.get_d(h, k, l, m, n, p)
 
-                        pk_env = os.path.join(dbgdir, '{}_{:05d}_{:03d}.png'.format(outname,i,j+(s+1)*100))
-                        ex_env = os.path.join(dbgdir, 'rej_{}_{:05d}_{:03d}.png'.format(outname,i,j+(s+1)*100))
+                        pk_env = os.path.join(dbgdir, '{}.pdf'.format(outname))
+                        ex_env = os.path.join(dbgdir, 'rej_{}.pdf'.format(outname))
 
                         peak_envelope.update_plots(sat_key, d)
 
@@ -3007,7 +3314,7 @@ def integration_loop(keys, inds, proc, outname, ref_dict, int_list, filename, bo
                         sat_Q1, sat_D1, sat_W1 = Q2.copy(), D2.copy(), W2.copy()
                         sat_Q1_sigs = Q2_sigs.copy()
 
-                        Q_bin, Q_rot, Q_radii, Q_scales, signal, error, data_norm, pk_bkg, cntrs = norm_integrator(facility, instrument, runs, banks, indices, split_angle,
+                        Q_bin, Q_rot, Q_radii, Q_scales, signal, error, data_norm, pk_bkg, cntrs = norm_integrate(facility, instrument, runs, banks, indices, split_angle,
                                                                                                                    Q2, np.zeros(3), D2, W2, bins=[13,13,13], exp=experiment, close=False)
 
                         dQ1_extents, dQ2_extents, Qp_extents = Q_bin
@@ -3111,8 +3418,8 @@ def integration_loop(keys, inds, proc, outname, ref_dict, int_list, filename, bo
                                 sat_Q2, sat_D2, sat_W2 = sat_Q1.copy(), sat_D1.copy(), sat_W1.copy()
                                 sat_Q2_sigs = sat_Q1_sigs.copy()
 
-                                pk_env = os.path.join(dbgdir, 'ind_{}_{:05d}_{:03d}_{:03d}.png'.format(outname,i,j+(s+1)*100,sat_k))
-                                ex_env = os.path.join(dbgdir, 'rej_ind_{}_{:05d}_{:03d}_{:03d}.png'.format(outname,i,j+(s+1)*100,sat_k))
+                                pk_env = os.path.join(dbgdir, 'ind_{}.pdf'.format(outname))
+                                ex_env = os.path.join(dbgdir, 'rej_ind_{}.pdf'.format(outname))
 
                                 peak_envelope.update_individual(sat_k, len(indices), wls[sat_k], np.rad2deg(tts[sat_k]), np.rad2deg(azs[sat_k]), ind_run, ind_bank)
 
@@ -3136,7 +3443,7 @@ def integration_loop(keys, inds, proc, outname, ref_dict, int_list, filename, bo
                                 iteration = 0
                                 while iteration < 2 and try_ind:
 
-                                    Q_bin, Q_rot, Q_radii, Q_scales, signal, error, data_norm, pk_bkg, cntrs = norm_integrator(facility, instrument, [ind_run], [ind_bank], [ind_index], split_angle,
+                                    Q_bin, Q_rot, Q_radii, Q_scales, signal, error, data_norm, pk_bkg, cntrs = norm_integrate(facility, instrument, [ind_run], [ind_bank], [ind_index], split_angle,
                                                                                                                                sat_Q2, np.zeros(3), sat_D2, sat_W2, bins=[13,13,13], exp=experiment, close=False)
 
                                     dQ1_extents, dQ2_extents, Qp_extents = Q_bin
@@ -3275,6 +3582,11 @@ def integration_loop(keys, inds, proc, outname, ref_dict, int_list, filename, bo
             runs_banks, run_keys, bank_keys = partial_cleanup(runs, banks, indices, facility, instrument, split_angle,
                                                               runs_banks, run_keys, bank_keys, bank_group, key, exp=experiment)
 
+            if binner is not None:
+                binner.release()
+
+        peak_envelope.report_peak(sig_noise_ratio)
+
         if i % 15 == 0:
 
             peak_summary.flush()
@@ -3292,6 +3604,12 @@ def integration_loop(keys, inds, proc, outname, ref_dict, int_list, filename, bo
     peak_dictionary.save_hkl(os.path.join(dbgdir, '{}.hkl'.format(outname)))
     peak_dictionary.save(os.path.join(dbgdir, '{}.pkl'.format(outname)))
 
+    prefetcher.shutdown()
+
+    if prefetcher.lookahead > 0:
+        prefetcher.write_report(os.path.join(dbgdir, '{}_prefetch.txt'.format(outname)))
+        print('Process {} hid {:.1f} s of {:.1f} s prefetch load time'.format(proc,prefetcher.hidden_time(),prefetcher.prefetch_time))
+
     peak_summary.close()
     excl_summary.close()
 
@@ -3308,98 +3626,86 @@ def integration_loop(keys, inds, proc, outname, ref_dict, int_list, filename, bo
     if mtd.doesExist('van'):
         DeleteWorkspace('van')
 
-    with open(os.path.join(dbgdir, 'ind_{}.pdf'.format(outname)), 'wb') as f:
-        merger = []
-        files = sorted(glob.glob(os.path.join(dbgdir, 'ind_{}_*.png'.format(outname))))
-        for file in files:
-            if os.path.exists(file):
-                with Image.open(file) as im:
-                    fig = file.replace('png','jpg')
-                    im = im.convert('RGB')
-                    im.save(fig, 'JPEG')
-                merger.append(fig)
-        if len(merger) > 0:
-            f.write(img2pdf.convert(merger))
-        else:
-            os.remove(os.path.join(dbgdir, 'ind_{}.pdf'.format(outname)))
-
-    with open(os.path.join(dbgdir, 'rej_ind_{}.pdf'.format(outname)), 'wb') as f:
-        merger = []
-        files = sorted(glob.glob(os.path.join(dbgdir, 'rej_ind_{}_*.png'.format(outname))))
-        for file in files:
-            if os.path.exists(file):
-                with Image.open(file) as im:
-                    fig = file.replace('png','jpg')
-                    im = im.convert('RGB')
-                    im.save(fig, 'JPEG')
-                merger.append(fig)
-        if len(merger) > 0:
-            f.write(img2pdf.convert(merger))
-        else:
-            os.remove(os.path.join(dbgdir, 'rej_ind_{}.pdf'.format(outname)))
-
-    files = glob.glob(os.path.join(dbgdir, 'ind_{}_*.png'.format(outname)))
-    for file in files:
-        if os.path.exists(file):
-            os.remove(file)
-    files = glob.glob(os.path.join(dbgdir, 'rej_ind_{}_*.png'.format(outname)))
-    for file in files:
-        if os.path.exists(file):
-            os.remove(file)
-
-    files = glob.glob(os.path.join(dbgdir, 'ind_{}_*.jpg'.format(outname)))
-    for file in files:
-        if os.path.exists(file):
-            os.remove(file)
-    files = glob.glob(os.path.join(dbgdir, 'rej_ind_{}_*.jpg'.format(outname)))
-    for file in files:
-        if os.path.exists(file):
-            os.remove(file)
-            
-    with open(os.path.join(dbgdir, '{}.pdf'.format(outname)), 'wb') as f:
-        merger = []
-        files = sorted(glob.glob(os.path.join(dbgdir, '{}_*.png'.format(outname))))
-        for file in files:
-            if os.path.exists(file):
-                with Image.open(file) as im:
-                    fig = file.replace('png','jpg')
-                    im = im.convert('RGB')
-                    im.save(fig, 'JPEG')
-                merger.append(fig)
-        if len(merger) > 0:
-            f.write(img2pdf.convert(merger))
-        else:
-            os.remove(os.path.join(dbgdir, '{}.pdf'.format(outname)))
-
-    with open(os.path.join(dbgdir, 'rej_{}.pdf'.format(outname)), 'wb') as f:
-        merger = []
-        files = sorted(glob.glob(os.path.join(dbgdir, 'rej_{}_*.png'.format(outname))))
-        for file in files:
-            if os.path.exists(file):
-                with Image.open(file) as im:
-                    fig = file.replace('png','jpg')
-                    im = im.convert('RGB')
-                    im.save(fig, 'JPEG')
-                merger.append(fig)
-        if len(merger) > 0:
-            f.write(img2pdf.convert(merger))
-        else:
-            os.remove(os.path.join(dbgdir, 'rej_{}.pdf'.format(outname)))
-
-    files = glob.glob(os.path.join(dbgdir, '{}_*.png'.format(outname)))
-    for file in files:
-        if os.path.exists(file):
-            os.remove(file)
-    files = glob.glob(os.path.join(dbgdir, 'rej_{}_*.png'.format(outname)))
-    for file in files:
-        if os.path.exists(file):
-            os.remove(file)
-
-    files = glob.glob(os.path.join(dbgdir, '{}_*.jpg'.format(outname)))
-    for file in files:
-        if os.path.exists(file):
-            os.remove(file)
-    files = glob.glob(os.path.join(dbgdir, 'rej_{}_*.jpg'.format(outname)))
-    for file in files:
-        if os.path.exists(file):
-            os.remove(file)
\ No newline at end of file
+    peak_envelope.flush_plots()
+
+    if not defer_plots:
+        peak_envelope.create_pdf()
+
+def render_report(dbgdir, outname):
+
+    payload_file = os.path.join(dbgdir, '{}_plots.pkl'.format(outname))
+
+    if os.path.exists(payload_file):
+
+        peak_envelope = PeakEnvelope()
+        peak_envelope.show_plots(False)
+        peak_envelope.render_plots(payload_file)
+        peak_envelope.create_pdf()
+
+        os.remove(payload_file)
+
+def merge_reports(outdir, dbgdir, outname, n_proc):
+
+    merger = PdfFileMerger()
+
+    for i in range(n_proc):
+        partfile = os.path.join(dbgdir, outname+'_p{}'.format(i)+'.pdf')
+        if os.path.exists(partfile):
+            merger.append(partfile)
+
+    merger.write(os.path.join(outdir, outname+'.pdf'))       
+    merger.close()
+
+    if os.path.exists(os.path.join(outdir, outname+'.pdf')):
+        for i in range(n_proc):
+            partfile = os.path.join(dbgdir, outname+'_p{}'.format(i)+'.pdf')
+            if os.path.exists(partfile):
+                os.remove(partfile)
+
+    merger = PdfFileMerger()
+
+    for i in range(n_proc):
+        partfile = os.path.join(dbgdir, 'rej_'+outname+'_p{}'.format(i)+'.pdf')
+        if os.path.exists(partfile):
+            merger.append(partfile)
+
+    merger.write(os.path.join(dbgdir, 'rejected.pdf'))       
+    merger.close()
+
+    if os.path.exists(os.path.join(dbgdir, 'rejected.pdf')):
+        for i in range(n_proc):
+            partfile = os.path.join(dbgdir, 'rej_'+outname+'_p{}'.format(i)+'.pdf')
+            if os.path.exists(partfile):
+                os.remove(partfile)
+
+    merger = PdfFileMerger()
+
+    for i in range(n_proc):
+        partfile = os.path.join(dbgdir, 'ind_'+outname+'_p{}'.format(i)+'.pdf')
+        if os.path.exists(partfile):
+            merger.append(partfile)
+
+    merger.write(os.path.join(outdir, outname+'_individual.pdf'))       
+    merger.close()
+
+    if os.path.exists(os.path.join(outdir, outname+'_individual.pdf')):
+        for i in range(n_proc):
+            partfile = os.path.join(dbgdir, 'ind_'+outname+'_p{}'.format(i)+'.pdf')
+            if os.path.exists(partfile):
+                os.remove(partfile)
+
+    merger = PdfFileMerger()
+
+    for i in range(n_proc):
+        partfile = os.path.join(dbgdir, 'rej_ind_'+outname+'_p{}'.format(i)+'.pdf')
+        if os.path.exists(partfile):
+            merger.append(partfile)
+
+    merger.write(os.path.join(dbgdir, 'rejected_individual.pdf'))       
+    merger.close()
+
+    if os.path.exists(os.path.join(dbgdir, 'rejected_individual.pdf')):
+        for i in range(n_proc):
+            partfile = os.path.join(dbgdir, 'rej_ind_'+outname+'_p{}'.format(i)+'.pdf')
+            if os.path.exists(partfile):
+                os.remove(partfile)
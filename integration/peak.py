@@ -15,6 +15,8 @@ import matplotlib as mpl
 import matplotlib.pyplot as plt
 from matplotlib.backends.backend_pdf import PdfPages
 
+from PIL import Image
+
 from matplotlib.patches import Ellipse
 import matplotlib.transforms as transforms
 import matplotlib.gridspec as gridspec
@@ -41,6 +43,10 @@ np.seterr(divide='ignore', invalid='ignore')
 #from sklearn.cluster import MeanShift, estimate_bandwidth
 
 import os
+import io
+import zlib
+import copy
+import hashlib
 import pprint
 import dill as pickle
 
@@ -73,10 +79,114 @@ def _pprint_dict(self, object, stream, indent, allowance, context, level):
     write('}')
 pprint.PrettyPrinter._dispatch[dict.__repr__] = _pprint_dict
 
+class PdfStream:
+
+    def __init__(self, filename):
+
+        self.__file = open(filename, 'wb')
+
+        self.__offsets = {}
+        self.__pages = []
+
+        self.__n = 2
+
+        self.__file.write(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def __write(self, n, content, stream=None):
+
+        self.__offsets[n] = self.__file.tell()
+
+        self.__file.write('{} 0 obj\n{}'.format(n,content).encode())
+
+        if stream is not None:
+            self.__file.write(b'\nstream\n')
+            self.__file.write(stream)
+            self.__file.write(b'\nendstream')
+
+        self.__file.write(b'\nendobj\n')
+
+        return n
+
+    def __object(self, content, stream=None):
+
+        self.__n += 1
+
+        return self.__write(self.__n, content, stream)
+
+    def savefig(self, fig, dpi=100, **kwargs):
+
+        buffer = io.BytesIO()
+
+        fig.savefig(buffer, format='png', dpi=dpi, **kwargs)
+
+        buffer.seek(0)
+
+        image = Image.open(buffer).convert('RGB')
+
+        width, height = image.size
+
+        data = zlib.compress(image.tobytes(), 6)
+
+        del image, buffer
+
+        image = self.__object('<< /Type /XObject /Subtype /Image /Width {} /Height {} /ColorSpace /DeviceRGB '
+                              '/BitsPerComponent 8 /Filter /FlateDecode /Length {} >>'.format(width,height,len(data)), data)
+
+        w, h = width*72/dpi, height*72/dpi
+
+        data = 'q {:.2f} 0 0 {:.2f} 0 0 cm /Im0 Do Q'.format(w,h).encode()
+
+        content = self.__object('<< /Length {} >>'.format(len(data)), data)
+
+        page = self.__object('<< /Type /Page /Parent 2 0 R /MediaBox [0 0 {:.2f} {:.2f}] '
+                             '/Resources << /XObject << /Im0 {} 0 R >> >> /Contents {} 0 R >>'.format(w,h,image,content))
+
+        self.__pages.append(page)
+
+    def close(self):
+
+        kids = ' '.join(['{} 0 R'.format(page) for page in self.__pages])
+
+        self.__write(2, '<< /Type /Pages /Kids [{}] /Count {} >>'.format(kids,len(self.__pages)))
+        self.__write(1, '<< /Type /Catalog /Pages 2 0 R >>')
+
+        xref = self.__file.tell()
+
+        self.__file.write('xref\n0 {}\n'.format(self.__n+1).encode())
+        self.__file.write(b'0000000000 65535 f \n')
+
+        for n in range(1, self.__n+1):
+            self.__file.write('{:010d} 00000 n \n'.format(self.__offsets[n]).encode())
+
+        self.__file.write('trailer\n<< /Size {} /Root 1 0 R >>\nstartxref\n{}\n%%EOF\n'.format(self.__n+1,xref).encode())
+
+        self.__file.close()
+
 class PeakEnvelope:
 
     def __init__(self):
 
+        self.fig = None
+
+        self.pp = {}
+
+        self.__show_plots = False
+
+        self.__payload_file = None
+        self.__archive_file = None
+
+        self.__calls = []
+        self.__figures = []
+
+        self.__replay = False
+
+        self.__key = None
+        self.__d = None
+
+        self.report_policy('all')
+
+    def __create_figure(self):
+
         plt.close('peak-envelope')
 
         self.fig = plt.figure(num='peak-envelope', figsize=(20,12), dpi=144)
@@ -500,10 +610,140 @@ class PeakEnvelope:
         self.cb.ax.minorticks_on()
         self.cb2.ax.minorticks_on()
 
-        self.__show_plots = False
+        for ax in self.fig.axes:
+            ax.set_rasterization_zorder(2.4)
+
+    def __recording(self):
+
+        if self.__replay:
+            return False
+
+        return self.__payload_file is not None or 'all' not in self.__policy
+
+    def __record(self, name, *args):
+
+        if not self.__recording():
+            if self.fig is None:
+                self.__create_figure()
+            return False
+
+        if name == 'clear_plots':
+            self.flush_plots()
+            self.__calls = []
+            self.__key, self.__d = args[0], args[1]
+
+        self.__calls.append((name, copy.deepcopy(args)))
+
+        return True
+
+    def __render(self, figures, figname=None):
+
+        self.__replay = True
+
+        for name, calls in figures:
+            for call, args in calls:
+                getattr(self, call)(*args)
+            self.write_figure(name if figname is None else figname)
+
+        self.__replay = False
+
+    def __requested(self, key):
+
+        for hkl in self.__hkls:
+            if len(hkl) == 3 and np.allclose(key[3:], 0) and np.allclose(key[:3], hkl):
+                return True
+            elif len(hkl) == 6 and np.allclose(key, hkl):
+                return True
+
+        return False
+
+    def defer_plots(self, payload_file):
+
+        self.flush_plots()
+
+        self.__payload_file = payload_file
+        self.__calls = []
+
+    def report_policy(self, policy, fraction=0.05, hkls=None, archive_file=None, seed=0):
+
+        self.__policy = policy if type(policy) is list else [policy]
+
+        if hkls is None:
+            hkls = []
+        elif len(hkls) > 0 and type(hkls[0]) is not list:
+            hkls = [hkls]
+
+        self.__hkls = hkls
+        self.__fraction = fraction
+        self.__archive_file = archive_file
+
+        self.__d_bins = [0.5, 0.75, 1, 1.5, 2, 3, 5]
+        self.__sig_bins = [1, 3, 10, 30, 100]
+
+        self.__strata = {}
+        self.__rng = np.random.default_rng(seed)
+
+    def report_peak(self, sig_noise_ratio):
+
+        if len(self.__figures) == 0 or 'all' in self.__policy:
+            return
+
+        flagged = any([os.path.basename(figname).startswith('rej_') for figname, _ in self.__figures])
+
+        stratum = (np.digitize(self.__d, self.__d_bins), np.digitize(sig_noise_ratio, self.__sig_bins))
+
+        seen, shown = self.__strata.get(stratum, (0, 0))
+
+        selected = ('flagged' in self.__policy and flagged) \
+                or ('hkl' in self.__policy and self.__requested(self.__key)) \
+                or ('sample' in self.__policy and shown < self.__fraction*seen+1) \
+                or ('random' in self.__policy and self.__rng.random() < self.__fraction)
+
+        self.__strata[stratum] = (seen+1, shown+selected)
+
+        if selected:
+            self.flush_plots()
+        else:
+            if self.__archive_file is not None:
+                with open(self.__archive_file, 'ab') as f:
+                    pickle.dump((self.__key, self.__figures), f)
+            self.__figures = []
+
+    def flush_plots(self):
+
+        figures, self.__figures = self.__figures, []
+
+        if len(figures) > 0:
+            if self.__payload_file is not None:
+                with open(self.__payload_file, 'ab') as f:
+                    pickle.dump((self.__key, figures), f)
+            else:
+                self.__render(figures)
+
+    def render_plots(self, payload_file, hkls=None, figname=None):
+
+        self.defer_plots(None)
+
+        if hkls is not None:
+            self.report_policy('hkl', hkls=hkls)
+
+        if os.path.exists(payload_file):
+            with open(payload_file, 'rb') as f:
+                while True:
+                    try:
+                        key, figures = pickle.load(f)
+                    except EOFError:
+                        break
+                    if hkls is None or self.__requested(key):
+                        self.__render(figures, figname)
+
+        self.report_policy('all')
 
     def update_plots(self, key, d):
 
+        if self.__record('update_plots', key, d):
+            return
+
         h, k, l, m, n, p = key
 
         if m**2+n**2+p**2 > 0:
@@ -515,6 +755,9 @@ class PeakEnvelope:
 
     def clear_plots(self, key, d, lamda, two_theta, az_phi, n_runs):
 
+        if self.__record('clear_plots', key, d, lamda, two_theta, az_phi, n_runs):
+            return
+
         h, k, l, m, n, p = key
 
         if m**2+n**2+p**2 > 0:
@@ -959,10 +1202,16 @@ class PeakEnvelope:
 
     def create_pdf(self):
 
-        self.pp.close()
+        for pp in self.pp.values():
+            pp.close()
+
+        self.pp = {}
 
     def plot_Q(self, x, y, y0, yerr, y_fit, y_bkg):
 
+        if self.__record('plot_Q', x, y, y0, yerr, y_fit, y_bkg):
+            return
+
         if np.any(y > 0):
 
             barsy_p, = self.bars_Q_p
@@ -984,6 +1233,9 @@ class PeakEnvelope:
 
     def plot_extracted_Q(self, x, y, y0, yerr, y_fit, y_bkg, chi_sq):
 
+        if self.__record('plot_extracted_Q', x, y, y0, yerr, y_fit, y_bkg, chi_sq):
+            return
+
         if np.any(y > 0):
 
             barsy_p, = self.bars_Q2_p
@@ -1007,6 +1259,9 @@ class PeakEnvelope:
 
     def plot_projection(self, z, z0, x_extents, y_extents, mu, sigma, rho, chi_sq):
 
+        if self.__record('plot_projection', z, z0, x_extents, y_extents, mu, sigma, rho, chi_sq):
+            return
+
         z[z <= 0] = np.nan
         z0[z0 <= 0] = np.nan
 
@@ -1053,6 +1308,9 @@ class PeakEnvelope:
 
     def plot_extracted_projection(self, z, z0, x_extents, y_extents, mu, sigma, rho, chi_sq):
 
+        if self.__record('plot_extracted_projection', z, z0, x_extents, y_extents, mu, sigma, rho, chi_sq):
+            return
+
         z[z <= 0] = np.nan
         z0[z0 <= 0] = np.nan
 
@@ -1099,6 +1357,9 @@ class PeakEnvelope:
 
     def update_ellipse(self, mu, sigma, rho):
 
+        if self.__record('update_ellipse', mu, sigma, rho):
+            return
+
         mu_x, mu_y = mu
         sigma_x, sigma_y = sigma
 
@@ -1120,6 +1381,9 @@ class PeakEnvelope:
 
     def update_ellipse2(self, mu, sigma, rho):
 
+        if self.__record('update_ellipse2', mu, sigma, rho):
+            return
+
         mu_x, mu_y = mu
         sigma_x, sigma_y = sigma
 
@@ -1141,6 +1405,9 @@ class PeakEnvelope:
 
     def plot_integration(self, signal, u_extents, v_extents, Q_extents, centers, radii, scales):
 
+        if self.__record('plot_integration', signal, u_extents, v_extents, Q_extents, centers, radii, scales):
+            return
+
         self.trans_peak_pu.clear()
         self.trans_inner_pu.clear()
         self.trans_outer_pu.clear()
@@ -1341,6 +1608,9 @@ class PeakEnvelope:
 
     def plot_extracted_integration(self, signal, u_extents, v_extents, Q_extents, centers, radii, scales):
 
+        if self.__record('plot_extracted_integration', signal, u_extents, v_extents, Q_extents, centers, radii, scales):
+            return
+
         self.trans_peak_pu2.clear()
         self.trans_inner_pu2.clear()
         self.trans_outer_pu2.clear()
@@ -1541,6 +1811,9 @@ class PeakEnvelope:
 
     def plot_fitting(self, signal, I, sig, chi_sq):
 
+        if self.__record('plot_fitting', signal, I, sig, chi_sq):
+            return
+
         Qu = np.nansum(signal, axis=1)
         Qv = np.nansum(signal, axis=0)
         uv = np.nansum(signal, axis=2).T
@@ -1566,6 +1839,9 @@ class PeakEnvelope:
 
     def plot_extracted_fitting(self, signal, I, sig, chi_sq):
 
+        if self.__record('plot_extracted_fitting', signal, I, sig, chi_sq):
+            return
+
         Qu = np.nansum(signal, axis=1)
         Qv = np.nansum(signal, axis=0)
         uv = np.nansum(signal, axis=2).T
@@ -1591,6 +1867,9 @@ class PeakEnvelope:
 
     def update_individual(self, ind, no, lamda, two_theta, az_phi, run, bank):
 
+        if self.__record('update_individual', ind, no, lamda, two_theta, az_phi, run, bank):
+            return
+
         if type(lamda) is list:
             self.ax_Qu2.set_title('')
             self.ax_Qv2.set_title('')
@@ -1623,8 +1902,18 @@ class PeakEnvelope:
 
     def write_figure(self, figname):
 
+        if self.__recording():
+            self.__figures.append((figname, list(self.__calls)))
+            return
+
+        if self.fig is None:
+            self.__create_figure()
+
+        if self.pp.get(figname) is None:
+            self.pp[figname] = PdfStream(figname)
+
         try:
-            self.fig.savefig(figname, dpi=100, facecolor='white', transparent=False)
+            self.pp[figname].savefig(self.fig, dpi=100, facecolor='white', transparent=False)
         except:
             pass
 
@@ -2074,6 +2363,16 @@ class PeakInformation:
 
         return np.round(a, d).tolist()
 
+    def fingerprint(self):
+
+        outputs = ['good_indices', 'intens_fit', 'sig_fit', 'sat_intens_fit', 'sat_sig_fit', 'ind_intens_fit', 'ind_sig_fit']
+        corrections = ['data_scale', 'norm_scale', 't', 'tbar']
+        outputs = ['_PeakInformation__'+output for output in outputs+corrections]
+
+        state = [(name, value) for name, value in sorted(self.__dict__.items()) if name not in outputs]
+
+        return hashlib.sha1(pickle.dumps(state)).hexdigest()
+
     def dictionary(self):
 
         d = { 'PeakNumber': self.__peak_num,
@@ -3443,6 +3742,11 @@ class PeakDictionary:
         self.z_parameter = 0
         self.chemical_formula = None
 
+        self.__absorption_sphere = None
+        self.__absorption_ellipsoid = {}
+        self.__absorption_polyhedron = {}
+        self.__extinction_tables = {}
+
         self.sample_name = sample+'_' if type(sample) is str else ''
 
         CreatePeaksWorkspace(NumberOfPeaks=0, OutputType='LeanElasticPeak', OutputWorkspace=self.sample_name+'pws')
@@ -3603,7 +3907,9 @@ class PeakDictionary:
 
        ol.setModUB(mod_UB)
 
-    def __reset_peaks(self):
+    def __reset_peaks(self, keys=None):
+
+        keys = set(keys) if keys is not None else None
 
         DeleteTableRows(TableWorkspace=self.pws, Rows=range(self.pws.getNumberPeaks()))
 
@@ -3624,7 +3930,7 @@ class PeakDictionary:
 
             for peak in peaks:
 
-                if peak.is_peak_integrated():
+                if peak.is_peak_integrated() and (keys is None or key in keys):
                     peak.individual_integrate()
                     peak.prune_peaks()
                     peak.integrate()
@@ -5201,16 +5507,34 @@ class PeakDictionary:
 
             pickle.dump(self.peak_dict, f)
 
-    def load(self, filename):
+    def load(self, filename, keys=None):
 
         self.peak_dict = self.load_dictionary(filename)
 
+        if keys is not None:
+            return
+
         self.__reset_peaks()
 
         self.clear_peaks()
 
         self.repopulate_workspaces()
 
+    def integrate_peaks(self, keys=None):
+
+        keys = self.peak_dict.keys() if keys is None else keys
+
+        for key in keys:
+
+            for peak in self.peak_dict.get(key, []):
+
+                if peak.is_peak_integrated():
+                    peak.individual_integrate()
+                    peak.prune_peaks()
+                    peak.integrate()
+
+        self.__reset_peaks([])
+
     def load_dictionary(self, filename):
 
         ol = self.pws.sample().getOrientedLattice()
@@ -5369,16 +5693,18 @@ class PeakDictionary:
 
     def __spherical_absorption(self):
 
-        filename = os.path.join(os.path.dirname(__file__), 'absorption_sphere.csv')
+        if self.__absorption_sphere is None:
+
+            filename = os.path.join(os.path.dirname(__file__), 'absorption_sphere.csv')
 
-        data = np.loadtxt(filename, skiprows=1, delimiter=',', usecols=np.arange(1,92))
+            data = np.loadtxt(filename, skiprows=1, delimiter=',', usecols=np.arange(1,92))
 
-        muR = np.loadtxt(filename, skiprows=1, delimiter=',', usecols=(0))
-        theta = np.loadtxt(filename, delimiter=',', max_rows=1, usecols=np.arange(1,92))
+            muR = np.loadtxt(filename, skiprows=1, delimiter=',', usecols=(0))
+            theta = np.loadtxt(filename, delimiter=',', max_rows=1, usecols=np.arange(1,92))
 
-        f = scipy.interpolate.interp2d(muR, 2*theta, data.T, kind='cubic')
+            self.__absorption_sphere = scipy.interpolate.RectBivariateSpline(muR, 2*theta, data, kx=3, ky=3)
 
-        return f
+        return self.__absorption_sphere
 
     def __material_constants(self):
 
@@ -5482,57 +5808,45 @@ class PeakDictionary:
 
                 absorption_file.close()
 
-            for key in self.peak_dict.keys():
+            peaks = [peak for key in self.peak_dict.keys() for peak in self.peak_dict[key]]
 
-                peaks = self.peak_dict.get(key)
-
-                for peak in peaks:
-
-                    wls = peak.get_wavelengths()
-                    two_thetas = peak.get_scattering_angles()
+            if len(peaks) > 0:
 
-                    Astar, Astar_van, T, Tbar = [], [], [], []
+                wls = [peak.get_wavelengths() for peak in peaks]
+                two_thetas = [peak.get_scattering_angles() for peak in peaks]
 
-                    for wl, two_theta in zip(wls, two_thetas):
+                split = np.cumsum([len(wl) for wl in wls])[:-1]
 
-                        mu = n*(sigma_s+sigma_a*wl/1.8) # barn / ang^3 = 1/cm
-                        muR = mu*R
+                wl, two_theta = np.concatenate(wls), np.rad2deg(np.concatenate(two_thetas))
 
-                        # print('wavelength: {} ang'.format(wl))
-                        # print('2theta: {} deg'.format(np.rad2deg(two_theta)))
-                        # print('linear absorption coefficient: {} 1/cm'.format(mu))
+                mu = n*(sigma_s+sigma_a*wl/1.8) # barn / ang^3 = 1/cm
+                muR = mu*R
 
-                        correction = f(muR,np.rad2deg(two_theta))[0]
-                        Astar.append(correction)
+                Astar = f.ev(muR, two_theta)
 
-                        transmission = 1/correction
-                        T.append(transmission)
+                T = 1/Astar
+                Tbar = R*f.ev(muR, two_theta, dx=1)/Astar
 
-                        length = R*f(muR, np.rad2deg(two_theta), dx=1)[0]/f(muR, np.rad2deg(two_theta))[0]
-                        Tbar.append(length)
+                # --- 
 
-                        # --- 
+                van_mu = van_n*(van_sigma_s+van_sigma_a*wl/1.8)
+                van_muR = van_mu*van_R
 
-                        van_mu = van_n*(van_sigma_s+van_sigma_a*wl/1.8)
-                        van_muR = van_mu*van_R
+                Astar_van = f.ev(van_muR, two_theta)*0+1 # sq sf * np.exp(4*np.pi**2*Uiso/d**2)
 
-                        # print('linear absorption coefficient: {} 1/cm'.format(mu))
+                for peak, A, A_van, t, tbar in zip(peaks, np.split(Astar, split), np.split(Astar_van, split),
+                                                   np.split(T, split), np.split(Tbar, split)):
 
-                        d = 0.5*wl/np.sin(two_theta)
+                    peak.set_data_scale(A)
+                    peak.set_norm_scale(A_van)
 
-                        correction = f(van_muR,np.rad2deg(two_theta))[0]*0+1
-                        Astar_van.append(correction) # sq sf * np.exp(4*np.pi**2*Uiso/d**2)
-
-                    peak.set_data_scale(Astar)
-                    peak.set_norm_scale(Astar_van)
-
-                    peak.set_transmission_coefficient(T)
-                    peak.set_weighted_mean_path_length(Tbar)
+                    peak.set_transmission_coefficient(t)
+                    peak.set_weighted_mean_path_length(tbar)
 
             self.clear_peaks()
             self.repopulate_workspaces()
 
-    def apply_ellipsoidal_correction(self, vanadium_mass=0, ratios=[1,1,1], polar=np.pi/2, azimuthal=np.pi/2, omega=0, fname=None):
+    def apply_ellipsoidal_correction(self, vanadium_mass=0, ratios=[1,1,1], polar=np.pi/2, azimuthal=np.pi/2, omega=0, fname=None, cache_dir=None):
 
         if fname is not None:
             absorption_file = open(fname, 'w')
@@ -5636,46 +5950,54 @@ class PeakDictionary:
                           [uy*ux*(1-np.cos(omega))+uz*np.sin(omega), np.cos(omega)+uy**2*(1-np.cos(omega)), uy*uz*(1-np.cos(omega))-ux*np.sin(omega)],
                           [uz*ux*(1-np.cos(omega))-uy*np.sin(omega), uz*uy*(1-np.cos(omega))+ux*np.sin(omega), np.cos(omega)+uz**2*(1-np.cos(omega))]])
 
-            for key in self.peak_dict.keys():
+            if cache_dir is None and fname is not None:
+                cache_dir = os.path.dirname(fname)
 
-                peaks = self.peak_dict.get(key)
+            peaks = [peak for key in self.peak_dict.keys() for peak in self.peak_dict[key]]
 
-                for peak in peaks:
+            if len(peaks) > 0:
 
-                    wls = peak.get_wavelengths()
-                    two_thetas = peak.get_scattering_angles()
-                    az_phis = peak.get_azimuthal_angles()
-                    
-                    Rs = np.array(peak.get_goniometers())
+                wls = [peak.get_wavelengths() for peak in peaks]
 
-                    kx_hat = np.sin(two_thetas)*np.cos(az_phis)
-                    ky_hat = np.sin(two_thetas)*np.sin(az_phis)
-                    kz_hat = np.cos(two_thetas)-1
+                split = np.cumsum([len(wl) for wl in wls])[:-1]
 
-                    ix = np.zeros_like(kx_hat)
-                    iy = np.zeros_like(ky_hat)
-                    iz = np.ones_like(kz_hat)
+                wls = np.concatenate(wls)
+                two_thetas = np.concatenate([peak.get_scattering_angles() for peak in peaks])
+                az_phis = np.concatenate([peak.get_azimuthal_angles() for peak in peaks])
 
-                    fx = -(ix+kx_hat)
-                    fy = -(iy+ky_hat)
-                    fz = -(iz+kz_hat)
+                Rs = np.concatenate([np.array(peak.get_goniometers()).reshape(-1,3,3) for peak in peaks])
 
-                    i1, i2, i3 = np.einsum('kji,jk->ik', Rs, np.einsum('ji,jk->ik', U, [ix, iy, iz])) 
-                    f1, f2, f3 = np.einsum('kji,jk->ik', Rs, np.einsum('ji,jk->ik', U, [fx, fy, fz]))
+                kx_hat = np.sin(two_thetas)*np.cos(az_phis)
+                ky_hat = np.sin(two_thetas)*np.sin(az_phis)
+                kz_hat = np.cos(two_thetas)-1
 
-                    mu = n*(sigma_s+sigma_a*wls/1.8)
+                ix = np.zeros_like(kx_hat)
+                iy = np.zeros_like(ky_hat)
+                iz = np.ones_like(kz_hat)
 
-                    T, Tbar = self.__ellipsoid_absorption(mu, a1, a2, a3, i1, i2, i3, f1, f2, f3)
+                fx = -(ix+kx_hat)
+                fy = -(iy+ky_hat)
+                fz = -(iz+kz_hat)
 
-                    Astar = 1/T
+                i1, i2, i3 = np.einsum('kji,jk->ik', Rs, np.einsum('ji,jk->ik', U, [ix, iy, iz])) 
+                f1, f2, f3 = np.einsum('kji,jk->ik', Rs, np.einsum('ji,jk->ik', U, [fx, fy, fz]))
 
-                    Astar_van = Astar*0+1
+                mu = n*(sigma_s+sigma_a*wls/1.8)
 
-                    peak.set_data_scale(Astar)
-                    peak.set_norm_scale(Astar_van)
+                T, Tbar = self.__ellipsoid_absorption(mu, a1, a2, a3, i1, i2, i3, f1, f2, f3, cache_dir=cache_dir)
 
-                    peak.set_transmission_coefficient(T)
-                    peak.set_weighted_mean_path_length(Tbar)
+                Astar = 1/T
+
+                Astar_van = Astar*0+1
+
+                for peak, A, A_van, t, tbar in zip(peaks, np.split(Astar, split), np.split(Astar_van, split),
+                                                          np.split(T, split), np.split(Tbar, split)):
+
+                    peak.set_data_scale(A)
+                    peak.set_norm_scale(A_van)
+
+                    peak.set_transmission_coefficient(t)
+                    peak.set_weighted_mean_path_length(tbar)
 
             self.clear_peaks()
             self.repopulate_workspaces()
@@ -5684,7 +6006,50 @@ class PeakDictionary:
 
         return scipy.integrate.simpson(scipy.integrate.simpson(scipy.integrate.simpson(f*R.reshape(-1,1)**2*np.sin(p1.reshape(-1,1,1)), R, axis=2), p1, axis=1), alpha, axis=0)
 
-    def __ellipsoid_absorption(self, mu, a1, a2, a3, i1, i2, i3, f1, f2, f3, N=12):
+    def __ellipsoid_moments(self, N=12, n_phi=181, cache_dir=None):
+
+        key = (N, n_phi)
+
+        if self.__absorption_ellipsoid.get(key) is None:
+
+            filename = None
+            if cache_dir is not None:
+                filename = os.path.join(cache_dir, 'absorption_ellipsoid_N{}_phi{}.npz'.format(*key))
+
+            phi = np.linspace(0,np.pi,n_phi)
+
+            if filename is not None and os.path.exists(filename):
+
+                V = np.load(filename)['V']
+
+            else:
+
+                R = np.linspace(0,1,11)
+                p1 = np.linspace(0,np.pi,31)
+                alpha = np.linspace(0,2*np.pi,61)
+
+                p2 = np.zeros_like(R.reshape(-1,1))+np.arccos(np.cos(p1.reshape(-1,1,1))*np.cos(np.pi-phi)+np.sin(p1.reshape(-1,1,1))*np.sin(np.pi-phi)*np.cos(alpha.reshape(-1,1,1,1)))
+
+                f1 = R.reshape(-1,1)*np.cos(p1.reshape(-1,1,1))+np.sqrt(1-R.reshape(-1,1)**2*np.sin(p1.reshape(-1,1,1))**2)+np.zeros_like(alpha.reshape(-1,1,1,1))
+                f2 = R.reshape(-1,1)*np.cos(p2                )+np.sqrt(1-R.reshape(-1,1)**2*np.sin(p2                )**2)+np.zeros_like(alpha.reshape(-1,1,1,1))
+
+                V = np.zeros((N+1,N+1,n_phi))
+
+                for p in range(N+1):
+                    for q in range(N+1-p):
+                        V[p,q,:] = self.__volume_integral(f1**p*f2**q, p1, alpha, R)
+
+                if filename is not None:
+                    try:
+                        np.savez(filename, V=V)
+                    except OSError:
+                        pass
+
+            self.__absorption_ellipsoid[key] = scipy.interpolate.CubicSpline(phi, V, axis=2)
+
+        return self.__absorption_ellipsoid[key]
+
+    def __ellipsoid_absorption(self, mu, a1, a2, a3, i1, i2, i3, f1, f2, f3, N=12, cache_dir=None):
 
         I1, I2, I3 = i1/a1, i2/a2, i3/a3
         F1, F2, F3 = f1/a1, f2/a2, f3/a3
@@ -5692,22 +6057,17 @@ class PeakDictionary:
         I = np.sqrt(I1**2+I2**2+I3**2)
         F = np.sqrt(F1**2+F2**2+F3**2)
 
-        phi = np.arccos(-(I1*F1+I2*F2+I3*F3)/I/F)
+        phi = np.arccos(np.clip(-(I1*F1+I2*F2+I3*F3)/I/F, -1, 1))
 
-        R = np.linspace(0,1,11)
-        p1 = np.linspace(0,np.pi,31)
-        alpha = np.linspace(0,2*np.pi,61)
+        mu, I, F, phi = np.broadcast_arrays(mu, I, F, phi)
 
-        p2 = np.zeros_like(R.reshape(-1,1))+np.arccos(np.cos(p1.reshape(-1,1,1))*np.cos(np.pi-phi)+np.sin(p1.reshape(-1,1,1))*np.sin(np.pi-phi)*np.cos(alpha.reshape(-1,1,1,1)))
+        n = np.size(phi)
 
-        f1 = R.reshape(-1,1)*np.cos(p1.reshape(-1,1,1))+np.sqrt(1-R.reshape(-1,1)**2*np.sin(p1.reshape(-1,1,1))**2)+np.zeros_like(alpha.reshape(-1,1,1,1))
-        f2 = R.reshape(-1,1)*np.cos(p2                )+np.sqrt(1-R.reshape(-1,1)**2*np.sin(p2                )**2)+np.zeros_like(alpha.reshape(-1,1,1,1))
+        V = self.__ellipsoid_moments(N, cache_dir=cache_dir)(phi.flatten())
 
-        n = 1
-        if np.size(phi) > 1:
-            n = np.size(phi)
-        else:
-            n = np.size(mu)
+        x, y = (mu/I).flatten(), (mu/F).flatten()
+
+        mu = mu.flatten()
 
         a = np.zeros((N+1,n))
         t = np.zeros((N+1,n))
@@ -5715,8 +6075,8 @@ class PeakDictionary:
         for j in range(N+1):
             f = 0
             for p in range(j+1):
-                f += scipy.special.comb(j,p)/I**p/F**(j-p)*f1**p*f2**(j-p)
-            a[j,:] = 3/4/np.pi/scipy.special.factorial(j)*mu**j*self.__volume_integral(f, p1, alpha, R)
+                f += scipy.special.comb(j,p)*x**p*y**(j-p)*V[p,j-p,:]
+            a[j,:] = 3/4/np.pi/scipy.special.factorial(j)*f
             t[j,:] = a[j,:]*j/mu
 
         da = np.zeros((N+1,N+1,n))
@@ -5739,6 +6099,159 @@ class PeakDictionary:
 
         return A, Tbar
 
+    def apply_polyhedral_correction(self, faces, vanadium_mass=0, n_grid=12, fname=None):
+
+        if fname is not None:
+            absorption_file = open(fname, 'w')
+
+        chemical_formula = self.chemical_formula
+
+        if chemical_formula is not None:
+
+            mat_dict = self.__material_constants()
+
+            atms = [atm.replace('(','').replace(')','').rstrip('1234567890.') for atm in chemical_formula.split(' ')]
+            pres = [re.findall('(?:\d+)', atm)[0] if '(' in atm else '' for atm in chemical_formula.split(' ')]
+            atms = [pre+atm for pre, atm in zip(pres,atms)]
+            n_atms = [float(atm.replace(atm.rstrip('1234567890.'), '')) for atm in chemical_formula.split(' ')]
+
+            x_tot = [mat_dict[atm][0] for atm in atms]
+            x_abs = [mat_dict[atm][1] for atm in atms]
+
+            chemical_formula = '-'.join(chemical_formula.split(' '))
+
+            m, M, n, N, rho, V, R = self.__equivalent_sphere()
+
+            sigma_a = np.dot(n_atms, x_abs)/N
+            sigma_s = np.dot(n_atms, x_tot)/N
+
+            normals, d, P, W, volume, vertices = self.__polyhedron_grid(faces, n_grid)
+
+            if fname is not None:
+
+                absorption_file.write('{}\n'.format(chemical_formula))
+                absorption_file.write('absoption cross section: {:.4f} barn\n'.format(sigma_a))
+                absorption_file.write('scattering cross section: {:.4f} barn\n'.format(sigma_s))
+
+                absorption_file.write('linear absorption coefficient: {:.4f} 1/cm\n'.format(n*sigma_a))
+                absorption_file.write('linear scattering coefficient: {:.4f} 1/cm\n'.format(n*sigma_s))
+
+                absorption_file.write('mass: {:.4f} g\n'.format(m))
+                absorption_file.write('density: {:.4f} g/cm^3\n'.format(rho))
+
+                absorption_file.write('volume: {:.4f} cm^3\n'.format(V))
+                absorption_file.write('polyhedron volume: {:.4f} cm^3\n'.format(volume))
+
+                for face in faces:
+                    absorption_file.write('face ({} {} {}): {:.4f} cm\n'.format(*face))
+
+                absorption_file.write('grid points: {}\n'.format(W.size))
+
+                absorption_file.write('total atoms: {:.4f}\n'.format(N))
+                absorption_file.write('molar mass: {:.4f} g/mol\n'.format(M))
+                absorption_file.write('number density: {:.4f} 1/A^3\n'.format(n))
+
+                absorption_file.close()
+
+            peaks = [peak for key in self.peak_dict.keys() for peak in self.peak_dict[key]]
+
+            if len(peaks) > 0:
+
+                wls = [peak.get_wavelengths() for peak in peaks]
+
+                split = np.cumsum([len(wl) for wl in wls])[:-1]
+
+                wls = np.concatenate(wls)
+                two_thetas = np.concatenate([peak.get_scattering_angles() for peak in peaks])
+                az_phis = np.concatenate([peak.get_azimuthal_angles() for peak in peaks])
+
+                Rs = np.concatenate([np.array(peak.get_goniometers()).reshape(-1,3,3) for peak in peaks])
+
+                ki = np.column_stack([np.zeros_like(two_thetas), np.zeros_like(two_thetas), np.ones_like(two_thetas)])
+                kf = np.column_stack([np.sin(two_thetas)*np.cos(az_phis), np.sin(two_thetas)*np.sin(az_phis), np.cos(two_thetas)])
+
+                ki = np.einsum('kji,kj->ki', Rs, ki)
+                kf = np.einsum('kji,kj->ki', Rs, kf)
+
+                mu = n*(sigma_s+sigma_a*wls/1.8)
+
+                T, Tbar = self.__polyhedron_absorption(mu, ki, kf, normals, d, P, W)
+
+                Astar = 1/T
+
+                Astar_van = Astar*0+1
+
+                for peak, A, A_van, t, tbar in zip(peaks, np.split(Astar, split), np.split(Astar_van, split),
+                                                          np.split(T, split), np.split(Tbar, split)):
+
+                    peak.set_data_scale(A)
+                    peak.set_norm_scale(A_van)
+
+                    peak.set_transmission_coefficient(t)
+                    peak.set_weighted_mean_path_length(tbar)
+
+            self.clear_peaks()
+            self.repopulate_workspaces()
+
+    def __polyhedron_grid(self, faces, n_grid=12):
+
+        UB = self.iws.sample().getOrientedLattice().getUB()
+
+        key = (tuple([tuple(face) for face in faces]), n_grid, tuple(np.round(UB, 8).flatten()))
+
+        if self.__absorption_polyhedron.get(key) is None:
+
+            hkl, d = np.array(faces, dtype=float)[:,:3], np.array(faces, dtype=float)[:,3]
+
+            normals = np.einsum('ij,kj->ki', UB, hkl)
+            normals /= np.linalg.norm(normals, axis=1).reshape(-1,1)
+
+            hs = scipy.spatial.HalfspaceIntersection(np.column_stack((normals, -d)), np.zeros(3))
+
+            vertices = hs.intersections
+            volume = scipy.spatial.ConvexHull(vertices).volume
+
+            x, w = np.polynomial.legendre.leggauss(n_grid)
+
+            lower, upper = vertices.min(axis=0), vertices.max(axis=0)
+
+            center, half = (upper+lower)/2, (upper-lower)/2
+
+            P = np.stack(np.meshgrid(*[center[i]+half[i]*x for i in range(3)], indexing='ij'), axis=-1).reshape(-1,3)
+            W = np.einsum('i,j,k->ijk', *[half[i]*w for i in range(3)]).flatten()
+
+            mask = np.all(np.dot(P, normals.T) <= d, axis=1)
+
+            self.__absorption_polyhedron[key] = normals, d, P[mask], W[mask], volume, vertices
+
+        return self.__absorption_polyhedron[key]
+
+    def __path_length(self, u, normals, r):
+
+        nu = np.dot(u, normals.T)
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            t = np.where(nu[:,np.newaxis,:] > 0, r[np.newaxis,:,:]/nu[:,np.newaxis,:], np.inf)
+
+        return t.min(axis=2)
+
+    def __polyhedron_absorption(self, mu, ki, kf, normals, d, P, W, chunk=256):
+
+        r = d-np.dot(P, normals.T)
+
+        T, Tbar = np.zeros(mu.size), np.zeros(mu.size)
+
+        for i in range(0, mu.size, chunk):
+
+            L = self.__path_length(-ki[i:i+chunk], normals, r)+self.__path_length(kf[i:i+chunk], normals, r)
+
+            att = np.exp(-mu[i:i+chunk].reshape(-1,1)*L)
+
+            T[i:i+chunk] = np.dot(att, W)/W.sum()
+            Tbar[i:i+chunk] = np.dot(L*att, W)/np.dot(att, W)
+
+        return T, Tbar
+
     def __spherical_extinction(self, model):
 
         if 'gaussian' in model:
@@ -5748,15 +6261,19 @@ class PeakDictionary:
         else:
             fname = 'primary_extinction_sphere.csv'
 
-        filename = os.path.join(os.path.dirname(__file__), fname)
+        if self.__extinction_tables.get(fname) is None:
 
-        data = np.loadtxt(filename, skiprows=1, delimiter=',', usecols=np.arange(91))
-        theta = np.loadtxt(filename, delimiter=',', max_rows=1)
+            filename = os.path.join(os.path.dirname(__file__), fname)
 
-        f1 = scipy.interpolate.interp1d(2*np.deg2rad(theta), data[0], kind='cubic')
-        f2 = scipy.interpolate.interp1d(2*np.deg2rad(theta), data[1], kind='cubic')
+            data = np.loadtxt(filename, skiprows=1, delimiter=',', usecols=np.arange(91))
+            theta = np.loadtxt(filename, delimiter=',', max_rows=1)
 
-        return f1, f2
+            f1 = scipy.interpolate.CubicSpline(2*np.deg2rad(theta), data[0])
+            f2 = scipy.interpolate.CubicSpline(2*np.deg2rad(theta), data[1])
+
+            self.__extinction_tables[fname] = f1, f2
+
+        return self.__extinction_tables[fname]
 
     def apply_extinction_correction(self, r, g, s, mu, phi, a, b, c, e, model='secondary, gaussian', fname=None):
 
@@ -6215,16 +6732,33 @@ class PeakDictionary:
 
         return 1/np.sqrt(A[0,0]*vec[0]**2+A[1,1]*vec[1]**2+A[2,2]*vec[2]**2+2*(A[1,2]*vec[1]*vec[2]+A[0,2]*vec[0]*vec[2]+A[0,1]*vec[0]*vec[1]))
 
-    def __extinction_residual(self, params, I, E, HKL, two_theta, omega, lamda, Tbar, u_dir, d_dir, R, V, f1, f2, model, vary_F2=False):
+    def __flatten_families(self, I, E, HKL, two_theta, omega, lamda, Tbar, u_dir, d_dir, f1, f2):
 
-        uc = self.cs.getUnitCell()
-        a, b, c, alpha, beta, gamma = uc.a(), uc.b(), uc.c(), uc.alpha(), uc.beta(), uc.gamma()
+        family = np.concatenate([np.full(len(i), j) for j, i in enumerate(I)])
+
+        I, E = np.concatenate(I), np.concatenate(E)
+
+        two_theta, omega = np.concatenate(two_theta), np.concatenate(omega)
+        lamda, Tbar = np.concatenate(lamda), np.concatenate(Tbar)
+
+        u_dir, d_dir = np.concatenate(u_dir), np.concatenate(d_dir)
+
+        c1, c2 = f1(two_theta), f2(two_theta)
+
+        hkl = [V3D(*ind[0]) for ind in HKL]
+
+        return I, E, hkl, two_theta, omega, lamda, Tbar, u_dir, d_dir, c1, c2, family
+
+    def __structure_factors(self, HKL, U):
+
+        uc = self.cs.getUnitCell()
+        a, b, c, alpha, beta, gamma = uc.a(), uc.b(), uc.c(), uc.alpha(), uc.beta(), uc.gamma()
 
         constants = '{} {} {} {} {} {}'.format(a,b,c,alpha,beta,gamma)
 
         scatterers = self.cs.getScatterers()
 
-        U = str(params['U'].value)
+        U = str(U)
 
         atoms = []
         for j, scatterer in enumerate(scatterers):
@@ -6236,34 +6770,30 @@ class PeakDictionary:
         cs = CrystalStructure(constants, self.hm, atoms)
         generator = ReflectionGenerator(cs)
 
-        r = [params['r_vals_{}'.format(j)] for j in range(6)]
-        g = [params['g_vals_{}'.format(j)] for j in range(6)]
+        return np.array(generator.getFsSquared(HKL))
 
-        s = params['s']
+    def __extinction_residual(self, params, I, E, HKL, two_theta, omega, lamda, Tbar, u_dir, d_dir, R, V, c1, c2, family, model, vary_F2=False):
 
-        mu, phi, c = params['mu'], params['phi'], params['c']
-        a, b, e = params['a'], params['b'], params['e']
-
-        diff_I = np.array([])
-        err_I = np.array([])
+        if not vary_F2:
 
-        for j, (i, err, hkl, tt, w, wl, wpl, u, d) in enumerate(zip(I, E, HKL, two_theta, omega, lamda, Tbar, u_dir, d_dir)):
+            sf = self.__structure_factors(HKL, params['U'].value)[family]
 
-            c1, c2 = f1(tt), f2(tt)
+        else:
 
-            h, k, l = hkl[0]
+            sf = np.array([params['F2_{}'.format(j)].value for j in range(len(HKL))])[family]
 
-            sf = generator.getFsSquared([V3D(h,k,l)])[0] if not vary_F2 else params['F2_{}'.format(j)]
+        r = [params['r_vals_{}'.format(j)].value for j in range(6)]
+        g = [params['g_vals_{}'.format(j)].value for j in range(6)]
 
-            scale = self.beam_profile(w, wl, mu, phi, a, b, c, e)
-            intens = self.__extinction_model(r, g, s, sf, c1, c2, tt, wl, wpl, u, d, R, V, model)
+        s = params['s'].value
 
-            dI = (i-intens*scale)
+        mu, phi, c = params['mu'].value, params['phi'].value, params['c'].value
+        a, b, e = params['a'].value, params['b'].value, params['e'].value
 
-            diff_I = np.concatenate((diff_I,dI))
-            err_I = np.concatenate((err_I,err))
+        scale = self.beam_profile(omega, lamda, mu, phi, a, b, c, e)
+        intens = self.__extinction_model(r, g, s, sf, c1, c2, two_theta, lamda, Tbar, u_dir, d_dir, R, V, model)
 
-        return diff_I/err_I
+        return (I-intens*scale)/E
 
     def __wobble_init(self, theta, mu, k):
 
@@ -6428,7 +6958,7 @@ class PeakDictionary:
 
         return diff
 
-    def extinction_curves(self, r, g, s, mu, phi, a, b, c, e, model):
+    def extinction_curves(self, r, g, s, mu, phi, a, b, c, e, model, U=None, families=None):
 
         f1, f2 = self.__spherical_extinction(model)
 
@@ -6437,7 +6967,13 @@ class PeakDictionary:
         V = self.iws.sample().getOrientedLattice().volume() # Ang^3
         R *= 1e+8 # Ang
 
-        I, E, two_theta, omega, lamda, Tbar, hkl, F2, d_spacing, u_dir, d_dir = self.peak_families()
+        if families is None:
+            families = self.peak_families()
+
+        I, E, two_theta, omega, lamda, Tbar, hkl, F2, d_spacing, u_dir, d_dir = families
+
+        if U is not None:
+            F2 = self.__structure_factors([V3D(*ind[0]) for ind in hkl], U)
 
         X, Y = [], []
 
@@ -6465,6 +7001,17 @@ class PeakDictionary:
 
         return X, Y, I, E, hkl, d_spacing
 
+    def extinction_agreement(self, r, g, s, U, mu, phi, a, b, c, e, model, families=None):
+
+        X, Y, I, E, hkl, d_spacing = self.extinction_curves(r, g, s, mu, phi, a, b, c, e, model, U, families)
+
+        I, E, Y = np.concatenate(I), np.concatenate(E), np.concatenate(Y)
+
+        R1 = np.sum(np.abs(I-Y))/np.sum(np.abs(I))
+        wR2 = np.sqrt(np.sum(((I-Y)/E)**2)/np.sum((I/E)**2))
+
+        return R1, wR2
+
     def beam_profile(self, omega, lamda, mu, phi, a, b, c, e):
 
         t = omega-mu
@@ -6473,7 +7020,405 @@ class PeakDictionary:
 
         return np.exp(-(c*x-b)**2/(1+a*lamda)**2)
 
-    def fit_extinction(self, model):
+    def __extinction_derivatives(self, F2, c1, c2, xi_p, xi_s):
+
+        xp = xi_p*F2
+        yp = 1/(1+c1*xp**c2)
+
+        dyp = -c1*c2*np.power(xp, c2-1, out=np.zeros_like(xp), where=xp > 0)*yp**2
+
+        z = yp*xi_s*F2
+        ys = 1/(1+c1*z**c2)
+
+        dys = -c1*c2*np.power(z, c2-1, out=np.zeros_like(z), where=z > 0)*ys**2
+
+        y = yp*ys
+
+        dy_dF2 = dyp*xi_p*ys+yp*dys*(dyp*xi_p*xi_s*F2+yp*xi_s)
+
+        dy_dxp = dyp*F2*ys+yp*dys*dyp*F2*xi_s*F2
+        dy_dxs = yp*dys*yp*F2
+
+        return y, dy_dF2, dy_dxp, dy_dxs
+
+    def __extinction_factor_derivatives(self, r, g, two_theta, lamda, Tbar, V, model):
+
+        a = 1e-4 # Ang
+
+        rho = r/lamda
+
+        K = a**2/V**2*lamda**3*(Tbar*1e8)
+
+        dxi_dr, dxi_dg = np.zeros_like(rho), np.zeros_like(rho)
+
+        if model == 'primary':
+
+            dxi_dr = 3*a**2/V**2*lamda**3*rho
+
+        elif model == 'secondary, gaussian':
+
+            w = 1+rho**2*np.sin(two_theta)**2/g**2
+
+            dxi_dr = K/w**1.5/lamda
+            dxi_dg = K*rho**3*np.sin(two_theta)**2/g**3/w**1.5
+
+        elif model == 'secondary, lorentzian':
+
+            w = 1+rho*np.sin(two_theta)/g
+
+            dxi_dr = K/w**2/lamda
+            dxi_dg = K*rho**2*np.sin(two_theta)/g**2/w**2
+
+        elif 'type II' in model:
+
+            dxi_dr = K/lamda
+
+        elif 'type I' in model:
+
+            dxi_dg = K/np.sin(two_theta)
+
+        return dxi_dr, dxi_dg
+
+    def __skew_matrix(self, v):
+
+        return np.array([[0, -v[2], v[1]],
+                         [v[2], 0, -v[0]],
+                         [-v[1], v[0], 0]])
+
+    def __U_matrix_derivatives(self, phi, theta, omega):
+
+        u = np.array([np.cos(phi)*np.sin(theta), np.sin(phi)*np.sin(theta), np.cos(theta)])
+
+        du_dphi = np.array([-np.sin(phi)*np.sin(theta), np.cos(phi)*np.sin(theta), 0])
+        du_dtheta = np.array([np.cos(phi)*np.cos(theta), np.sin(phi)*np.cos(theta), -np.sin(theta)])
+
+        dU = [(1-np.cos(omega))*(np.outer(du,u)+np.outer(u,du))+np.sin(omega)*self.__skew_matrix(du) for du in [du_dphi, du_dtheta]]
+
+        dU.append(np.sin(omega)*(np.outer(u,u)-np.eye(3))+np.cos(omega)*self.__skew_matrix(u))
+
+        return dU
+
+    def __anisotropic_derivatives(self, vec, vals):
+
+        *lamda, phi, theta, omega = vals
+
+        Q = self.__U_matrix(phi, theta, omega)
+
+        p = np.dot(Q.T, vec)
+
+        r = 1/np.sqrt(np.dot(lamda, p**2))
+
+        dr = [-0.5*r**3*p[i]**2 for i in range(3)]
+
+        for dQ in self.__U_matrix_derivatives(phi, theta, omega):
+
+            dp = np.dot(dQ.T, vec)
+
+            dr.append(-r**3*np.dot(lamda, dp*p))
+
+        return r, dr
+
+    def __beam_profile_derivatives(self, omega, lamda, mu, phi, a, b, c, e):
+
+        t = omega-mu
+
+        f = np.sqrt(1-e**2)
+
+        x = np.cos(t)*np.cos(phi)-f*np.sin(t)*np.sin(phi)
+
+        D = 1+a*lamda
+        q = (c*x-b)/D
+
+        scale = np.exp(-q**2)
+
+        dx_dmu = np.sin(t)*np.cos(phi)+f*np.cos(t)*np.sin(phi)
+        dx_dphi = -np.cos(t)*np.sin(phi)-f*np.sin(t)*np.cos(phi)
+        dx_de = np.sin(t)*np.sin(phi)*e/f if f > 0 else np.zeros_like(t)
+
+        dq = {'mu': c/D*dx_dmu, 'phi': c/D*dx_dphi, 'a': -q*lamda/D, 'b': -1/D, 'c': x/D, 'e': c/D*dx_de}
+
+        return scale, {name: -2*q*scale*value for name, value in dq.items()}
+
+    def __extinction_terms(self, values, two_theta, omega, lamda, Tbar, u_dir, d_dir, R, V, model):
+
+        r_vals = [values['r_vals_{}'.format(j)] for j in range(6)]
+        g_vals = [values['g_vals_{}'.format(j)] for j in range(6)]
+
+        r, dr = self.__anisotropic_derivatives(u_dir.T, r_vals)
+        g, dg = self.__anisotropic_derivatives(d_dir.T, g_vals)
+
+        xi_p = self.__extinction_factor(r_vals, g_vals, two_theta, lamda, Tbar, u_dir, d_dir, R, V, 'primary')
+        xi_s = self.__extinction_factor(r_vals, g_vals, two_theta, lamda, Tbar, u_dir, d_dir, R, V, model)
+
+        dxi_p_dr, _ = self.__extinction_factor_derivatives(r, g, two_theta, lamda, Tbar, V, 'primary')
+        dxi_s_dr, dxi_s_dg = self.__extinction_factor_derivatives(r, g, two_theta, lamda, Tbar, V, model)
+
+        mu, phi, c = values['mu'], values['phi'], values['c']
+        a, b, e = values['a'], values['b'], values['e']
+
+        scale, dscale = self.__beam_profile_derivatives(omega, lamda, mu, phi, a, b, c, e)
+
+        zero = np.zeros_like(scale)
+
+        derivs = {}
+
+        for j in range(6):
+            derivs['r_vals_{}'.format(j)] = dxi_p_dr*dr[j], dxi_s_dr*dr[j], zero
+            derivs['g_vals_{}'.format(j)] = zero, dxi_s_dg*dg[j], zero
+
+        for name in dscale.keys():
+            derivs[name] = zero, zero, dscale[name]
+
+        return xi_p, xi_s, scale, derivs
+
+    def __log_parameters(self):
+
+        return ['s']+['{}_vals_{}'.format(v,j) for v in ['r','g'] for j in range(3)]
+
+    def __extinction_bounds(self):
+
+        bounded = {'mu': (-np.pi, np.pi), 'phi': (-np.pi, np.pi), 'a': (0, np.inf), 'c': (0, np.inf)}
+        clipped = {'b': (0, np.inf), 'e': (0, 1), 'U': (0, 1)}
+
+        return bounded, clipped
+
+    def __extinction_internal(self, values, names):
+
+        log_names = self.__log_parameters()
+
+        bounded, _ = self.__extinction_bounds()
+
+        theta = []
+
+        for name in names:
+
+            value = values[name]
+
+            if name in log_names:
+                theta.append(np.log(value))
+            elif name in bounded:
+                lo, hi = bounded[name]
+                if np.isinf(hi):
+                    theta.append(np.sqrt((value-lo+1)**2-1))
+                else:
+                    theta.append(np.arcsin(np.clip(2*(value-lo)/(hi-lo)-1, -1, 1)))
+            else:
+                theta.append(value)
+
+        return np.array(theta)
+
+    def __extinction_values(self, values, theta, names, ties):
+
+        values = values.copy()
+
+        log_names = self.__log_parameters()
+
+        bounded, clipped = self.__extinction_bounds()
+
+        for name, t in zip(names, theta):
+            if name in log_names:
+                values[name] = np.exp(t)
+            elif name in bounded:
+                lo, hi = bounded[name]
+                values[name] = lo-1+np.sqrt(t**2+1) if np.isinf(hi) else lo+(np.sin(t)+1)*(hi-lo)/2
+            else:
+                values[name] = t
+
+        for target, source in ties:
+            values[target] = values[source]
+
+        for name, (lo, hi) in clipped.items():
+            values[name] = np.clip(values[name], lo, hi)
+
+        return values
+
+    def __extinction_chain(self, theta, names):
+
+        log_names = self.__log_parameters()
+
+        bounded, clipped = self.__extinction_bounds()
+
+        chain = np.ones_like(theta)
+
+        for k, (name, t) in enumerate(zip(names, theta)):
+            if name in log_names:
+                chain[k] = np.exp(t)
+            elif name in bounded:
+                lo, hi = bounded[name]
+                chain[k] = t/np.sqrt(t**2+1) if np.isinf(hi) else np.cos(t)*(hi-lo)/2
+            elif name in clipped:
+                lo, hi = clipped[name]
+                chain[k] = 1 if lo <= t <= hi else 0
+
+        return chain
+
+    def __extinction_evaluate(self, theta, names, ties, values, F2, vary_F2, args, model):
+
+        I, E, hkl, two_theta, omega, lamda, Tbar, u_dir, d_dir, R, V, c1, c2, family = args
+
+        vals = self.__extinction_values(values, theta, names, ties)
+
+        dF2_dU = np.zeros_like(F2)
+
+        if not vary_F2 and 'U' in names:
+            F2 = self.__structure_factors(hkl, vals['U'])
+            d_star = np.dot(self.cs.getUnitCell().getB(), np.array([list(ind) for ind in hkl]).T)
+            dF2_dU = -4*np.pi**2*np.sum(d_star**2, axis=0)*F2
+
+        xi_p, xi_s, scale, derivs = self.__extinction_terms(vals, two_theta, omega, lamda, Tbar, u_dir, d_dir, R, V, model)
+
+        sf = F2[family]
+
+        y, dy_dF2, dy_dxp, dy_dxs = self.__extinction_derivatives(sf, c1, c2, xi_p, xi_s)
+
+        s = vals['s']
+
+        intens = s*sf*y*scale
+
+        res = (I-intens)/E
+
+        Jl = s*scale*(y+sf*dy_dF2)/E
+
+        d_int = {'s': sf*y*scale, 'U': s*scale*(y+sf*dy_dF2)*dF2_dU[family]}
+
+        for name, (dxi_p, dxi_s, dscale) in derivs.items():
+            d_int[name] = s*sf*(scale*(dy_dxp*dxi_p+dy_dxs*dxi_s)+y*dscale)
+
+        chain = self.__extinction_chain(theta, names)
+
+        Jg = np.zeros((I.size, len(names)))
+
+        for k, name in enumerate(names):
+
+            Jg[:,k] = d_int[name]
+
+            for target, source in ties:
+                if source == name:
+                    Jg[:,k] += d_int[target]
+
+            Jg[:,k] *= chain[k]/E
+
+        return res, Jg, Jl, F2
+
+    def __extinction_stage(self, names, ties, values, F2, vary_F2, args, model, max_iter=100, tol=1e-8):
+
+        family = args[-1]
+
+        n, p = F2.size, len(names)
+
+        theta = self.__extinction_internal(values, names)
+
+        res, Jg, Jl, F2 = self.__extinction_evaluate(theta, names, ties, values, F2, vary_F2, args, model)
+
+        chi2 = np.sum(res**2)
+
+        damping = 1e-3
+
+        for _ in range(max_iter):
+
+            A, bg = np.dot(Jg.T, Jg), np.dot(Jg.T, res)
+
+            if vary_F2:
+                D = np.bincount(family, Jl**2, n)
+                bl = np.bincount(family, Jl*res, n)
+                B = np.array([np.bincount(family, Jg[:,k]*Jl, n) for k in range(p)]).reshape(p, n)
+
+            improved = False
+
+            while damping < 1e+12:
+
+                S, b = A+damping*np.diag(np.diag(A)), bg
+
+                if vary_F2:
+                    Dl = D*(1+damping)
+                    Dl[Dl == 0] = np.inf
+                    BD = B/Dl
+                    S, b = S-np.dot(BD, B.T), bg-np.dot(BD, bl)
+
+                dg = np.linalg.lstsq(S, b, rcond=None)[0]
+
+                trial_F2 = np.clip(F2+(bl-np.dot(B.T, dg))/Dl, 0, None) if vary_F2 else F2
+
+                trial = self.__extinction_evaluate(theta+dg, names, ties, values, trial_F2, vary_F2, args, model)
+
+                trial_chi2 = np.sum(trial[0]**2)
+
+                if np.isfinite(trial_chi2) and trial_chi2 < chi2:
+                    improved = True
+                    break
+
+                damping *= 10
+
+            if not improved:
+                break
+
+            theta = theta+dg
+
+            res, Jg, Jl, F2 = trial
+
+            change = (chi2-trial_chi2)/chi2
+            chi2 = trial_chi2
+
+            damping = np.max([damping/10, 1e-12])
+
+            if change < tol:
+                break
+
+        values = self.__extinction_values(values, theta, names, ties)
+
+        n_params = p+n if vary_F2 else p
+
+        redchi = chi2/np.max([res.size-n_params, 1])
+
+        print('{}: {} parameters, reduced chi2 = {:.4f}'.format(model, n_params, redchi))
+
+        return values, F2, redchi
+
+    def __refine_extinction(self, model, F2, args):
+
+        hkl = args[2]
+
+        values = {'s': 1, 'U': 1e-3, 'mu': 0, 'phi': 0, 'a': 0, 'b': 0, 'c': 0, 'e': 0}
+
+        for v in ['r','g']:
+            for j in range(6):
+                values['{}_vals_{}'.format(v,j)] = 1e+4 if j < 3 else (np.pi/2 if j == 4 else 0)
+
+        if 'type II' in model:
+            ext = ['r']
+        elif 'type I' in model or 'secondary' in model:
+            ext = ['r','g']
+        else:
+            ext = ['r']
+
+        names = ['s','U']+['{}_vals_0'.format(v) for v in ext]
+        ties = [('{}_vals_{}'.format(v,j), '{}_vals_0'.format(v)) for v in ext for j in [1,2]]
+
+        values, F2, redchi = self.__extinction_stage(names, ties, values, F2, False, args, model)
+
+        names = ['s','U']+['{}_vals_{}'.format(v,j) for v in ext for j in range(6)]
+
+        values, F2, redchi = self.__extinction_stage(names, [], values, F2, False, args, model)
+
+        F2 = self.__structure_factors(hkl, values['U'])
+
+        values['a'], values['c'] = 1, 1
+
+        names = names[2:]+['mu','phi','a','b','c','e']
+
+        values, F2, redchi = self.__extinction_stage(names, [], values, F2, True, args, model)
+
+        r_vals = [values['r_vals_{}'.format(j)] for j in range(6)]
+        g_vals = [values['g_vals_{}'.format(j)] for j in range(6)]
+
+        s, U = values['s'], values['U']
+
+        mu, phi = values['mu'], values['phi']
+        a, b, c, e = values['a'], values['b'], values['c'], values['e']
+
+        return r_vals, g_vals, s, U, mu, phi, a, b, c, e, redchi
+
+    def fit_extinction(self, model, schur=False, families=None):
 
         f1, f2 = self.__spherical_extinction(model)
 
@@ -6482,7 +7427,17 @@ class PeakDictionary:
         V = self.iws.sample().getOrientedLattice().volume() # Ang^3
         R *= 1e+8 # Ang
 
-        I, E, two_theta, omega, lamda, Tbar, hkl, F2, d_spacing, u_dir, d_dir = self.peak_families()
+        if families is None:
+            families = self.peak_families()
+
+        I, E, two_theta, omega, lamda, Tbar, hkl, F2, d_spacing, u_dir, d_dir = families
+
+        args = self.__flatten_families(I, E, hkl, two_theta, omega, lamda, Tbar, u_dir, d_dir, f1, f2)
+
+        I, E, hkl, two_theta, omega, lamda, Tbar, u_dir, d_dir, c1, c2, family = args
+
+        if schur:
+            return self.__refine_extinction(model, np.array(F2), (I, E, hkl, two_theta, omega, lamda, Tbar, u_dir, d_dir, R, V, c1, c2, family))
 
         params = Parameters()
 
@@ -6540,7 +7495,7 @@ class PeakDictionary:
 
             params.add('F2_{}'.format(j), min=0, max=np.inf, value=sf, vary=False)
 
-        out = Minimizer(self.__extinction_residual, params, reduce_fcn='negentropy', fcn_args=(I, E, hkl, two_theta, omega, lamda, Tbar, u_dir, d_dir, R, V, f1, f2, model, False))
+        out = Minimizer(self.__extinction_residual, params, reduce_fcn='negentropy', fcn_args=(I, E, hkl, two_theta, omega, lamda, Tbar, u_dir, d_dir, R, V, c1, c2, family, model, False))
         result = out.minimize(method='least_squares')
 
         report_fit(result)
@@ -6606,7 +7561,7 @@ class PeakDictionary:
 
             params['F2_{}'.format(j)].set(vary=False)
 
-        out = Minimizer(self.__extinction_residual, params, reduce_fcn='negentropy', fcn_args=(I, E, hkl, two_theta, omega, lamda, Tbar, u_dir, d_dir, R, V, f1, f2, model, False))
+        out = Minimizer(self.__extinction_residual, params, reduce_fcn='negentropy', fcn_args=(I, E, hkl, two_theta, omega, lamda, Tbar, u_dir, d_dir, R, V, c1, c2, family, model, False))
         result = out.minimize(method='least_squares')
 
         report_fit(result)
@@ -6625,7 +7580,7 @@ class PeakDictionary:
         # 
         #     params['F2_{}'.format(j)].set(vary=False)
         # 
-        # out = Minimizer(self.__extinction_residual, params, reduce_fcn='negentropy', fcn_args=(I, E, hkl, two_theta, omega, lamda, Tbar, u_dir, d_dir, R, V, f1, f2, model, False))
+        # out = Minimizer(self.__extinction_residual, params, reduce_fcn='negentropy', fcn_args=(I, E, hkl, two_theta, omega, lamda, Tbar, u_dir, d_dir, R, V, c1, c2, family, model, False))
         # result = out.minimize(method='least_squares')
         # 
         # report_fit(result)
@@ -6652,7 +7607,7 @@ class PeakDictionary:
             sf = result.params['F2_{}'.format(j)].value
             params['F2_{}'.format(j)].set(value=sf, vary=False)
 
-        out = Minimizer(self.__extinction_residual, params, reduce_fcn='negentropy', fcn_args=(I, E, hkl, two_theta, omega, lamda, Tbar, u_dir, d_dir, R, V, f1, f2, model, False))
+        out = Minimizer(self.__extinction_residual, params, reduce_fcn='negentropy', fcn_args=(I, E, hkl, two_theta, omega, lamda, Tbar, u_dir, d_dir, R, V, c1, c2, family, model, False))
         result = out.minimize(method='least_squares')
 
         report_fit(result)
@@ -6683,203 +7638,219 @@ class PeakStatistics:
         self.sg = SpaceGroupFactory.createSpaceGroup(space_group)
         self.pg = PointGroupFactory.createPointGroupFromSpaceGroup(self.sg)
 
-    def prune_outliers(self):
+    def __hkl_matrices(self, group):
 
-        filename = self.filename
-        data = self.data
+        matrices = []
 
-        sg = self.sg
-        pg = self.pg
+        for op in group.getSymmetryOperations():
 
-        miss, total = 0, 0
+            columns = [op.transformHKL(V3D(*e)) for e in np.eye(3)]
 
-        lines = []
+            matrices.append(np.array(columns).T)
 
-        fname, ext = os.path.splitext(filename)
+        return np.round(matrices).astype(int)
 
-        f = open(fname+'_prune.txt', 'w')
+    def __encode(self, hkl, base):
 
-        f.write('space group #{} ({})\n'.format(sg.getNumber(),sg.getHMSymbol()))
-        f.write('reflections:\n')
+        offset = base//2
 
-        dictionary = {}
+        return ((hkl[:,0]+offset)*base+(hkl[:,1]+offset))*base+(hkl[:,2]+offset)
 
-        for line in data:
+    def __unique_hkl(self, hkl):
 
-            h, k, l, I, sig, d = line
+        base = 4*np.abs(hkl).max(initial=0)+1
 
-            hkl = V3D(h,k,l)
+        codes, index, inverse = np.unique(self.__encode(hkl, base), return_index=True, return_inverse=True)
 
-            if sg.isAllowedReflection(hkl):
+        return hkl[index], inverse, base
 
-                lines.append(line)
+    def __absences(self, uniq, group, cache=None):
 
-                equivalents = pg.getEquivalents(hkl)
+        forbidden = np.zeros(len(uniq), dtype=bool)
 
-                key = tuple(equivalents)
+        for op, M in zip(group.getSymmetryOperations(), self.__hkl_matrices(group)):
 
-                if dictionary.get(key) is None:
+            t = np.array(op.transformCoordinates(V3D(0,0,0)))
 
-                    dictionary[key] = [len(equivalents),d,[(h,k,l)],[I],[sig]]
+            if not np.allclose(t, np.round(t)):
 
-                else:
+                identifier = op.getIdentifier()
 
-                    item = dictionary[key]
+                if cache is None or cache.get(identifier) is None:
 
-                    redundancy, d_spacing, peak_list, intens_list, sig_intens_list = item
+                    invariant = (np.dot(uniq, M.T) == uniq).all(axis=1)
 
-                    intens_list.append(I)
-                    sig_intens_list.append(sig)
-                    peak_list.append((h,k,l))
+                    phase = np.dot(uniq, t)
 
-                    item = [redundancy, d_spacing, peak_list, intens_list, sig_intens_list]
+                    mask = invariant & ~np.isclose(phase, np.round(phase))
 
-                    dictionary[key] = item
+                    if cache is not None:
+                        cache[identifier] = mask
 
-            else:
+                else:
 
-                f.write('({},{},{}) forbidden d = {:2.4f} \u212B\n'.format(int(h),int(k),int(l),d))
+                    mask = cache[identifier]
 
-                miss += 1
+                forbidden |= mask
 
-            total += 1
+        return forbidden
 
-        f.write('{}/{} reflections not allowed in space group\n'.format(miss,total))
+    def __allowed_reflections(self, hkl, group):
 
-        miss, total = 0, 0
+        uniq, inverse, base = self.__unique_hkl(hkl)
 
-        data = []
+        return ~self.__absences(uniq, group)[inverse]
 
-        for key in dictionary.keys():
+    def __point_group_classes(self, uniq, base, group):
 
-            item = dictionary[key]
+        matrices = self.__hkl_matrices(group)
 
-            redundancy, d_spacing, peak_list, intens_list, sig_intens_list = item
+        key = np.full(len(uniq), -1)
 
-            intens_list, sig_intens_list = np.array(intens_list), np.array(sig_intens_list)
+        for M in matrices:
+            key = np.maximum(key, self.__encode(np.dot(uniq, M.T), base))
 
-            median = np.median(intens_list)
-            Q1, Q3 = np.percentile(intens_list, [25,75])
-            IQR = Q3-Q1
+        keys, index, classes = np.unique(key, return_index=True, return_inverse=True)
 
-            high = np.argwhere(Q3+1.5*IQR < intens_list).flatten()
-            low = np.argwhere(Q1-1.5*IQR > intens_list).flatten()
+        images = np.sort([self.__encode(np.dot(uniq[index], M.T), base) for M in matrices], axis=0)
 
-            if len(high) > 0:
-                f.write('outlier, intensity too high : {}\n'.format(','.join(['({},{},{})'.format(*peak_list[ind]) for ind in high])))
+        redundancy = (np.diff(images, axis=0) != 0).sum(axis=0)+1
 
-            if len(low) > 0:
-                f.write('outlier, intensity too low : {}\n'.format(','.join(['({},{},{})'.format(*peak_list[ind]) for ind in low])))
+        return classes, redundancy
 
-            mask = np.concatenate((low,high)).tolist()
+    def __equivalence_classes(self, hkl, group):
 
-            median = np.median(sig_intens_list)
-            Q1, Q3 = np.percentile(sig_intens_list, [25,75])
-            IQR = Q3-Q1
+        uniq, inverse, base = self.__unique_hkl(hkl)
 
-            high = np.argwhere(Q3+1.5*IQR < sig_intens_list).flatten().tolist()
+        classes, redundancy = self.__point_group_classes(uniq, base, group)
 
-            mask += high
+        observed = np.bincount(classes, minlength=len(redundancy))
 
-            for i in range(len(intens_list)):
+        inverse = classes[inverse]
 
-                if i not in mask:
+        counts = np.bincount(inverse, minlength=len(redundancy))
 
-                    h, k, l = peak_list[i]
-                    I = intens_list[i]
-                    sig = sig_intens_list[i]
-                    d = d_spacing
+        order = np.argsort(inverse, kind='stable')
+        first = order[np.cumsum(counts)-counts]
 
-                    line = h, k, l, I, sig, d
+        return inverse, first, redundancy, observed, counts
 
-                    data.append(line)
+    def __segment_percentile(self, values, inverse, counts, q):
 
-                else:
+        order = np.lexsort((values, inverse))
 
-                    miss += 1
+        start = np.cumsum(counts)-counts
 
-                total += 1
+        pos = q/100*(counts-1)
 
-        f.write('{}/{} reflections outliers\n'.format(miss,total))
+        low = np.floor(pos).astype(int)
+        high = np.ceil(pos).astype(int)
 
-        self.data = data
+        frac = pos-low
 
-    def write_statisics(self):
+        values = values[order]
+
+        return values[start+low]*(1-frac)+values[start+high]*frac
+
+    def prune_outliers(self):
 
         filename = self.filename
-        data = self.data
+        data = np.array(self.data).reshape(-1,6)
 
         sg = self.sg
         pg = self.pg
 
-        lines = []
-
         fname, ext = os.path.splitext(filename)
 
-        f = open(fname+'_symm.txt', 'w')
+        f = open(fname+'_prune.txt', 'w')
 
-        f.write('d-spacing \u212B   | Comp    | R(mrg)  | R(pim)\n')
+        f.write('space group #{} ({})\n'.format(sg.getNumber(),sg.getHMSymbol()))
+        f.write('reflections:\n')
 
-        dictionary = {}
+        hkl = np.round(data[:,:3]).astype(int)
 
-        for line in data:
+        allowed = self.__allowed_reflections(hkl, sg)
 
-            h, k, l, I, sig, d = line
+        for (h, k, l), d in zip(hkl[~allowed], data[~allowed,5]):
 
-            hkl = V3D(h,k,l)
+            f.write('({},{},{}) forbidden d = {:2.4f} \u212B\n'.format(h,k,l,d))
 
-            if sg.isAllowedReflection(hkl):
+        f.write('{}/{} reflections not allowed in space group\n'.format(np.sum(~allowed),len(data)))
 
-                lines.append(line)
+        data, hkl = data[allowed], hkl[allowed]
 
-                equivalents = pg.getEquivalents(hkl)
+        I, sig = data[:,3], data[:,4]
 
-                key = tuple(equivalents)
+        inverse, first, redundancy, observed, counts = self.__equivalence_classes(hkl, pg)
 
-                if dictionary.get(key) is None:
+        Q1, Q3 = [self.__segment_percentile(I, inverse, counts, q) for q in [25,75]]
+        IQR = Q3-Q1
 
-                    dictionary[key] = [len(equivalents),d,[(h,k,l)],[I],[sig]]
+        high = Q3[inverse]+1.5*IQR[inverse] < I
+        low = Q1[inverse]-1.5*IQR[inverse] > I
 
-                else:
+        Q1, Q3 = [self.__segment_percentile(sig, inverse, counts, q) for q in [25,75]]
+        IQR = Q3-Q1
 
-                    item = dictionary[key]
+        mask = high | low | (Q3[inverse]+1.5*IQR[inverse] < sig)
 
-                    redundancy, d_spacing, peak_list, intens_list, sig_intens_list = item
+        rank = np.argsort(np.argsort(first))[inverse]
 
-                    intens_list.append(I)
-                    sig_intens_list.append(sig)
-                    peak_list.append((h,k,l))
+        outliers = np.flatnonzero(high | low)
+        outliers = outliers[np.lexsort((outliers, rank[outliers]))]
 
-                    item = [redundancy, d_spacing, peak_list, intens_list, sig_intens_list]
+        for group in np.split(outliers, np.flatnonzero(np.diff(rank[outliers]))+1):
 
-                    dictionary[key] = item
+            for flag, label in [(high, 'high'), (low, 'low')]:
 
-        r, n, d = [], [], []
+                members = group[flag[group]]
 
-        I_sum, I_mae = [], []
+                if len(members) > 0:
+                    f.write('outlier, intensity too {} : {}\n'.format(label, ','.join(['({},{},{})'.format(*hkl[ind]) for ind in members])))
 
-        for key in dictionary.keys():
+        f.write('{}/{} reflections outliers\n'.format(np.sum(mask),len(data)))
 
-            item = dictionary[key]
+        f.close()
 
-            redundancy, d_spacing, peak_list, intens_list, sig_intens_list = item
+        keep = np.flatnonzero(~mask)
+        keep = keep[np.lexsort((keep, rank[keep]))]
 
-            I_mean = np.mean(intens_list)
+        self.data = data[keep]
 
-            r.append(redundancy)
-            n.append(np.unique(peak_list,axis=0).size)
-            d.append(d_spacing)
+    def write_statisics(self):
+
+        filename = self.filename
+        data = np.array(self.data).reshape(-1,6)
+
+        sg = self.sg
+        pg = self.pg
+
+        fname, ext = os.path.splitext(filename)
+
+        f = open(fname+'_symm.txt', 'w')
 
-            I_sum.append(np.sum(intens_list))
-            I_mae.append(np.sum(np.abs(np.array(intens_list)-I_mean)))
+        f.write('d-spacing \u212B   | Comp    | R(mrg)  | R(pim)\n')
+
+        hkl = np.round(data[:,:3]).astype(int)
+
+        allowed = self.__allowed_reflections(hkl, sg)
+
+        data, hkl = data[allowed], hkl[allowed]
+
+        I, d_spacing = data[:,3], data[:,5]
 
-        r, n, d = np.array(r), np.array(n), np.array(d)
+        inverse, first, redundancy, observed, counts = self.__equivalence_classes(hkl, pg)
 
-        I_sum, I_mae = np.array(I_sum), np.array(I_mae)
+        I_sum = np.bincount(inverse, I)
+        I_mean = I_sum/counts
+
+        I_mae = np.bincount(inverse, np.abs(I-I_mean[inverse]))
+
+        r, n, m, d = redundancy, observed, counts, d_spacing[first]
 
         sort = np.argsort(d)[::-1]
 
-        r, n, d = r[sort], n[sort], d[sort]
+        r, n, m, d = r[sort], n[sort], m[sort], d[sort]
         I_sum, I_mae = I_sum[sort], I_mae[sort]
 
         n_pk = len(d)
@@ -6896,10 +7867,134 @@ class PeakStatistics:
                 comp = 100*n[s].sum()/r[s].sum()
 
                 R_merge = 100*I_mae[s].sum()/I_sum[s].sum()
-                R_pim = 100*(np.sqrt(1/(n[s]-1))*I_mae[s]).sum()/I_sum[s].sum()
+                R_pim = 100*(np.sqrt(1/np.maximum(m[s]-1,1))*I_mae[s]).sum()/I_sum[s].sum()
 
                 f.write('{:6.3f}-{:6.3f} | {:6.2f}% | {:6.2f}% | {:6.2f}%\n'.format(d_max,d_min,comp,R_merge,R_pim))
 
+        f.close()
+
+    def __merging_statistics(self, I, inverse, u_inverse, redundancy, mask):
+
+        I, inverse, u_inverse = I[mask], inverse[mask], u_inverse[mask]
+
+        if len(I) == 0:
+            return np.nan, 0, 0
+
+        classes, inverse = np.unique(inverse, return_inverse=True)
+
+        counts = np.bincount(inverse)
+
+        I_mean = np.bincount(inverse, I)/counts
+        I_mae = np.bincount(inverse, np.abs(I-I_mean[inverse]))
+
+        I_sum = np.sum(I[counts[inverse] > 1])
+
+        R_int = I_mae.sum()/I_sum if I_sum > 0 else np.nan
+
+        comp = len(np.unique(u_inverse))/redundancy[classes].sum()
+
+        Q1, Q3 = [self.__segment_percentile(I, inverse, counts, q) for q in [25,75]]
+        IQR = Q3-Q1
+
+        outliers = (Q3[inverse]+1.5*IQR[inverse] < I) | (Q1[inverse]-1.5*IQR[inverse] > I)
+
+        return R_int, comp, np.mean(outliers)
+
+    def screen_groups(self, tolerance=0.15, max_violations=0.01):
+
+        filename = self.filename
+        data = np.array(self.data).reshape(-1,6)
+
+        fname, ext = os.path.splitext(filename)
+
+        hkl = np.round(data[:,:3]).astype(int)
+
+        I, sig = data[:,3], data[:,4]
+
+        strong = I > 3*sig
+
+        uniq, u_inverse, base = self.__unique_hkl(hkl)
+
+        everything = np.ones(len(I), dtype=bool)
+
+        point_groups = {}
+
+        for symbol in PointGroupFactory.getAllPointGroupSymbols():
+
+            pg = PointGroupFactory.createPointGroup(symbol)
+
+            classes, redundancy = self.__point_group_classes(uniq, base, pg)
+
+            inverse = classes[u_inverse]
+
+            R_int, comp, outliers = self.__merging_statistics(I, inverse, u_inverse, redundancy, everything)
+
+            order = len(pg.getSymmetryOperations())
+
+            point_groups[pg.getHMSymbol()] = inverse, redundancy, order, R_int, comp, outliers
+
+        point_group_table = []
+
+        for symbol, (inverse, redundancy, order, R_int, comp, outliers) in point_groups.items():
+
+            consistent = R_int <= tolerance
+
+            point_group_table.append((not consistent, -order, R_int, symbol, comp, outliers))
+
+        point_group_table.sort(key=lambda row: row[:3])
+
+        cache = {}
+
+        space_group_table = []
+
+        for symbol in SpaceGroupFactory.getAllSpaceGroupSymbols():
+
+            sg = SpaceGroupFactory.createSpaceGroup(symbol)
+            pg = PointGroupFactory.createPointGroupFromSpaceGroup(sg)
+
+            item = point_groups.get(pg.getHMSymbol())
+
+            if item is None or not item[3] <= tolerance:
+                continue
+
+            inverse, redundancy, order, *_ = item
+
+            forbidden = self.__absences(uniq, sg, cache)[u_inverse]
+
+            n_absent = np.sum(forbidden)
+            n_violations = np.sum(forbidden & strong)
+
+            fraction = n_violations/n_absent if n_absent > 0 else 0
+
+            R_int, comp, outliers = self.__merging_statistics(I, inverse, u_inverse, redundancy, ~forbidden)
+
+            consistent = fraction <= max_violations
+
+            space_group_table.append((not consistent, -order, -n_absent, R_int, sg.getNumber(), sg.getHMSymbol(), comp, outliers, n_violations))
+
+        space_group_table.sort(key=lambda row: row[:4])
+
+        with open(fname+'_groups.txt', 'w') as f:
+
+            f.write('point group  | order | R(int)  | Comp    | Outliers\n')
+
+            for inconsistent, order, R_int, symbol, comp, outliers in point_group_table:
+
+                flag = ' ' if not inconsistent else '*'
+
+                f.write('{:12} | {:5d} | {:6.2f}% | {:6.2f}% | {:6.2f}% {}\n'.format(symbol,-order,100*R_int,100*comp,100*outliers,flag))
+
+            f.write('\n')
+            f.write('space group       | order | R(int)  | Comp    | Outliers | Absent  | Violations\n')
+
+            for inconsistent, order, n_absent, R_int, number, symbol, comp, outliers, n_violations in space_group_table:
+
+                flag = ' ' if not inconsistent else '*'
+
+                f.write('#{:3d} {:13} | {:5d} | {:6.2f}% | {:6.2f}% | {:6.2f}%  | {:7d} | {:7d} {}\n'.format(number,symbol,-order,100*R_int,100*comp,100*outliers,-n_absent,n_violations,flag))
+
+        return [row[5] for row in space_group_table if not row[0]]
+
     def write_intensity(self):
 
         fname, ext = os.path.splitext(self.filename)
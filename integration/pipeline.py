@@ -0,0 +1,316 @@
+from mantid.simpleapi import *
+
+import os
+import time
+import psutil
+import threading
+
+import numpy as np
+
+import merge
+
+def workspace_name(facility, instrument, r, b, i, split_angle, exp=None):
+
+    if facility == 'SNS':
+        if np.isclose(split_angle, 0):
+            ows = '{}_{}'.format(instrument,r)
+        else:
+            ows = '{}_{}_{}'.format(instrument,r,b)
+    elif instrument == 'HB2C':
+        ows = '{}_{}_{}'.format(instrument,r,i)
+    else:
+        ows = '{}_{}_{}_{}'.format(instrument,exp,r,i)
+
+    return ows
+
+def split_load_args(args):
+
+    facility, instrument, runs, banks, indices, phi, chi, omega, *other = args
+
+    split_angle, exp = other[1], other[8]
+
+    items = []
+
+    for r, b, i, p, c, o in zip(runs, banks, indices, phi, chi, omega):
+
+        ows = workspace_name(facility, instrument, r, b, i, split_angle, exp)
+
+        items.append((ows+'_md', (facility, instrument, [r], [b], [i], [p], [c], [o], *other)))
+
+    return items
+
+def stage_setup(facility, instrument, spectrum_file, counts_file, tube_calibration, detector_calibration, mask_file, elastic):
+
+    if elastic:
+        LoadEmptyInstrument(InstrumentName='CORELLI', OutputWorkspace='CORELLI')
+
+    merge.load_normalization_calibration(facility, instrument, spectrum_file, counts_file,
+                                         tube_calibration, detector_calibration, mask_file)
+
+    if mtd.doesExist('flux'):
+        ExtractMask(InputWorkspace='sa', OutputWorkspace='mask')
+
+class BinningClient:
+
+    def __init__(self, proc, request_queue, reply_queue, remaining, lock, staged, stagedir):
+
+        self.proc = proc
+
+        self.__request_queue = request_queue
+        self.__reply_queue = reply_queue
+
+        self.__remaining = remaining
+        self.__lock = lock
+        self.__staged = staged
+        self.__stagedir = stagedir
+
+        self.__load_args = None
+
+    def load(self, args):
+
+        self.__load_args = args
+
+    def __request(self, name, args, kwargs):
+
+        self.__request_queue.put((self.proc, name, self.__load_args, args, kwargs))
+
+        result = self.__reply_queue.get()
+
+        if isinstance(result, Exception):
+            raise result
+
+        return result
+
+    def box_integrator(self, *args, **kwargs):
+
+        return self.__request('box_integrator', args, kwargs)
+
+    def norm_integrator(self, *args, **kwargs):
+
+        return self.__request('norm_integrator', args, kwargs)
+
+    def release(self):
+
+        if self.__load_args is None:
+            return
+
+        for omd, _ in split_load_args(self.__load_args):
+
+            with self.__lock:
+
+                count = self.__remaining.get(omd, 1)-1
+                self.__remaining[omd] = count
+
+                filename = os.path.join(self.__stagedir, omd+'.nxs')
+
+                if count <= 0 and os.path.exists(filename):
+                    os.remove(filename)
+                    self.__staged.release()
+
+        self.__load_args = None
+
+def loader_stage(proc, load_queue, ready, remaining, lock, staged, stagedir, stats,
+                 facility, instrument, spectrum_file, counts_file, tube_calibration, detector_calibration, mask_file, elastic):
+
+    stage_setup(facility, instrument, spectrum_file, counts_file, tube_calibration, detector_calibration, mask_file, elastic)
+
+    busy, idle = 0, 0
+
+    while True:
+
+        start = time.time()
+        item = load_queue.get()
+        idle += time.time()-start
+
+        if item is None:
+            break
+
+        omd, args = item
+
+        if remaining.get(omd, 0) <= 0 or ready.get(omd) is not None:
+            continue
+
+        start = time.time()
+        staged.acquire()
+        idle += time.time()-start
+
+        if ready.get(omd) is not None:
+            staged.release()
+            continue
+
+        ready[omd] = 'loading'
+
+        start = time.time()
+
+        merge.partial_load(*args)
+
+        filename = os.path.join(stagedir, omd+'.nxs')
+
+        SaveMD(InputWorkspace=omd, Filename=filename, SaveHistory=False)
+        DeleteWorkspace(omd)
+
+        with lock:
+            if remaining.get(omd, 0) <= 0:
+                os.remove(filename)
+                staged.release()
+            else:
+                ready[omd] = 'staged'
+
+        busy += time.time()-start
+
+    stats['loader {}'.format(proc)] = (busy, idle)
+
+def binner_stage(proc, request_queue, reply_queues, ready, stagedir, stats,
+                 facility, instrument, spectrum_file, counts_file, tube_calibration, detector_calibration, mask_file, elastic,
+                 memory_limit=70, timeout=5, load_timeout=300):
+
+    stage_setup(facility, instrument, spectrum_file, counts_file, tube_calibration, detector_calibration, mask_file, elastic)
+
+    loaded = []
+
+    busy, idle = 0, 0
+
+    while True:
+
+        start = time.time()
+        item = request_queue.get()
+        idle += time.time()-start
+
+        if item is None:
+            break
+
+        start = time.time()
+
+        fitter, name, load_args, args, kwargs = item
+
+        try:
+
+            items = split_load_args(load_args)
+
+            for omd, _ in items:
+                if omd in loaded:
+                    loaded.remove(omd)
+                    loaded.append(omd)
+
+            while len(loaded) > 0 and psutil.virtual_memory().percent > memory_limit:
+                omd = loaded.pop(0)
+                if mtd.doesExist(omd):
+                    DeleteWorkspace(omd)
+
+            for omd, single_args in items:
+
+                if mtd.doesExist(omd):
+                    continue
+
+                filename = os.path.join(stagedir, omd+'.nxs')
+
+                wait = time.time()
+                while ready.get(omd) is None and time.time()-wait < timeout:
+                    time.sleep(0.1)
+
+                while ready.get(omd) == 'loading' and time.time()-wait < load_timeout:
+                    time.sleep(0.1)
+
+                if ready.get(omd) == 'staged' and os.path.exists(filename):
+                    LoadMD(Filename=filename, OutputWorkspace=omd)
+                    RecalculateTrajectoriesExtents(InputWorkspace=omd, OutputWorkspace=omd)
+                else:
+                    ready[omd] = 'direct'
+                    merge.partial_load(*single_args)
+
+                loaded.append(omd)
+
+            if name == 'box_integrator':
+                result = merge.box_integrator(*args, **kwargs)
+            else:
+                result = merge.norm_integrator(*args, **kwargs)
+
+        except Exception as e:
+
+            result = e
+
+        reply_queues[fitter].put(result)
+
+        busy += time.time()-start
+
+    stats['binner {}'.format(proc)] = (busy, idle)
+
+def run_pipeline(join_args, load_args, n_load, n_bin, stagedir, calibration_args, max_staged=64, memory_limit=70):
+
+    import multiprocess as multiprocessing
+
+    context = multiprocessing.get_context('spawn')
+
+    manager = context.Manager()
+
+    n_fit = len(join_args)
+
+    load_queue = manager.Queue()
+    request_queues = [manager.Queue(maxsize=n_fit) for _ in range(n_bin)]
+    reply_queues = [manager.Queue(maxsize=1) for _ in range(n_fit)]
+
+    ready = manager.dict()
+    remaining = manager.dict()
+    stats = manager.dict()
+
+    lock = manager.Lock()
+    staged = manager.Semaphore(max_staged)
+
+    if not os.path.exists(stagedir):
+        os.mkdir(stagedir)
+
+    counts, order = {}, []
+
+    n_peaks = np.max([len(peak_args) for peak_args in load_args]) if len(load_args) > 0 else 0
+
+    for k in range(n_peaks):
+        for peak_args in load_args:
+            if k < len(peak_args):
+                for omd, single_args in split_load_args(peak_args[k]):
+                    if counts.get(omd) is None:
+                        counts[omd] = 0
+                        order.append((omd, single_args))
+                    counts[omd] += 1
+
+    remaining.update(counts)
+
+    loaders = [context.Process(target=loader_stage, args=(p, load_queue, ready, remaining, lock, staged, stagedir, stats, *calibration_args)) for p in range(n_load)]
+    binners = [context.Process(target=binner_stage, args=(p, request_queues[p], reply_queues, ready, stagedir, stats, *calibration_args, memory_limit)) for p in range(n_bin)]
+
+    for process in loaders+binners:
+        process.start()
+
+    feeder = threading.Thread(target=lambda: [load_queue.put(item) for item in order+[None]*n_load])
+    feeder.start()
+
+    clients = [BinningClient(p, request_queues[p % n_bin], reply_queues[p], remaining, lock, staged, stagedir) for p in range(n_fit)]
+
+    fit_args = [(*args, client) for args, client in zip(join_args, clients)]
+
+    start = time.time()
+
+    with context.Pool(processes=n_fit) as pool:
+        pool.starmap(merge.integration_loop, fit_args)
+        pool.close()
+        pool.join()
+
+    wall_time = time.time()-start
+
+    feeder.join()
+
+    for p in range(n_bin):
+        request_queues[p].put(None)
+
+    for process in loaders+binners:
+        process.join()
+
+    for omd in counts.keys():
+        filename = os.path.join(stagedir, omd+'.nxs')
+        if os.path.exists(filename):
+            os.remove(filename)
+
+    stage_stats = dict(stats)
+
+    manager.shutdown()
+
+    return wall_time, stage_stats
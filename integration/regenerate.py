@@ -26,6 +26,7 @@ imp.reload(peak)
 imp.reload(parameters)
 
 from peak import PeakDictionary, PeakFitPrune
+from incremental import RegenerationManifest, file_fingerprint
 
 from mantid.kernel import V3D
 
@@ -155,6 +156,26 @@ elif scale_factor is None:
 else:
     scale = scale_factor
 
+skip_unchanged = dictionary.get('skip-unchanged')
+
+if skip_unchanged is None:
+    skip_unchanged = False
+
+ub_twin_list = [os.path.join(directory, ub_twin) for ub_twin in ub_twin_list]
+
+manifest = RegenerationManifest(os.path.join(outdir, 'regenerate.json'))
+
+ub_files = ub_file if type(ub_file) is list else [ub_file]
+
+inputs_changed = manifest.inputs_changed('inputs', dictionary, ub_twin_list,
+                                         file_fingerprint(os.path.join(outdir, outname+'.pkl')),
+                                         file_fingerprint(os.path.join(outdir, outname+'_cal.mat')),
+                                         [file_fingerprint(ub) for ub in ub_files+ub_twin_list])
+
+if skip_unchanged and not inputs_changed:
+    print('no inputs changed since last run, skipping')
+    sys.exit()
+
 peak_dictionary = PeakDictionary(a, b, c, alpha, beta, gamma)
 peak_dictionary.set_satellite_info(mod_vector_1, mod_vector_2, mod_vector_3, max_order)
 peak_dictionary.set_material_info(chemical_formula, z_parameter, 0)
@@ -185,8 +206,6 @@ d = mtd['cws'].column(6)
 min_d_spacing = np.min(d)*0.95
 max_d_spacing = np.max(d)*1.05
 
-ub_twin_list = [os.path.join(directory, ub_twin) for ub_twin in ub_twin_list]
-
 CloneWorkspace(InputWorkspace='iws', OutputWorkspace='ref')
 ClearUB(Workspace='ref')
 LoadIsawUB(InputWorkspace='ref', Filename=ub_file)
@@ -722,6 +741,8 @@ scale = peak_dictionary.save_hkl(os.path.join(outdir, outname+'_w_pre.hkl'), ada
 peak_dictionary.save_reflections(os.path.join(outdir, outname+'_w_pre.hkl'), adaptive_scale=False, scale=scale)
 peak_dictionary.save(os.path.join(outdir, outname+'_corr.pkl'))
 
+manifest.save()
+
 for corr in ['', '_w_abs', '_twin', '_w_pre']:
     for app in ['', '_nuc', '_sat']:
         outfile = os.path.join(outdir,outname+corr+'_norm'+app+'.hkl')
@@ -14,6 +14,7 @@ sys.path.append(directory)
 import parameters
 
 from peak import PeakDictionary, PeakStatistics, PeakFitPrune
+from incremental import RegenerationManifest, file_fingerprint
 
 from mantid.geometry import PointGroupFactory, SpaceGroupFactory
 
@@ -37,6 +38,10 @@ min_I_sig = dictionary.get('minimum-signal-to-noise-ratio')
 if min_I_sig is None:
     min_I_sig = 3
 
+incremental = dictionary.get('incremental-regeneration')
+if incremental is None:
+    incremental = False
+
 group = dictionary['group']
 
 pgs = [pg.replace(' ', '') for pg in PointGroupFactory.getAllPointGroupSymbols()]
@@ -67,6 +72,8 @@ vanadium_mass = dictionary.get('vanadium-mass')
 if vanadium_mass is None:
     vanadium_mass = 0
 
+crystal_faces = dictionary.get('crystal-faces')
+
 facility, instrument = parameters.set_instrument(dictionary['instrument'])
 ipts = dictionary['ipts']
 
@@ -128,7 +135,43 @@ if cif_file is not None:
 peak_dictionary.set_satellite_info(mod_vector_1, mod_vector_2, mod_vector_3, max_order)
 peak_dictionary.set_material_info(chemical_formula, z_parameter, 0)
 peak_dictionary.set_scale_constant(scale_constant)
-peak_dictionary.load(os.path.join(outdir, outname+'.pkl'))
+
+manifest = RegenerationManifest(os.path.join(outdir, 'regenerate_intensities.json'))
+
+wobble_file = os.path.join(outdir, 'wobble.txt')
+
+absorption_changed = manifest.inputs_changed('absorption', chemical_formula, z_parameter, sample_mass, vanadium_mass, crystal_faces)
+
+output_changed = manifest.inputs_changed('output', a, b, c, alpha, beta, gamma, sg, min_I_sig, scale_factor, max_order,
+                                         mod_vector_1, mod_vector_2, mod_vector_3, cif_file, file_fingerprint(scale_file),
+                                         file_fingerprint(wobble_file), file_fingerprint(os.path.join(outdir, outname+'_cal.mat')))
+
+if incremental:
+
+    peak_dictionary.load(os.path.join(outdir, outname+'.pkl'), keys=[])
+
+    stale = manifest.stale_peaks(peak_dictionary.peak_dict)
+    removed = manifest.removed_peaks(peak_dictionary.peak_dict)
+
+    if absorption_changed:
+        stale = list(peak_dictionary.peak_dict.keys())
+
+    if len(stale) == 0 and len(removed) == 0 and not output_changed:
+        print('no inputs changed since last regeneration')
+        sys.exit()
+
+    print('regenerating {}/{} reflections'.format(len(stale),len(peak_dictionary.peak_dict.keys())))
+
+    peak_dictionary.integrate_peaks(stale)
+
+    if chemical_formula is None:
+        peak_dictionary.clear_peaks()
+        peak_dictionary.repopulate_workspaces()
+
+else:
+
+    peak_dictionary.load(os.path.join(outdir, outname+'.pkl'))
+
 peak_dictionary.apply_spherical_correction(0)
 
 LoadIsawUB(InputWorkspace='cws', Filename=os.path.join(outdir, outname+'_cal.mat'))
@@ -153,7 +196,10 @@ absorption_file = os.path.join(outdir, 'absorption.txt')
 
 if chemical_formula is not None and z_parameter > 0 and sample_mass > 0:
     peak_dictionary.set_material_info(chemical_formula, z_parameter, sample_mass)
-    peak_dictionary.apply_spherical_correction(vanadium_mass, fname=absorption_file)
+    if crystal_faces is not None:
+        peak_dictionary.apply_polyhedral_correction(crystal_faces, vanadium_mass, fname=absorption_file)
+    else:
+        peak_dictionary.apply_spherical_correction(vanadium_mass, fname=absorption_file)
     peak_dictionary.recalculate_hkl(fname=os.path.join(outdir, 'indexing_w_abs.txt'))
     peak_dictionary.save_hkl(os.path.join(outdir, outname+'_w_abs.hkl'), min_sig_noise_ratio=min_I_sig, adaptive_scale=False, scale=scale)
     peak_dictionary.save_reflections(os.path.join(outdir, outname+'_w_abs.hkl'), min_sig_noise_ratio=min_I_sig, adaptive_scale=False, scale=scale)
@@ -171,6 +217,9 @@ if chemical_formula is not None and z_parameter > 0 and sample_mass > 0:
 
 peak_dictionary.save(os.path.join(outdir, outname+'.pkl'))
 
+manifest.stale_peaks(peak_dictionary.peak_dict)
+manifest.save()
+
 def wobble_scale(theta, wl, mu, alpha, a, b, c, e):
 
     t = np.deg2rad(theta-mu)
@@ -185,8 +234,6 @@ def wobble_scale(theta, wl, mu, alpha, a, b, c, e):
 
     return 1/f
 
-wobble_file = os.path.join(outdir, 'wobble.txt')
-
 if os.path.exists(wobble_file):
 
     with open(wobble_file, 'r') as f:
@@ -0,0 +1,68 @@
+import sys, os, re, glob, imp
+
+import multiprocess as multiprocessing
+
+directory = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(directory)
+
+directory = os.path.abspath(os.path.join(directory, '..', 'reduction'))
+sys.path.append(directory)
+
+import merge, peak, parameters
+
+imp.reload(merge)
+imp.reload(peak)
+imp.reload(parameters)
+
+from peak import PeakEnvelope
+
+filename, n_proc, *hkls = sys.argv[1], int(sys.argv[2]), *sys.argv[3:]
+
+hkls = [[float(x) for x in hkl.split(',')] for hkl in hkls]
+
+if n_proc > os.cpu_count():
+    n_proc = os.cpu_count()
+
+if __name__ == '__main__':
+
+    dictionary = parameters.load_input_file(filename)
+
+    directory = os.path.dirname(os.path.abspath(filename))
+    outname = dictionary['name']
+
+    if dictionary.get('elastic'):
+        outname += '_cc'
+
+    outdir = os.path.join(directory, outname)
+    dbgdir = os.path.join(outdir, 'debug')
+
+    if len(hkls) > 0:
+
+        peak_envelope = PeakEnvelope()
+        peak_envelope.show_plots(False)
+
+        files = sorted(glob.glob(os.path.join(dbgdir, outname+'_p*_plots.pkl')))
+        files += sorted(glob.glob(os.path.join(dbgdir, outname+'_p*_archive.pkl')))
+
+        for file in files:
+            peak_envelope.render_plots(file, hkls, os.path.join(outdir, outname+'_requested.pdf'))
+
+        peak_envelope.create_pdf()
+
+        sys.exit()
+
+    files = glob.glob(os.path.join(dbgdir, outname+'_p*_plots.pkl'))
+
+    parts = [int(re.findall(r'_p(\d+)_plots.pkl$', file)[0]) for file in files]
+
+    if len(parts) > 0:
+
+        n_parts = max(parts)+1
+
+        multiprocessing.set_start_method('spawn', force=True)
+        with multiprocessing.get_context('spawn').Pool(processes=n_proc) as pool:
+            pool.starmap(merge.render_report, [(dbgdir, outname+'_p{}'.format(i)) for i in range(n_parts)])
+            pool.close()
+            pool.join()
+
+        merge.merge_reports(outdir, dbgdir, outname, n_parts)
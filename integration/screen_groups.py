@@ -0,0 +1,26 @@
+import sys, os, imp
+
+directory = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(directory)
+
+import peak
+
+imp.reload(peak)
+
+from peak import PeakStatistics
+
+_, filename, *args = sys.argv
+
+tolerance = float(args[0]) if len(args) > 0 else 0.15
+max_violations = float(args[1]) if len(args) > 1 else 0.01
+
+peak_statistics = PeakStatistics(filename, 'P 1')
+
+candidates = peak_statistics.screen_groups(tolerance, max_violations)
+
+fname, ext = os.path.splitext(filename)
+
+print('{} consistent space groups, see {}'.format(len(candidates), fname+'_groups.txt'))
+
+for symbol in candidates[:10]:
+    print(symbol)
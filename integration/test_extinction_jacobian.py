@@ -0,0 +1,75 @@
+import os
+import sys
+
+directory = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(directory)
+
+import numpy as np
+
+import imp
+
+import peak
+imp.reload(peak)
+
+from peak import PeakDictionary
+
+np.random.seed(13)
+
+n, n_fam = 200, 8
+
+family = np.random.randint(0, n_fam, size=n)
+
+I, E = np.random.uniform(10, 100, size=n), np.random.uniform(1, 5, size=n)
+
+two_theta = np.random.uniform(0.3, 2.5, size=n)
+omega = np.random.uniform(-np.pi, np.pi, size=n)
+lamda = np.random.uniform(0.7, 3.0, size=n)
+Tbar = np.random.uniform(0.01, 0.1, size=n)
+
+u_dir, d_dir = np.random.normal(size=(2,n,3))
+u_dir /= np.linalg.norm(u_dir, axis=1).reshape(-1,1)
+d_dir /= np.linalg.norm(d_dir, axis=1).reshape(-1,1)
+
+c1, c2 = np.random.uniform(0.5, 1.5, size=n), np.random.uniform(0.5, 1.0, size=n)
+
+F2 = np.random.uniform(10, 100, size=n_fam)
+
+args = (I, E, None, two_theta, omega, lamda, Tbar, u_dir, d_dir, 1e+6, 300, c1, c2, family)
+
+values = {'s': 2, 'U': 3e-3, 'mu': 0.3, 'phi': -0.4, 'a': 0.7, 'b': 0.2, 'c': 1.2, 'e': 0.4}
+
+for v, lamdas in zip(['r','g'], [[2e-7,3e-7,4e-7],[2e+4,3e+4,4e+4]]):
+    for j, val in enumerate(lamdas+[0.3,1.2,-0.5]):
+        values['{}_vals_{}'.format(v,j)] = val
+
+names = ['{}_vals_{}'.format(v,j) for v in ['r','g'] for j in range(6)]+['mu','phi','a','b','c','e']
+
+peak_dictionary = PeakDictionary.__new__(PeakDictionary)
+
+internal = peak_dictionary._PeakDictionary__extinction_internal
+evaluate = peak_dictionary._PeakDictionary__extinction_evaluate
+
+for model in ['primary', 'secondary, gaussian', 'secondary, lorentzian',
+              'secondary, gaussian type I', 'secondary, lorentzian type II']:
+
+    theta = internal(values, names)
+
+    res, Jg, Jl, _ = evaluate(theta, names, [], values, F2, True, args, model)
+
+    J_num = np.zeros_like(Jg)
+
+    for k in range(len(names)):
+
+        step = np.zeros_like(theta)
+        step[k] = 1e-6*np.max([np.abs(theta[k]), 1])
+
+        res_1 = evaluate(theta+step, names, [], values, F2, True, args, model)[0]
+        res_0 = evaluate(theta-step, names, [], values, F2, True, args, model)[0]
+
+        J_num[:,k] = (res_0-res_1)/(2*step[k])
+
+    error = np.max(np.abs(Jg-J_num).max(axis=0)/np.maximum(np.abs(J_num).max(axis=0), 1e-12))
+
+    print('{}: maximum relative Jacobian error: {:.2e}'.format(model, error))
+
+    assert error < 1e-4
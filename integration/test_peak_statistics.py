@@ -0,0 +1,69 @@
+import os
+import sys
+
+directory = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(directory)
+
+import numpy as np
+
+import imp
+
+import peak
+imp.reload(peak)
+
+from peak import PeakStatistics
+
+np.random.seed(13)
+
+generators = [np.array([[0,-1,0],[1,0,0],[0,0,1]]), np.diag([1,1,-1]), np.diag([-1,1,1])]
+
+matrices = [np.eye(3, dtype=int)]
+
+for M in matrices:
+    for G in generators:
+        P = np.dot(M, G)
+        if not any([np.array_equal(P, N) for N in matrices]):
+            matrices.append(P)
+
+matrices = np.array(matrices)
+
+assert len(matrices) == 16
+
+n = 400
+
+hkl = np.random.randint(-4, 5, size=(n,3))
+I = np.random.exponential(100, size=n)
+
+statistics = PeakStatistics.__new__(PeakStatistics)
+
+inverse, first, redundancy, observed, counts = statistics._PeakStatistics__equivalence_classes(hkl, matrices)
+
+Q1, Q3 = [statistics._PeakStatistics__segment_percentile(I, inverse, counts, q) for q in [25,75]]
+
+dictionary = {}
+
+for i, ind in enumerate(hkl):
+
+    key = tuple(sorted(set([tuple(np.dot(M, ind)) for M in matrices])))
+
+    if dictionary.get(key) is None:
+        dictionary[key] = [len(key),[i]]
+    else:
+        dictionary[key][1].append(i)
+
+assert len(dictionary) == len(counts)
+
+for key, (multiplicity, rows) in dictionary.items():
+
+    c = inverse[rows[0]]
+
+    assert np.all(inverse[rows] == c)
+    assert counts[c] == len(rows)
+    assert redundancy[c] == multiplicity
+    assert observed[c] == len(set([tuple(hkl[row]) for row in rows]))
+    assert first[c] == rows[0]
+
+    assert np.isclose(Q1[c], np.percentile(I[rows], 25))
+    assert np.isclose(Q3[c], np.percentile(I[rows], 75))
+
+print('{} equivalence classes match the reference grouping'.format(len(counts)))
@@ -0,0 +1,95 @@
+import os
+import sys
+import shutil
+import tempfile
+
+directory = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(directory)
+
+directory = os.path.abspath(os.path.join(directory, '..', 'reduction'))
+sys.path.append(directory)
+
+import numpy as np
+
+import imp
+
+import q_index
+imp.reload(q_index)
+
+from q_index import QIndex, build_q_index, morton_keys
+
+np.random.seed(13)
+
+def interleave(i, j, k):
+
+    key = 0
+    for b in range(21):
+        key |= ((i >> b) & 1) << 3*b
+        key |= ((j >> b) & 1) << 3*b+1
+        key |= ((k >> b) & 1) << 3*b+2
+
+    return key
+
+cells = np.random.randint(0, 2**21, size=(500,3))
+
+keys = morton_keys(cells)
+
+assert all([int(key) == interleave(*[int(c) for c in cell]) for key, cell in zip(keys, cells)])
+
+n = 50000
+
+Q = np.random.uniform(-4, 4, size=(n,3)).astype(np.float32).astype(float)
+bank = np.random.randint(1, 20, size=n)
+
+tmpdir = tempfile.mkdtemp()
+
+basename = os.path.join(tmpdir, 'test')
+
+build_q_index(basename, Q, bank, {'run': 0})
+
+index = QIndex(basename)
+
+assert index.metadata['events'] == n
+assert index.metadata['run'] == 0
+
+def lexsorted(a):
+
+    return a[np.lexsort(a.T[::-1])]
+
+for _ in range(20):
+
+    Q_min = np.random.uniform(-5, 4, size=3)
+    Q_max = Q_min+np.random.uniform(0, 2, size=3)
+
+    banks = np.random.choice(np.arange(1, 20), size=5, replace=False).tolist()
+
+    for b in [None, banks]:
+
+        mask = np.all((Q >= Q_min) & (Q <= Q_max), axis=1)
+
+        if b is not None:
+            mask &= np.isin(bank, b)
+
+        result = index.query_box(Q_min, Q_max, b)
+
+        assert result.shape == (mask.sum(),3)
+        assert np.array_equal(lexsorted(result), lexsorted(Q[mask]))
+
+W = np.linalg.qr(np.random.normal(size=(3,3)))[0]
+
+for _ in range(20):
+
+    Q0 = np.random.uniform(-3, 3, size=3)
+    radii = np.random.uniform(0.1, 1, size=3)
+
+    mask = np.sum((np.dot(Q-Q0, W)/radii)**2, axis=1) <= 1
+
+    result = index.query_ellipsoid(Q0, W, radii)
+
+    assert np.array_equal(lexsorted(result), lexsorted(Q[mask]))
+
+assert index.query_box([10,10,10], [11,11,11]).shape == (0,3)
+
+shutil.rmtree(tmpdir)
+
+print('q-index queries match brute force')
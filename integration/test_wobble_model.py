@@ -0,0 +1,45 @@
+import os
+import sys
+
+directory = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(directory)
+
+import numpy as np
+
+import scipy.optimize
+
+import imp
+
+import wobble_model
+imp.reload(wobble_model)
+
+from wobble_model import scale, scale_jacobian, residual, jacobian
+
+np.random.seed(13)
+
+n = 50
+
+omega_1, omega_2 = np.random.uniform(-180, 180, size=(2,n))
+lamda_1, lamda_2 = np.random.uniform(0.7, 3.0, size=(2,n))
+intens_1, intens_2 = np.random.uniform(10, 100, size=(2,n))
+
+args = (omega_1, lamda_1, intens_1, omega_2, lamda_2, intens_2)
+
+# mu, alpha, beta, omega, a, bx, by, c, e
+x = np.array([15, 30, 60, 10, 0.1, 0.05, -0.02, 0.8, 0.3])
+
+s, J = scale_jacobian(omega_1, lamda_1, *x)
+
+assert np.allclose(s, scale(omega_1, lamda_1, *x))
+
+J = jacobian(x, *args)
+
+J_num = scipy.optimize.approx_fprime(x, residual, 1e-7*np.maximum(np.abs(x), 1), *args)
+
+assert J.shape == (n,9)
+
+error = np.abs(J-J_num).max()/np.abs(J_num).max()
+
+print('maximum relative Jacobian error: {:.2e}'.format(error))
+
+assert error < 1e-4
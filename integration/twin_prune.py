@@ -151,16 +151,13 @@ LoadIsawUB(InputWorkspace='cws', Filename=os.path.join(outdir, outname+'_cal.mat
 peak_dictionary.save_calibration(os.path.join(outdir, outname+'_cal.nxs'))
 peak_dictionary.recalculate_hkl(fname=os.path.join(outdir, 'indexing.txt'))
 
-for pn in range(mtd['iws'].getNumberPeaks()-1,-1,-1):
+hklmnp = np.array([list(pk.getIntHKL())+list(pk.getIntMNP()) for pk in [mtd['cws'].getPeak(pn) for pn in range(mtd['cws'].getNumberPeaks())]]).reshape(-1,6)
 
-    pk = mtd['cws'].getPeak(pn)
+zero = np.argwhere((hklmnp == 0).all(axis=1)).flatten().tolist()
 
-    h, k, l = pk.getIntHKL()
-    m, n, p = pk.getIntMNP()
-
-    if (np.array([h,k,l,m,n,p]) == 0).all():
-        mtd['iws'].removePeak(pn)
-        mtd['cws'].removePeak(pn)
+if len(zero) > 0:
+    DeleteTableRows(TableWorkspace='iws', Rows=zero)
+    DeleteTableRows(TableWorkspace='cws', Rows=zero)
 
 d = mtd['cws'].column(6)
 
@@ -178,6 +175,15 @@ LoadIsawUB(InputWorkspace='ref', Filename=ub_file)
 
 UB = mtd['ref'].sample().getOrientedLattice().getUB()
 
+hklmnp = np.array([list(pk.getIntHKL())+list(pk.getIntMNP()) for pk in [mtd['iws'].getPeak(pn) for pn in range(mtd['iws'].getNumberPeaks())]]).reshape(-1,6)
+
+mod_vectors = np.array([mod_vector_1, mod_vector_2, mod_vector_3], dtype=float)
+
+Q = 2*np.pi*np.dot(hklmnp[:,0:3]+np.dot(hklmnp[:,3:6], mod_vectors), UB.T)
+n = Q/np.linalg.norm(Q, axis=1)[:,np.newaxis]
+
+overlap = np.zeros(len(Q), dtype=bool)
+
 for i, ub_twin in enumerate(ub_twin_list):
     CloneWorkspace(InputWorkspace='ref', OutputWorkspace='iws{}'.format(i))
     ClearUB(Workspace='iws{}'.format(i))
@@ -194,24 +200,26 @@ for i, ub_twin in enumerate(ub_twin_list):
     Qx, Qy, Qz = np.array(mtd['iws{}'.format(i)].column(12)).T
     points = np.c_[Qx, Qy, Qz]
 
+    if len(Q) == 0 or len(points) == 0:
+        continue
+
     tree = scipy.spatial.cKDTree(points)
 
-    for pn in range(mtd['iws'].getNumberPeaks()-1,-1,-1):
+    results = tree.query_ball_point(Q, 0.35)
+
+    counts = np.array([len(result) for result in results])
+    neighbors = np.concatenate(results.tolist()+[[]]).astype(int)
 
-        pk = mtd['iws'].getPeak(pn)
+    peaks = np.repeat(np.arange(len(Q)), counts)
 
-        h, k, l = pk.getIntHKL()
-        m, n, p = pk.getIntMNP()
+    distance = np.abs(np.einsum('ij,ij->i', n[peaks], points[neighbors]-Q[peaks]))
 
-        dh, dk, dl = m*np.array(mod_vector_1)+n*np.array(mod_vector_2)+p*np.array(mod_vector_3)       
-        Q = 2*np.pi*np.dot(UB,[h+dh,k+dk,l+dl])
-        n = Q/np.linalg.norm(Q)
+    overlap[peaks[distance < 0.2]] = True
 
-        results = tree.query_ball_point(Q, 0.35)
+rows = np.argwhere(overlap).flatten().tolist()
 
-        for result in results:
-            if np.abs(np.dot(n, points[result]-Q)) < 0.2:
-                mtd['iws'].removePeak(pn)
+if len(rows) > 0:
+    DeleteTableRows(TableWorkspace='iws', Rows=rows)
 
 peak_dictionary.save_hkl(os.path.join(outdir, outname+'_twin.hkl'), adaptive_scale=False, scale=scale)
 peak_dictionary.save_reflections(os.path.join(outdir, outname+'_twin.hkl'), adaptive_scale=False, scale=scale)
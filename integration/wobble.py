@@ -23,6 +23,8 @@ import parameters
 
 from peak import PeakDictionary, PeakStatistics, PeakFitPrune
 
+from wobble_model import scale, residual, jacobian
+
 from mantid.geometry import PointGroupFactory, SpaceGroupFactory, CrystalStructure
 
 from mantid.kernel import V3D
@@ -127,8 +129,6 @@ if not all([a,b,c,alpha,beta,gamma]):
 
 scale_constant = 1e+4
 
-scale = np.loadtxt(os.path.join(outdir, 'scale.txt'))
-
 cif_file = dictionary.get('cif-file')
 
 peak_dictionary = PeakDictionary(a, b, c, alpha, beta, gamma)
@@ -260,111 +260,62 @@ for key in symmetry.keys():
 values = np.array(values)
 angles = np.array(angles)
 
-def scale(theta, wl, mu, alpha, beta, omega, a, bx, by, c, e):
-
-    t = np.deg2rad(theta-mu)
-
-    x0 = c*np.cos(t)
-    y0 = np.zeros_like(x0)
-    z0 = c*np.sqrt(1-e**2)*np.sin(t)
-
-    ux = np.cos(np.deg2rad(alpha))*np.sin(np.deg2rad(beta))
-    uy = np.sin(np.deg2rad(alpha))*np.sin(np.deg2rad(beta))
-    uz = np.cos(np.deg2rad(beta))
-
-    gamma = np.deg2rad(omega)
-
-    U = np.array([[np.cos(gamma)+ux**2*(1-np.cos(gamma)), ux*uy*(1-np.cos(gamma))-uz*np.sin(gamma), ux*uz*(1-np.cos(gamma))+uy*np.sin(gamma)],
-                  [uy*ux*(1-np.cos(gamma))+uz*np.sin(gamma), np.cos(gamma)+uy**2*(1-np.cos(gamma)), uy*uz*(1-np.cos(gamma))-ux*np.sin(gamma)],
-                  [uz*ux*(1-np.cos(gamma))-uy*np.sin(gamma), uz*uy*(1-np.cos(gamma))+ux*np.sin(gamma), np.cos(gamma)+uz**2*(1-np.cos(gamma))]])
-
-    x, y, z = np.einsum('ij,jk->ik', U, [x0,y0,z0])
-
-    f = np.exp(-0.5*((x-bx)**2+(y-by)**2)/(1+a*wl)**2)
-
-    return 1/f
+def pair_observations(ref_dict, keys):
 
-def residual(x, ref_dict, keys):
-
-#     mu = params['mu']
-#     alpha = params['alpha']
-# 
-#     a = params['a']
-#     b = params['b']
-#     c = params['c']
-#     e = params['e']
-# 
-#     x = mu.value, alpha.value, a.value, b.value, c.value, e.value
-
-    mu, alpha, beta, omega, a, bx, by, c, e = x
-
-    #print((6*'{:.4f} ').format(*x))
-
-    diff = []
+    omegas_1, lamdas_1, intens_1 = [], [], []
+    omegas_2, lamdas_2, intens_2 = [], [], []
 
     for equivalents in keys:
 
-        y, z, sig = [], [], []
-
         peaks_1 = ref_dict[equivalents[0]]
         peaks_2 = ref_dict[equivalents[1]]
 
         for peak_1 in peaks_1:
 
             if peak_1.is_peak_integrated() and len(peak_1.get_individual_bin_size()) > 0:
-                #peak_1.individual_integrate()
-                #peak_1.prune_peaks()
 
                 lamda_1 = peak_1.get_wavelengths().copy()
                 omega_1 = peak_1.get_omega_angles().copy()
-                scales_1 = peak_1.get_data_scale().copy()
 
-                intens_1 = peak_1.get_individual_intensity().copy()
-                sig_intens_1 = peak_1.get_individual_intensity_error().copy()
+                intensity_1 = peak_1.get_individual_intensity().copy()
+                sig_intensity_1 = peak_1.get_individual_intensity_error().copy()
 
                 fit_intens_1 = peak_1.get_individual_fitted_intensity().copy()
                 fit_sig_intens_1 = peak_1.get_individual_fitted_intensity_error().copy()
 
                 pk_vol_fract_1 = peak_1.get_individual_peak_volume_fraction().copy()
 
-                mask_1 = (intens_1 > 3*sig_intens_1) & (fit_intens_1 > 3*fit_sig_intens_1) & (pk_vol_fract_1 > 0.85)
+                mask_1 = (intensity_1 > 3*sig_intensity_1) & (fit_intens_1 > 3*fit_sig_intens_1) & (pk_vol_fract_1 > 0.85)
 
                 lamda_1 = lamda_1[mask_1]
                 omega_1 = omega_1[mask_1]
-                scales_1 = scales_1[mask_1]
 
-                intens_1 = intens_1[mask_1]
-                sig_intens_1 = sig_intens_1[mask_1]
-                indices_1 = np.arange(lamda_1.size) 
+                intensity_1 = intensity_1[mask_1]
+                indices_1 = np.arange(lamda_1.size)
 
                 if len(indices_1) > 0:
 
                     for peak_2 in peaks_2:
 
                         if peak_2.is_peak_integrated() and len(peak_2.get_individual_bin_size()) > 0:
-                            #peak_2.individual_integrate()
-                            #peak_2.prune_peaks()
 
                             lamda_2 = peak_2.get_wavelengths().copy()
                             omega_2 = peak_2.get_omega_angles().copy()
-                            scales_2 = peak_2.get_data_scale().copy()
 
-                            intens_2 = peak_2.get_individual_intensity().copy()
-                            sig_intens_2 = peak_2.get_individual_intensity_error().copy()
+                            intensity_2 = peak_2.get_individual_intensity().copy()
+                            sig_intensity_2 = peak_2.get_individual_intensity_error().copy()
 
                             fit_intens_2 = peak_2.get_individual_fitted_intensity().copy()
                             fit_sig_intens_2 = peak_2.get_individual_fitted_intensity_error().copy()
 
                             pk_vol_fract_2 = peak_2.get_individual_peak_volume_fraction().copy()
 
-                            mask_2 = (intens_2 > 3*sig_intens_2) & (fit_intens_2 > 3*fit_sig_intens_2) & (pk_vol_fract_2 > 0.85)
+                            mask_2 = (intensity_2 > 3*sig_intensity_2) & (fit_intens_2 > 3*fit_sig_intens_2) & (pk_vol_fract_2 > 0.85)
 
                             lamda_2 = lamda_2[mask_2]
                             omega_2 = omega_2[mask_2]
-                            scales_2 = scales_2[mask_2]
 
-                            intens_2 = intens_2[mask_2]
-                            sig_intens_2 = sig_intens_2[mask_2]
+                            intensity_2 = intensity_2[mask_2]
                             indices_2 = np.arange(lamda_2.size)
 
                             if len(indices_2) > 0:
@@ -373,9 +324,6 @@ def residual(x, ref_dict, keys):
                                 angle_2 = np.mod(omega_2, 180)
 
                                 inds = np.isclose(angle_1, angle_2[:,np.newaxis], atol=1e-1)
-                                #print(angle_1.round(2))
-                                #print(angle_2.round(2))
-                                #print(inds)
 
                                 i1, i2 = np.meshgrid(indices_1, indices_2, indexing='xy')
 
@@ -384,95 +332,20 @@ def residual(x, ref_dict, keys):
                                 i1_inds = i1_inds[np.argsort(angle_1[i1_inds])]
                                 i2_inds = i2_inds[np.argsort(angle_2[i2_inds])]
 
-                                if len(i1_inds) > 0 and len(i2_inds) > 0 and len(intens_1) > 0 and len(intens_2) > 0 and len(i1_inds) == len(i2_inds) and len(intens_1) == len(intens_2) and len(intens_1) > i1_inds.max():
-
-                                    s1 = scale(omega_1, lamda_1, mu, alpha, beta, omega, a, bx, by, c, e)
-                                    s2 = scale(omega_2, lamda_2, mu, alpha, beta, omega, a, bx, by, c, e)
-
-                                    #sig_intens_1 = peak_1.get_partial_merged_intensity_error(i1_inds, False)
-                                    #sig_intens_2 = peak_2.get_partial_merged_intensity_error(i2_inds, False)
-
-                                    #sig_intens_1 = peak_1.get_individual_intensity_error()
-                                    #sig_intens_2 = peak_2.get_individual_intensity_error()
-
-                                    #sig_intens_1 = np.sqrt(np.mean(sig_intens_1[i1_inds]**2))
-                                    #sig_intens_2 = np.sqrt(np.mean(sig_intens_2[i2_inds]**2))
-
-                                    #peak_1.set_data_scale(scales_1*s1)
-                                    #peak_2.set_data_scale(scales_2*s2)
-
-                                    #intens_1 = peak_1.get_partial_merged_intensity(i1_inds)
-                                    #intens_2 = peak_2.get_partial_merged_intensity(i2_inds)
-
-                                    #intens_1 = peak_1.get_individual_intensity()
-                                    #intens_2 = peak_2.get_individual_intensity()
-
-                                    #intens_1 = np.mean(intens_1[i1_inds])
-                                    #intens_2 = np.mean(intens_2[i2_inds])
-
-                                    intens_1 = intens_1[i1_inds]
-                                    intens_2 = intens_2[i2_inds]
-
-                                    sig_intens_1 = sig_intens_1[i1_inds]
-                                    sig_intens_2 = sig_intens_2[i2_inds]
-
-                                    s1 = s1[i1_inds]
-                                    s2 = s2[i2_inds]
-
-                                    if len(intens_1) > 0 and len(intens_2) > 0:
-
-                                        #ave_intens_1 = np.sum(intens_1/sig_intens_1**2)/np.sum(1/sig_intens_2**2)
-                                        #ave_intens_2 = np.sum(intens_2/sig_intens_2**2)/np.sum(1/sig_intens_2**2)
-
-                                        #ave_sig_intens_1 = 1/np.sqrt(np.sum(1/sig_intens_1**2))
-                                        #ave_sig_intens_2 = 1/np.sqrt(np.sum(1/sig_intens_2**2))
-
-                                        #peak_1.set_data_scale(scales_1)
-                                        #peak_2.set_data_scale(scales_2)
-
-                                        #z = np.array([ave_intens_1,ave_intens_2])
-                                        #sig = np.array([ave_sig_intens_1,ave_sig_intens_2])
-
-                                        #z0 = np.sum(z/sig**2)/np.sum(1/sig**2)
-                                        #sig0 = 1/np.sqrt(np.sum(1/sig**2))
-
-                                        #x0 = intens_1/intens_2
-                                        #y0 = intens_2/intens_1
-                                        #x = s2/s1
-                                        #y = s1/s2
-                                        #sig = np.sqrt(sig_intens_1**2/intens_1**2+sig_intens_2**2/intens_2**2)
-
-                                        #diff += (np.abs(x0-x)/sig).tolist() #np.linalg.norm
-                                        #diff += (np.abs(y0-y)/sig).tolist() #np.linalg.norm
-
-                                        diff += (intens_1*s1-intens_2*s2).tolist()
-                                        #diff += (1/intens_1/s1-1/intens_2/s2).tolist()
-
-                                        #z0 = np.diff(z)
-                                        #diff += ((intens_1-z0)/sig_intens_1).tolist()
-                                        #diff += ((intens_2-z0)/sig_intens_2).tolist()
-
-                                        #inv_z0 = np.diff(1/z)
-                                        #diff += ((1/intens_1-1/z0)*sig_intens_1).tolist()
-                                        #diff += ((1/intens_2-1/z0)*sig_intens_2).tolist()
-
-                                        z += (intens_1*s1).tolist()
-                                        z += (intens_2*s2).tolist()
-                                        sig += (sig_intens_1).tolist()
-                                        sig += (sig_intens_2).tolist()
+                                if len(i1_inds) > 0 and len(i2_inds) > 0 and len(i1_inds) == len(i2_inds) and len(intensity_1) == len(intensity_2) and len(intensity_1) > i1_inds.max():
 
-        z, sig = np.array(z), np.array(sig)
-        #z0 = np.sum(z/sig**2)/np.sum(1/sig**2)
-        #sig0 = 1/np.sqrt(np.sum(1/sig**2))
+                                    omegas_1 += omega_1[i1_inds].tolist()
+                                    lamdas_1 += lamda_1[i1_inds].tolist()
+                                    intens_1 += intensity_1[i1_inds].tolist()
 
-        #y0 = np.mean(y)
-        z0 = np.mean(z)
+                                    omegas_2 += omega_2[i2_inds].tolist()
+                                    lamdas_2 += lamda_2[i2_inds].tolist()
+                                    intens_2 += intensity_2[i2_inds].tolist()
 
-        #diff += ((y-y0)).tolist()
-        #diff += ((z-z0)).tolist()
-        #diff += ((1/z-1/z0)*sig0).tolist()
+    omegas_1, lamdas_1, intens_1 = np.array(omegas_1), np.array(lamdas_1), np.array(intens_1)
+    omegas_2, lamdas_2, intens_2 = np.array(omegas_2), np.array(lamdas_2), np.array(intens_2)
 
-    return diff
+    return omegas_1, lamdas_1, intens_1, omegas_2, lamdas_2, intens_2
 
 def init(theta, mu, k):
 
@@ -537,10 +410,10 @@ d = 0.1
 e = 0.0
 
 x0 = (mu, alpha, beta, omega, a, bx, by, c, e)
-args = (ref_dict, data)
+args = pair_observations(ref_dict, data)
 bounds = ([-180, -180, 0, -180, 0, 0, 0, 0, 0], [180, 180, 180, 180, np.inf, np.inf, np.inf, np.inf, 1])
 
-sol = least_squares(residual, x0, args=args, bounds=np.array(bounds), method='trf', verbose=2) #, method='trust-constr', loss='soft_l1'
+sol = least_squares(residual, x0, jac=jacobian, args=args, bounds=np.array(bounds), method='trf', verbose=2) #, method='trust-constr', loss='soft_l1'
 mu, alpha, beta, omega, a, bx, by, c, e = sol.x
 
 # params = Parameters()
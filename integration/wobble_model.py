@@ -0,0 +1,94 @@
+import numpy as np
+
+def axis(alpha, beta):
+
+    alpha, beta = np.deg2rad(alpha), np.deg2rad(beta)
+
+    return np.array([np.cos(alpha)*np.sin(beta), np.sin(alpha)*np.sin(beta), np.cos(beta)])
+
+def cross(u):
+
+    ux, uy, uz = u
+
+    return np.array([[0, -uz, uy], [uz, 0, -ux], [-uy, ux, 0]])
+
+def rotation(u, gamma):
+
+    return np.cos(gamma)*np.eye(3)+(1-np.cos(gamma))*np.outer(u,u)+np.sin(gamma)*cross(u)
+
+def scale(theta, wl, mu, alpha, beta, omega, a, bx, by, c, e):
+
+    t = np.deg2rad(theta-mu)
+
+    x0 = c*np.cos(t)
+    y0 = np.zeros_like(x0)
+    z0 = c*np.sqrt(1-e**2)*np.sin(t)
+
+    U = rotation(axis(alpha, beta), np.deg2rad(omega))
+
+    x, y, z = np.dot(U, [x0,y0,z0])
+
+    f = np.exp(-0.5*((x-bx)**2+(y-by)**2)/(1+a*wl)**2)
+
+    return 1/f
+
+def scale_jacobian(theta, wl, mu, alpha, beta, omega, a, bx, by, c, e):
+
+    deg = np.pi/180
+
+    t = np.deg2rad(theta-mu)
+
+    r = np.sqrt(np.max([1-e**2, 1e-12]))
+
+    zero = np.zeros_like(t)
+
+    v = np.array([c*np.cos(t), zero, c*r*np.sin(t)])
+
+    dv_dmu = np.array([c*np.sin(t), zero, -c*r*np.cos(t)])*deg
+    dv_dc = np.array([np.cos(t), zero, r*np.sin(t)])
+    dv_de = np.array([zero, zero, -c*e/r*np.sin(t)])
+
+    al, be, gamma = np.deg2rad([alpha, beta, omega])
+
+    u = axis(alpha, beta)
+
+    du_dal = np.array([-np.sin(al)*np.sin(be), np.cos(al)*np.sin(be), 0])*deg
+    du_dbe = np.array([np.cos(al)*np.cos(be), np.sin(al)*np.cos(be), -np.sin(be)])*deg
+
+    U = rotation(u, gamma)
+
+    dU_dal = (1-np.cos(gamma))*(np.outer(du_dal,u)+np.outer(u,du_dal))+np.sin(gamma)*cross(du_dal)
+    dU_dbe = (1-np.cos(gamma))*(np.outer(du_dbe,u)+np.outer(u,du_dbe))+np.sin(gamma)*cross(du_dbe)
+    dU_dga = (-np.sin(gamma)*np.eye(3)+np.sin(gamma)*np.outer(u,u)+np.cos(gamma)*cross(u))*deg
+
+    x, y, z = np.dot(U, v)
+
+    W = 1+a*wl
+    Q = (x-bx)**2+(y-by)**2
+
+    s = np.exp(0.5*Q/W**2)
+
+    derivatives = [np.dot(U, dv_dmu), np.dot(dU_dal, v), np.dot(dU_dbe, v), np.dot(dU_dga, v), np.dot(U, dv_dc), np.dot(U, dv_de)]
+
+    mu_, al_, be_, ga_, c_, e_ = [s*((x-bx)*dx+(y-by)*dy)/W**2 for dx, dy, dz in derivatives]
+
+    a_ = -s*Q*wl/W**3
+
+    bx_ = -s*(x-bx)/W**2
+    by_ = -s*(y-by)/W**2
+
+    return s, np.column_stack([mu_, al_, be_, ga_, a_, bx_, by_, c_, e_])
+
+def residual(x, omega_1, lamda_1, intens_1, omega_2, lamda_2, intens_2):
+
+    s1 = scale(omega_1, lamda_1, *x)
+    s2 = scale(omega_2, lamda_2, *x)
+
+    return intens_1*s1-intens_2*s2
+
+def jacobian(x, omega_1, lamda_1, intens_1, omega_2, lamda_2, intens_2):
+
+    s1, J1 = scale_jacobian(omega_1, lamda_1, *x)
+    s2, J2 = scale_jacobian(omega_2, lamda_2, *x)
+
+    return intens_1[:,np.newaxis]*J1-intens_2[:,np.newaxis]*J2
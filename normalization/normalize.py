@@ -31,8 +31,17 @@ sys.path.append(directory)
 
 import imp
 import parameters
+import pyramid
+import prefetch
+import cache
 
 imp.reload(parameters)
+imp.reload(pyramid)
+imp.reload(prefetch)
+imp.reload(cache)
+
+from prefetch import RunPrefetcher
+from cache import WorkspaceCache
 
 dictionary = parameters.load_input_file(filename)
 
@@ -201,9 +210,292 @@ if group is not None:
 else:
     symmetry = '-1'
 
+post_symmetrize = dictionary.get('post-symmetrize')
+
+if post_symmetrize is None:
+    post_symmetrize = False
+
+# bounds the per-worker histogram (MB); the parent still divides and saves full grids, so its RAM sets the overall limit
+memory_cap = dictionary.get('memory-cap')
+
+pyramid_levels = dictionary.get('pyramid-levels')
+
+slice_planes = dictionary.get('slices')
+
+prefetch_lookahead = dictionary.get('prefetch-lookahead')
+if prefetch_lookahead is None:
+    prefetch_lookahead = 0
+
+prefetch_memory = dictionary.get('prefetch-memory')
+if prefetch_memory is None:
+    prefetch_memory = 70
+
+cache_directory = dictionary.get('cache-directory')
+cache_limit = dictionary.get('cache-limit')
+
+md_cache = WorkspaceCache(cache_directory, instrument, tube_calibration, detector_calibration,
+                          mask_file, counts_file, spectrum_file, ub_file, elastic, timing_offset)
+
+def bin_centers(binning):
+
+    lo, step, hi = binning
+
+    n_bins = int(np.round((hi-lo)/step))
+
+    return lo+step*(np.arange(n_bins)+0.5)
+
+def symmetry_mapping(symmetry, u_proj, v_proj, w_proj, u_binning, v_binning, w_binning, tol=1e-3):
+
+    W = np.array([u_proj,v_proj,w_proj]).T
+    W_inv = np.linalg.inv(W)
+
+    binnings = [u_binning, v_binning, w_binning]
+
+    centers = [bin_centers(binning) for binning in binnings]
+
+    shape = [len(center) for center in centers]
+
+    lo = np.array([binning[0] for binning in binnings])
+    step = np.array([binning[1] for binning in binnings])
+
+    u, v, w = np.meshgrid(*centers, indexing='ij')
+
+    uvw = np.column_stack([u.flatten(), v.flatten(), w.flatten()])
+
+    pg = PointGroupFactory.createPointGroup(symmetry)
+
+    mapping = []
+
+    for op in pg.getSymmetryOperations():
+
+        R = np.column_stack([op.transformHKL(vec) for vec in ([1,0,0],[0,1,0],[0,0,1])])
+
+        M = np.dot(W_inv, np.dot(R, W))
+
+        x = (np.dot(uvw, M.T)-lo)/step-0.5
+
+        ind = np.round(x).astype(int)
+
+        if not np.allclose(x, ind, atol=tol):
+            return None
+
+        if (ind < 0).any() or (ind >= shape).any():
+            return None
+
+        mapping.append(np.ravel_multi_index(ind.T, shape))
+
+    return mapping
+
+def symmetrize_histogram(ws, mapping):
+
+    signal = mtd[ws].getSignalArray().copy()
+    error_sq = mtd[ws].getErrorSquaredArray().copy()
+
+    shape = signal.shape
+
+    signal = signal.flatten()
+    error_sq = error_sq.flatten()
+
+    mtd[ws].setSignalArray(np.sum([signal[ind] for ind in mapping], axis=0).reshape(shape))
+    mtd[ws].setErrorSquaredArray(np.sum([error_sq[ind] for ind in mapping], axis=0).reshape(shape))
+
+def slice_bounds(UB, proj, binnings, symmetry):
+
+    W = np.array(proj).T
+
+    edges = [[binning[0], binning[2]] for binning in binnings]
+
+    corners = np.array(np.meshgrid(*edges, indexing='ij')).reshape(3,-1).T
+
+    hkl = np.dot(corners, W.T)
+
+    if symmetry is not None:
+        pg = PointGroupFactory.createPointGroup(symmetry)
+        Rs = [np.column_stack([op.transformHKL(vec) for vec in ([1,0,0],[0,1,0],[0,0,1])]) for op in pg.getSymmetryOperations()]
+    else:
+        Rs = [np.eye(3)]
+
+    hkl = np.vstack([np.dot(hkl, R.T) for R in Rs])
+
+    Q = 2*np.pi*np.dot(hkl, UB.T)
+
+    return Q.min(axis=0), Q.max(axis=0)
+
+def histogram_slabs(memory_cap, u_binning, v_binning, w_binning, bytes_per_bin=128):
+
+    n_u, n_v, n_w = [len(bin_centers(binning)) for binning in [u_binning, v_binning, w_binning]]
+
+    rows = max(1, int(memory_cap*1024**2 // (n_v*n_w*bytes_per_bin)))
+
+    return [(i0, min(i0+rows, n_u)) for i0 in range(0, n_u, rows)]
+
+def projection_name(proj):
+
+    letter = 'HKL'[np.argmax(np.abs(proj))]
+
+    components = []
+
+    for value in proj:
+        if value == 0:
+            components.append('0')
+        elif value == 1:
+            components.append(letter)
+        elif value == -1:
+            components.append('-'+letter)
+        else:
+            components.append('{:.3g}{}'.format(value, letter))
+
+    return '['+','.join(components)+']'
+
+def create_histogram(ws, header, u_proj, v_proj, w_proj, u_binning, v_binning, w_binning):
+
+    names = [projection_name(proj) for proj in [u_proj, v_proj, w_proj]]
+
+    binnings = [u_binning, v_binning, w_binning]
+
+    extents = []
+    for binning in binnings:
+        lo, step = binning[0], binning[1]
+        extents += [lo, lo+step*len(bin_centers(binning))]
+
+    CreateMDWorkspace(Dimensions=3,
+                      Extents=extents,
+                      Names=','.join(names),
+                      Units='r.l.u.,r.l.u.,r.l.u.',
+                      Frames='HKL,HKL,HKL',
+                      OutputWorkspace=ws)
+
+    BinMD(InputWorkspace=ws,
+          AxisAligned=True,
+          AlignedDim0='{},{},{},{}'.format(names[0],extents[0],extents[1],len(bin_centers(u_binning))),
+          AlignedDim1='{},{},{},{}'.format(names[1],extents[2],extents[3],len(bin_centers(v_binning))),
+          AlignedDim2='{},{},{},{}'.format(names[2],extents[4],extents[5],len(bin_centers(w_binning))),
+          OutputWorkspace=ws)
+
+    LoadMD(OutputWorkspace='header', Filename=header, LoadHistory=False)
+
+    CopyExperimentInfos(InputWorkspace='header', OutputWorkspace=ws)
+
+    DeleteWorkspace('header')
+
+def save_header(ws, fname, p):
+
+    if not os.path.exists(fname+'.nxs'):
+        SaveMD(Inputworkspace=ws, Filename=fname+'_p{}.nxs'.format(p), SaveHistory=False, SaveInstrument=False, SaveSample=False, SaveLogs=False)
+        os.replace(fname+'_p{}.nxs'.format(p), fname+'.nxs')
+
+def save_partial(ws, fname, p):
+
+    save_header(ws, fname, p)
+
+    np.save(fname+'_p{}.npy'.format(p), np.stack([mtd[ws].getSignalArray(), mtd[ws].getErrorSquaredArray()]))
+
+def add_partials(fname, other):
+
+    partial = np.load(fname, mmap_mode='r+')
+    partial += np.load(other, mmap_mode='r')
+    partial.flush()
+
+    del partial
+
+    os.remove(other)
+
+def partial_files(fname, n_proc):
+
+    files = [fname+'_p{}.npy'.format(p) for p in range(n_proc)]
+
+    return [f for f in files if os.path.exists(f)]
+
+def load_partial(ws, fname, partial, template=None):
+
+    if template is None:
+        LoadMD(OutputWorkspace=ws, Filename=fname+'.nxs', LoadHistory=False)
+    else:
+        CloneMDWorkspace(InputWorkspace=template, OutputWorkspace=ws)
+
+    partial = np.load(partial, mmap_mode='r')
+
+    mtd[ws].setSignalArray(partial[0])
+    mtd[ws].setErrorSquaredArray(partial[1])
+
+    del partial
+
+def run_file(r, facility, instrument, ipts):
+
+    fname = '/{}/{}/IPTS-{}/nexus/{}_{}.nxs.h5'.format(facility,instrument,ipts,instrument,r)
+    if not os.path.exists(fname):
+        fname = '/{}/{}/IPTS-{}/shared/data/{}_{}.nxs.h5'.format(facility,instrument,ipts,instrument,r)
+
+    return fname
+
+def load_run(r, ws, facility, instrument, ipts, tube_calibration, detector_calibration, elastic, timing_offset):
+
+    fname = run_file(r, facility, instrument, ipts)
+
+    LoadEventNexus(Filename=fname,
+                   OutputWorkspace=ws)
+
+    if elastic:
+        CopyInstrumentParameters(InputWorkspace=instrument, OutputWorkspace=ws)
+        CorelliCrossCorrelate(InputWorkspace=ws, OutputWorkspace=ws, TimingOffset=timing_offset)
+        # LoadNexus(Filename='/{}/{}/IPTS-{}/shared/autoreduce/{}_{}_elastic.nxs'.format(facility,instrument,ipts,instrument,r), 
+        #           OutputWorkspace=ws) 
+
+    if type(ub_file) is list:
+        ind = [str(r) in ub for ub in ub_file].index(True)
+        LoadIsawUB(InputWorkspace=ws, Filename=ub_file[ind])
+    elif type(ub_file) is str:
+        LoadIsawUB(InputWorkspace=ws, Filename=ub_file)
+    else:
+        UB = mtd[ws].getExperimentInfo(0).sample().getOrientedLattice().getUB()
+        SetUB(Workspace=ws, UB=UB)
+
+    if tube_calibration is not None:
+        ApplyCalibration(Workspace=ws, CalibrationTable='tube_table')
+
+    if detector_calibration is not None:
+        _, ext =  os.path.splitext(detector_calibration)
+        if ext == '.xml':
+            LoadParameterFile(Workspace=ws, Filename=detector_calibration)
+        else:
+            LoadIsawDetCal(InputWorkspace=ws, Filename=detector_calibration)
+
+    MaskDetectors(Workspace=ws, MaskedWorkspace='mask')
+
+    if instrument == 'CORELLI':
+        gon_axis = 'BL9:Mot:Sample:Axis3'
+        possible_axes = ['BL9:Mot:Sample:Axis1', 'BL9:Mot:Sample:Axis2', 'BL9:Mot:Sample:Axis3', 
+                         'BL9:Mot:Sample:Axis1.RBV', 'BL9:Mot:Sample:Axis2.RBV', 'BL9:Mot:Sample:Axis3.RBV'] #.RBV
+        for possible_axis in possible_axes:
+            if mtd[ws].run().hasProperty(possible_axis):
+                angle = np.mean(mtd[ws].run().getProperty(possible_axis).value)
+                if not np.isclose(angle,0):
+                    gon_axis = possible_axis
+        SetGoniometer(Workspace=ws, Axis0='{},0,1,0,1'.format(gon_axis))
+    else:
+        SetGoniometer(Workspace=ws, Goniometers='Universal')
+        SumNeighbours(InputWorkspace=ws, OutputWorkspace=ws, SumX=4, SumY=4)
+
 def run_normalization(runs, p, facility, instrument, ipts, detector_calibration, tube_calibration, 
                       directory, counts_file, spectrum_file, background_file, mask_file,
-                      u_proj, v_proj, w_proj, u_binning, v_binning, w_binning, symmetry, elastic, timing_offset):
+                      u_proj, v_proj, w_proj, u_binning, v_binning, w_binning, symmetry, elastic, timing_offset, slabs, slices):
+
+    apps = [('', None)]
+    if symmetry is not None:
+        apps.append(('_'+symmetry.replace('/','_').strip(), symmetry))
+
+    names = ['data', 'norm']
+    if background_file is not None:
+        names += ['bkg_data', 'bkg_norm']
+
+    if slabs is not None:
+
+        shape = tuple([len(bin_centers(binning)) for binning in [u_binning, v_binning, w_binning]])
+
+        partials = {}
+        for name in names:
+            for app, _ in apps:
+                partials[name+app] = np.lib.format.open_memmap(os.path.join(dbgdir,name+app+'_p{}.npy'.format(p)), mode='w+', dtype=float, shape=(2,)+shape)
 
     if not mtd.doesExist(instrument):
         LoadEmptyInstrument(InstrumentName=instrument, OutputWorkspace=instrument)
@@ -241,87 +533,61 @@ def run_normalization(runs, p, facility, instrument, ipts, detector_calibration,
 
     ExtractMask(InputWorkspace='sa', OutputWorkspace='mask')
 
+    keys = {r: md_cache.key(run_file(r, facility, instrument, ipts), 'Q_sample', False) for r in runs}
+
+    cached = [r for r in runs if slices is None and md_cache.contains(keys[r])]
+
+    prefetcher = RunPrefetcher(lambda r, ws: load_run(r, ws, facility, instrument, ipts, tube_calibration, detector_calibration, elastic, timing_offset),
+                               [r for r in runs if r not in cached], 'data', prefetch_lookahead, prefetch_memory)
+
     for i, r in enumerate(runs):
 
-        fname = '/{}/{}/IPTS-{}/nexus/{}_{}.nxs.h5'.format(facility,instrument,ipts,instrument,r)
-        if not os.path.exists(fname):
-            fname = '/{}/{}/IPTS-{}/shared/data/{}_{}.nxs.h5'.format(facility,instrument,ipts,instrument,r)
+        if r in cached and md_cache.load(keys[r], 'md'):
 
-        LoadEventNexus(Filename=fname,
-                       OutputWorkspace='data')
+            dims = [mtd['md'].getDimension(j) for j in range(3)]
 
-        if elastic:
-            CopyInstrumentParameters(InputWorkspace=instrument, OutputWorkspace='data')
-            CorelliCrossCorrelate(InputWorkspace='data', OutputWorkspace='data', TimingOffset=timing_offset)
-            # LoadNexus(Filename='/{}/{}/IPTS-{}/shared/autoreduce/{}_{}_elastic.nxs'.format(facility,instrument,ipts,instrument,r), 
-            #           OutputWorkspace='data') 
+            min_vals = [dim.getMinimum() for dim in dims]
+            max_vals = [dim.getMaximum() for dim in dims]
 
-        if type(ub_file) is list:
-            ind = [str(r) in ub for ub in ub_file].index(True)
-            LoadIsawUB(InputWorkspace='data', Filename=ub_file[ind])
-        elif type(ub_file) is str:
-            LoadIsawUB(InputWorkspace='data', Filename=ub_file)
-        else:
-            UB = mtd['data'].getExperimentInfo(0).sample().getOrientedLattice().getUB()
-            SetUB(Workspace='data', UB=UB)
-
-        if tube_calibration is not None:
-            ApplyCalibration(Workspace='data', CalibrationTable='tube_table')
-
-        if detector_calibration is not None:
-            _, ext =  os.path.splitext(detector_calibration)
-            if ext == '.xml':
-                LoadParameterFile(Workspace='data', Filename=detector_calibration)
-            else:
-                LoadIsawDetCal(InputWorkspace='data', Filename=detector_calibration)
-
-        MaskDetectors(Workspace='data', MaskedWorkspace='mask')
-
-        if instrument == 'CORELLI':
-            gon_axis = 'BL9:Mot:Sample:Axis3'
-            possible_axes = ['BL9:Mot:Sample:Axis1', 'BL9:Mot:Sample:Axis2', 'BL9:Mot:Sample:Axis3', 
-                             'BL9:Mot:Sample:Axis1.RBV', 'BL9:Mot:Sample:Axis2.RBV', 'BL9:Mot:Sample:Axis3.RBV'] #.RBV
-            for possible_axis in possible_axes:
-                if mtd['data'].run().hasProperty(possible_axis):
-                    angle = np.mean(mtd['data'].run().getProperty(possible_axis).value)
-                    if not np.isclose(angle,0):
-                        gon_axis = possible_axis
-            SetGoniometer(Workspace='data', Axis0='{},0,1,0,1'.format(gon_axis))
         else:
-            SetGoniometer(Workspace='data', Goniometers='Universal')
-            SumNeighbours(InputWorkspace='data', OutputWorkspace='data', SumX=4, SumY=4)
-
-        ConvertUnits(InputWorkspace='data', OutputWorkspace='data', EMode='Elastic', Target='Momentum')
-
-        CropWorkspaceForMDNorm(InputWorkspace='data',
-                               XMin=mtd['flux'].dataX(0).min(),
-                               XMax=mtd['flux'].dataX(0).max(),
-                               OutputWorkspace='data')
-
-        min_vals, max_vals = ConvertToMDMinMaxGlobal(InputWorkspace='data',
-                                                     QDimensions='Q3D',
-                                                     dEAnalysisMode='Elastic',
-                                                     Q3DFrames='Q')
-
-        if not np.isfinite(min_vals).all():
-            min_vals = [-20,-20,-20]
-        if not np.isfinite(max_vals).all():
-            max_vals = [20,20,20]
-
-        ConvertToMD(InputWorkspace='data', 
-                    OutputWorkspace='md', 
-                    QDimensions='Q3D',
-                    dEAnalysisMode='Elastic',
-                    Q3DFrames='Q_sample',
-                    LorentzCorrection=False,
-                    MinValues=min_vals,
-                    MaxValues=max_vals,
-                    Uproj='1,0,0',
-                    Vproj='0,1,0',
-                    Wproj='0,0,1')
-
-        RecalculateTrajectoriesExtents(InputWorkspace='md',
-                                       OutputWorkspace='md')
+
+            prefetcher.load(r)
+
+            ConvertUnits(InputWorkspace='data', OutputWorkspace='data', EMode='Elastic', Target='Momentum')
+
+            CropWorkspaceForMDNorm(InputWorkspace='data',
+                                   XMin=mtd['flux'].dataX(0).min(),
+                                   XMax=mtd['flux'].dataX(0).max(),
+                                   OutputWorkspace='data')
+
+            min_vals, max_vals = ConvertToMDMinMaxGlobal(InputWorkspace='data',
+                                                         QDimensions='Q3D',
+                                                         dEAnalysisMode='Elastic',
+                                                         Q3DFrames='Q')
+
+            if not np.isfinite(min_vals).all():
+                min_vals = [-20,-20,-20]
+            if not np.isfinite(max_vals).all():
+                max_vals = [20,20,20]
+
+            if slices is None:
+
+                ConvertToMD(InputWorkspace='data', 
+                            OutputWorkspace='md', 
+                            QDimensions='Q3D',
+                            dEAnalysisMode='Elastic',
+                            Q3DFrames='Q_sample',
+                            LorentzCorrection=False,
+                            MinValues=min_vals,
+                            MaxValues=max_vals,
+                            Uproj='1,0,0',
+                            Vproj='0,1,0',
+                            Wproj='0,0,1')
+
+                RecalculateTrajectoriesExtents(InputWorkspace='md',
+                                               OutputWorkspace='md')
+
+                md_cache.save('md', keys[r])
 
         if background_file is not None and not mtd.doesExist('bkg'):
             if type(background_file) is list:
@@ -352,7 +618,9 @@ def run_normalization(runs, p, facility, instrument, ipts, detector_calibration,
 
         if calculated_bkg:
 
-            pc = mtd['data'].run().getProperty('gd_prtn_chrg').value
+            run = mtd['data'].run() if mtd.doesExist('data') else mtd['md'].getExperimentInfo(0).run()
+
+            pc = run.getProperty('gd_prtn_chrg').value
 
             CreateSingleValuedWorkspace(DataValue=pc, OutputWorkspace='pc_scale')
 
@@ -364,86 +632,219 @@ def run_normalization(runs, p, facility, instrument, ipts, detector_calibration,
                          LogType='Number',
                          NumberType='Double')
 
-        DeleteWorkspace('data')
-
-        MDNorm(InputWorkspace='md',
-               SolidAngleWorkspace='sa',
-               FluxWorkspace='flux',
-               BackgroundWorkspace='bkg_md' if mtd.doesExist('bkg_md') else None,
-               QDimension0='{},{},{}'.format(*u_proj),
-               QDimension1='{},{},{}'.format(*v_proj),
-               QDimension2='{},{},{}'.format(*w_proj),
-               Dimension0Name='QDimension0',
-               Dimension1Name='QDimension1',
-               Dimension2Name='QDimension2',
-               Dimension0Binning='{},{},{}'.format(*u_binning),
-               Dimension1Binning='{},{},{}'.format(*v_binning),
-               Dimension2Binning='{},{},{}'.format(*w_binning),
-               SymmetryOperations=symmetry,
-               TemporaryDataWorkspace='dataMD' if mtd.doesExist('dataMD') else None,
-               TemporaryNormalizationWorkspace='normMD' if mtd.doesExist('normMD') else None,
-               TemporaryBackgroundDataWorkspace='bkgDataMD' if mtd.doesExist('bkgDataMD') else None,
-               TemporaryBackgroundNormalizationWorkspace='bkgNormMD' if mtd.doesExist('bkgNormMD') else None,
-               OutputWorkspace='normData',
-               OutputDataWorkspace='dataMD',
-               OutputNormalizationWorkspace='normMD',
-               OutputBackgroundDataWorkspace='bkgDataMD' if mtd.doesExist('bkg_md') else None,
-               OutputBackgroundNormalizationWorkspace='bkgNormMD' if mtd.doesExist('bkg_md') else None)
-
-        MDNorm(InputWorkspace='md',
-               SolidAngleWorkspace='sa',
-               FluxWorkspace='flux',
-               BackgroundWorkspace='bkg_md' if mtd.doesExist('bkg_md') else None,
-               QDimension0='{},{},{}'.format(*u_proj),
-               QDimension1='{},{},{}'.format(*v_proj),
-               QDimension2='{},{},{}'.format(*w_proj),
-               Dimension0Name='QDimension0',
-               Dimension1Name='QDimension1',
-               Dimension2Name='QDimension2',
-               Dimension0Binning='{},{},{}'.format(*u_binning),
-               Dimension1Binning='{},{},{}'.format(*v_binning),
-               Dimension2Binning='{},{},{}'.format(*w_binning),
-               SymmetryOperations=None,
-               TemporaryDataWorkspace='dataMD_no_symm' if mtd.doesExist('dataMD_no_symm') else None,
-               TemporaryNormalizationWorkspace='normMD_no_symm' if mtd.doesExist('normMD_no_symm') else None,
-               TemporaryBackgroundDataWorkspace='bkgDataMD_no_symm' if mtd.doesExist('bkgDataMD_no_symm') else None,
-               TemporaryBackgroundNormalizationWorkspace='bkgNormMD_no_symm' if mtd.doesExist('bkgNormMD_no_symm') else None,
-               OutputWorkspace='normData_no_symm',
-               OutputDataWorkspace='dataMD_no_symm',
-               OutputNormalizationWorkspace='normMD_no_symm',
-               OutputBackgroundDataWorkspace='bkgDataMD_no_symm' if mtd.doesExist('bkg_md') else None,
-               OutputBackgroundNormalizationWorkspace='bkgNormMD_no_symm' if mtd.doesExist('bkg_md') else None)
-
-        DeleteWorkspace('md')
+        if slices is not None:
+
+            UB = mtd['data'].sample().getOrientedLattice().getUB()
+
+            for s, (proj, binnings) in enumerate(slices):
+
+                Q_min, Q_max = slice_bounds(UB, proj, binnings, symmetry)
+
+                Q_min, Q_max = np.maximum(Q_min, min_vals), np.minimum(Q_max, max_vals)
+
+                if (Q_min >= Q_max).any():
+                    continue
+
+                ConvertToMD(InputWorkspace='data', 
+                            OutputWorkspace='md', 
+                            QDimensions='Q3D',
+                            dEAnalysisMode='Elastic',
+                            Q3DFrames='Q_sample',
+                            LorentzCorrection=False,
+                            MinValues=Q_min,
+                            MaxValues=Q_max,
+                            Uproj='1,0,0',
+                            Vproj='0,1,0',
+                            Wproj='0,0,1')
+
+                RecalculateTrajectoriesExtents(InputWorkspace='md',
+                                               OutputWorkspace='md')
+
+                for app, symm in apps:
+
+                    tag = '_slice{}{}'.format(s,app)
+
+                    MDNorm(InputWorkspace='md',
+                           SolidAngleWorkspace='sa',
+                           FluxWorkspace='flux',
+                           BackgroundWorkspace='bkg_md' if mtd.doesExist('bkg_md') else None,
+                           QDimension0='{},{},{}'.format(*proj[0]),
+                           QDimension1='{},{},{}'.format(*proj[1]),
+                           QDimension2='{},{},{}'.format(*proj[2]),
+                           Dimension0Name='QDimension0',
+                           Dimension1Name='QDimension1',
+                           Dimension2Name='QDimension2',
+                           Dimension0Binning='{},{},{}'.format(*binnings[0]),
+                           Dimension1Binning='{},{},{}'.format(*binnings[1]),
+                           Dimension2Binning='{},{},{}'.format(*binnings[2]),
+                           SymmetryOperations=symm,
+                           TemporaryDataWorkspace='dataMD'+tag if mtd.doesExist('dataMD'+tag) else None,
+                           TemporaryNormalizationWorkspace='normMD'+tag if mtd.doesExist('normMD'+tag) else None,
+                           TemporaryBackgroundDataWorkspace='bkgDataMD'+tag if mtd.doesExist('bkgDataMD'+tag) else None,
+                           TemporaryBackgroundNormalizationWorkspace='bkgNormMD'+tag if mtd.doesExist('bkgNormMD'+tag) else None,
+                           OutputWorkspace='normData'+tag,
+                           OutputDataWorkspace='dataMD'+tag,
+                           OutputNormalizationWorkspace='normMD'+tag,
+                           OutputBackgroundDataWorkspace='bkgDataMD'+tag if mtd.doesExist('bkg_md') else None,
+                           OutputBackgroundNormalizationWorkspace='bkgNormMD'+tag if mtd.doesExist('bkg_md') else None)
+
+                DeleteWorkspace('md')
+
+        if mtd.doesExist('data'):
+            DeleteWorkspace('data')
+
+        if slices is None and slabs is None:
+
+            if symmetry is not None:
+
+                MDNorm(InputWorkspace='md',
+                       SolidAngleWorkspace='sa',
+                       FluxWorkspace='flux',
+                       BackgroundWorkspace='bkg_md' if mtd.doesExist('bkg_md') else None,
+                       QDimension0='{},{},{}'.format(*u_proj),
+                       QDimension1='{},{},{}'.format(*v_proj),
+                       QDimension2='{},{},{}'.format(*w_proj),
+                       Dimension0Name='QDimension0',
+                       Dimension1Name='QDimension1',
+                       Dimension2Name='QDimension2',
+                       Dimension0Binning='{},{},{}'.format(*u_binning),
+                       Dimension1Binning='{},{},{}'.format(*v_binning),
+                       Dimension2Binning='{},{},{}'.format(*w_binning),
+                       SymmetryOperations=symmetry,
+                       TemporaryDataWorkspace='dataMD' if mtd.doesExist('dataMD') else None,
+                       TemporaryNormalizationWorkspace='normMD' if mtd.doesExist('normMD') else None,
+                       TemporaryBackgroundDataWorkspace='bkgDataMD' if mtd.doesExist('bkgDataMD') else None,
+                       TemporaryBackgroundNormalizationWorkspace='bkgNormMD' if mtd.doesExist('bkgNormMD') else None,
+                       OutputWorkspace='normData',
+                       OutputDataWorkspace='dataMD',
+                       OutputNormalizationWorkspace='normMD',
+                       OutputBackgroundDataWorkspace='bkgDataMD' if mtd.doesExist('bkg_md') else None,
+                       OutputBackgroundNormalizationWorkspace='bkgNormMD' if mtd.doesExist('bkg_md') else None)
+
+            MDNorm(InputWorkspace='md',
+                   SolidAngleWorkspace='sa',
+                   FluxWorkspace='flux',
+                   BackgroundWorkspace='bkg_md' if mtd.doesExist('bkg_md') else None,
+                   QDimension0='{},{},{}'.format(*u_proj),
+                   QDimension1='{},{},{}'.format(*v_proj),
+                   QDimension2='{},{},{}'.format(*w_proj),
+                   Dimension0Name='QDimension0',
+                   Dimension1Name='QDimension1',
+                   Dimension2Name='QDimension2',
+                   Dimension0Binning='{},{},{}'.format(*u_binning),
+                   Dimension1Binning='{},{},{}'.format(*v_binning),
+                   Dimension2Binning='{},{},{}'.format(*w_binning),
+                   SymmetryOperations=None,
+                   TemporaryDataWorkspace='dataMD_no_symm' if mtd.doesExist('dataMD_no_symm') else None,
+                   TemporaryNormalizationWorkspace='normMD_no_symm' if mtd.doesExist('normMD_no_symm') else None,
+                   TemporaryBackgroundDataWorkspace='bkgDataMD_no_symm' if mtd.doesExist('bkgDataMD_no_symm') else None,
+                   TemporaryBackgroundNormalizationWorkspace='bkgNormMD_no_symm' if mtd.doesExist('bkgNormMD_no_symm') else None,
+                   OutputWorkspace='normData_no_symm',
+                   OutputDataWorkspace='dataMD_no_symm',
+                   OutputNormalizationWorkspace='normMD_no_symm',
+                   OutputBackgroundDataWorkspace='bkgDataMD_no_symm' if mtd.doesExist('bkg_md') else None,
+                   OutputBackgroundNormalizationWorkspace='bkgNormMD_no_symm' if mtd.doesExist('bkg_md') else None)
+
+        elif slabs is not None:
+
+            for i0, i1 in slabs:
+
+                slab_binning = [u_binning[0]+u_binning[1]*i0,u_binning[1],u_binning[0]+u_binning[1]*(i1-1e-3)]
+
+                for app, symm in apps:
+
+                    MDNorm(InputWorkspace='md',
+                           SolidAngleWorkspace='sa',
+                           FluxWorkspace='flux',
+                           BackgroundWorkspace='bkg_md' if mtd.doesExist('bkg_md') else None,
+                           QDimension0='{},{},{}'.format(*u_proj),
+                           QDimension1='{},{},{}'.format(*v_proj),
+                           QDimension2='{},{},{}'.format(*w_proj),
+                           Dimension0Name='QDimension0',
+                           Dimension1Name='QDimension1',
+                           Dimension2Name='QDimension2',
+                           Dimension0Binning='{},{},{}'.format(*slab_binning),
+                           Dimension1Binning='{},{},{}'.format(*v_binning),
+                           Dimension2Binning='{},{},{}'.format(*w_binning),
+                           SymmetryOperations=symm,
+                           OutputWorkspace='slabNormData',
+                           OutputDataWorkspace='slabDataMD',
+                           OutputNormalizationWorkspace='slabNormMD',
+                           OutputBackgroundDataWorkspace='slabBkgDataMD' if mtd.doesExist('bkg_md') else None,
+                           OutputBackgroundNormalizationWorkspace='slabBkgNormMD' if mtd.doesExist('bkg_md') else None)
+
+                    save_header('slabDataMD', os.path.join(dbgdir,'template'), p)
+
+                    for ws, name in zip(['slabDataMD', 'slabNormMD', 'slabBkgDataMD', 'slabBkgNormMD'], ['data', 'norm', 'bkg_data', 'bkg_norm']):
+                        if mtd.doesExist(ws):
+                            partials[name+app][:,i0:i1] += np.stack([mtd[ws].getSignalArray(), mtd[ws].getErrorSquaredArray()])
+                            DeleteWorkspace(ws)
+
+                    DeleteWorkspace('slabNormData')
+
+        if mtd.doesExist('md'):
+            DeleteWorkspace('md')
 
         if type(background_file) is list:
             DeleteWorkspace('bkg_md')
 
-    SaveMD(Inputworkspace='dataMD', Filename=os.path.join(dbgdir,'data_{}_p{}.nxs'.format(symmetry.replace('/','_').strip(),p)), SaveHistory=False, SaveInstrument=False, SaveSample=False, SaveLogs=False)
-    SaveMD(Inputworkspace='normMD', Filename=os.path.join(dbgdir,'norm_{}_p{}.nxs'.format(symmetry.replace('/','_').strip(),p)), SaveHistory=False, SaveInstrument=False, SaveSample=False, SaveLogs=False)
+    prefetcher.shutdown()
+
+    if prefetch_lookahead > 0:
+        prefetcher.write_report(os.path.join(dbgdir,'prefetch_p{}.txt'.format(p)))
+
+    if slices is not None:
+
+        for s in range(len(slices)):
+            for app, _ in apps:
+
+                tag = '_slice{}{}'.format(s,app)
+
+                for ws, name in zip(['dataMD', 'normMD', 'bkgDataMD', 'bkgNormMD'], ['data', 'norm', 'bkg_data', 'bkg_norm']):
+                    if mtd.doesExist(ws+tag):
+                        save_partial(ws+tag, os.path.join(dbgdir,name+tag), p)
+                        DeleteWorkspace(ws+tag)
+
+                DeleteWorkspace('normData'+tag)
+
+    elif slabs is None:
+
+        if symmetry is not None:
+
+            save_partial('dataMD', os.path.join(dbgdir,'data_{}'.format(symmetry.replace('/','_').strip())), p)
+            save_partial('normMD', os.path.join(dbgdir,'norm_{}'.format(symmetry.replace('/','_').strip())), p)
 
-    SaveMD(Inputworkspace='dataMD_no_symm', Filename=os.path.join(dbgdir,'data_p{}.nxs'.format(p)), SaveHistory=False, SaveInstrument=False, SaveSample=False, SaveLogs=False)
-    SaveMD(Inputworkspace='normMD_no_symm', Filename=os.path.join(dbgdir,'norm_p{}.nxs'.format(p)), SaveHistory=False, SaveInstrument=False, SaveSample=False, SaveLogs=False)
+            DeleteWorkspace('dataMD')
+            DeleteWorkspace('normMD')
 
-    DeleteWorkspace('dataMD')
-    DeleteWorkspace('normMD')
+        save_partial('dataMD_no_symm', os.path.join(dbgdir,'data'), p)
+        save_partial('normMD_no_symm', os.path.join(dbgdir,'norm'), p)
 
-    DeleteWorkspace('dataMD_no_symm')
-    DeleteWorkspace('normMD_no_symm')
+        DeleteWorkspace('dataMD_no_symm')
+        DeleteWorkspace('normMD_no_symm')
 
-    if mtd.doesExist('bkg_md') or calculated_bkg:
+        if mtd.doesExist('bkg_md') or calculated_bkg:
 
-        SaveMD(Inputworkspace='bkgDataMD', Filename=os.path.join(dbgdir,'bkg_data_{}_p{}.nxs'.format(symmetry.replace('/','_').strip(),p)), SaveHistory=False, SaveInstrument=False, SaveSample=False, SaveLogs=False)
-        SaveMD(Inputworkspace='bkgNormMD', Filename=os.path.join(dbgdir,'bkg_norm_{}_p{}.nxs'.format(symmetry.replace('/','_').strip(),p)), SaveHistory=False, SaveInstrument=False, SaveSample=False, SaveLogs=False)
+            if symmetry is not None:
 
-        SaveMD(Inputworkspace='bkgDataMD_no_symm', Filename=os.path.join(dbgdir,'bkg_data_p{}.nxs'.format(p)), SaveHistory=False, SaveInstrument=False, SaveSample=False, SaveLogs=False)
-        SaveMD(Inputworkspace='bkgNormMD_no_symm', Filename=os.path.join(dbgdir,'bkg_norm_p{}.nxs'.format(p)), SaveHistory=False, SaveInstrument=False, SaveSample=False, SaveLogs=False)
+                save_partial('bkgDataMD', os.path.join(dbgdir,'bkg_data_{}'.format(symmetry.replace('/','_').strip())), p)
+                save_partial('bkgNormMD', os.path.join(dbgdir,'bkg_norm_{}'.format(symmetry.replace('/','_').strip())), p)
 
-        DeleteWorkspace('bkgDataMD')
-        DeleteWorkspace('bkgNormMD')
+                DeleteWorkspace('bkgDataMD')
+                DeleteWorkspace('bkgNormMD')
 
-        DeleteWorkspace('bkgDataMD_no_symm')
-        DeleteWorkspace('bkgNormMD_no_symm')
+            save_partial('bkgDataMD_no_symm', os.path.join(dbgdir,'bkg_data'), p)
+            save_partial('bkgNormMD_no_symm', os.path.join(dbgdir,'bkg_norm'), p)
+
+            DeleteWorkspace('bkgDataMD_no_symm')
+            DeleteWorkspace('bkgNormMD_no_symm')
+
+    else:
+
+        for partial in partials.values():
+            partial.flush()
+
+        del partials
 
     DeleteWorkspace('sa')
     DeleteWorkspace('flux')
@@ -455,53 +856,94 @@ if __name__ == '__main__':
 
     parameters.output_input_file(filename, directory, outname+'_norm')
 
+    slices = None
+
+    if slice_planes is not None:
+        if type(slice_planes[0]) is not list:
+            slice_planes = [slice_planes]
+        slices = []
+        for plane in slice_planes:
+            u, v, w, (offset, thickness) = plane[0:3], plane[3:6], plane[6:9], plane[9:11]
+            slices.append(([u, v, w], [u_binning, v_binning, [offset-thickness/2, thickness, offset+thickness/2]]))
+
+    mapping = None
+
+    if post_symmetrize and slices is None:
+        mapping = symmetry_mapping(symmetry, u_proj, v_proj, w_proj, u_binning, v_binning, w_binning)
+        if mapping is None:
+            print('Grid is not closed under {}, symmetrizing events with MDNorm'.format(symmetry))
+
+    slabs = None
+    template = None
+
+    if memory_cap is not None and slices is None:
+        slabs = histogram_slabs(memory_cap, u_binning, v_binning, w_binning)
+
     args = [facility, instrument, ipts, detector_calibration, tube_calibration, 
             directory, counts_file, spectrum_file, background_file, mask_file,
-            u_proj, v_proj, w_proj, u_binning, v_binning, w_binning, symmetry, elastic, timing_offset]
+            u_proj, v_proj, w_proj, u_binning, v_binning, w_binning, 
+            symmetry if mapping is None else None, elastic, timing_offset, slabs, slices]
 
     split_runs = [split.tolist() for split in np.array_split(run_nos, n_proc)]
 
     join_args = [(split, i, *args) for i, split in enumerate(split_runs)]
 
+    apps = ['', '_'+symmetry.replace('/','_').strip()]
+
+    if slices is None:
+        outputs = [('', [u_proj, v_proj, w_proj])]
+    else:
+        outputs = [('_slice{}'.format(s), proj) for s, (proj, _) in enumerate(slices)]
+
     config['MultiThreaded.MaxCores'] == 1
     os.environ['OPENBLAS_NUM_THREADS'] = '1'
     os.environ['OMP_NUM_THREADS'] = '1'
     os.environ['_SC_NPROCESSORS_ONLN'] = '1'
 
+    names = [name+tag+app for tag, _ in outputs for app in apps for name in ['data', 'norm', 'bkg_data', 'bkg_norm']]+['template']
+
+    for name in names:
+        if os.path.exists(os.path.join(dbgdir,name+'.nxs')):
+            os.remove(os.path.join(dbgdir,name+'.nxs'))
+
     #run_normalization(*join_args[0])
     multiprocessing.set_start_method('spawn', force=True)    
     with multiprocessing.get_context('spawn').Pool(processes=n_proc) as pool:
         pool.starmap(run_normalization, join_args)
+
+        parts = {name: partial_files(os.path.join(dbgdir,name), n_proc) for name in names}
+        parts = {name: files for name, files in parts.items() if len(files) > 0}
+
+        while np.any([len(files) > 1 for files in parts.values()]):
+            pairs = [(files[i], files[i+1]) for files in parts.values() for i in range(0,len(files)-1,2)]
+            pool.starmap(add_partials, pairs)
+            parts = {name: files[::2] for name, files in parts.items()}
+
         pool.close()
         pool.join()
 
+    md_cache.prune(cache_limit)
+
+    if slabs is not None:
+        template = 'template'
+        create_histogram(template, os.path.join(dbgdir,'template.nxs'), u_proj, v_proj, w_proj, u_binning, v_binning, w_binning)
+        os.remove(os.path.join(dbgdir,'template.nxs'))
+
     config['MultiThreaded.MaxCores'] == 4
     os.environ.pop('OPENBLAS_NUM_THREADS', None)
     os.environ.pop('OMP_NUM_THREADS', None)
     os.environ.pop('_SC_NPROCESSORS_ONLN', None)
 
-    for app in ['', '_'+symmetry.replace('/','_').strip()]:
-
-        for p in range(n_proc):
-            LoadMD(OutputWorkspace='tmpDataMD', Filename=os.path.join(dbgdir,'data{}_p{}.nxs'.format(app,p)), LoadHistory=False)
-            LoadMD(OutputWorkspace='tmpNormMD', Filename=os.path.join(dbgdir,'norm{}_p{}.nxs'.format(app,p)), LoadHistory=False)
-
-            if os.path.exists(os.path.join(dbgdir,'bkg_data{}_p{}.nxs'.format(app,p))):
-                LoadMD(OutputWorkspace='tmpBkgDataMD', Filename=os.path.join(dbgdir,'bkg_data{}_p{}.nxs'.format(app,p)), LoadHistory=False)
-                LoadMD(OutputWorkspace='tmpBkgNormMD', Filename=os.path.join(dbgdir,'bkg_norm{}_p{}.nxs'.format(app,p)), LoadHistory=False)
-
-            if p == 0:
-                CloneMDWorkspace(InputWorkspace='tmpDataMD', OutputWorkspace='dataMD')
-                CloneMDWorkspace(InputWorkspace='tmpNormMD', OutputWorkspace='normMD')
-                if mtd.doesExist('tmpBkgDataMD'):
-                    CloneMDWorkspace(InputWorkspace='tmpBkgDataMD', OutputWorkspace='bkgDataMD')
-                    CloneMDWorkspace(InputWorkspace='tmpBkgNormMD', OutputWorkspace='bkgNormMD')    
-            else:
-                PlusMD(LHSWorkspace='dataMD', RHSWorkspace='tmpDataMD', OutputWorkspace='dataMD')
-                PlusMD(LHSWorkspace='normMD', RHSWorkspace='tmpNormMD', OutputWorkspace='normMD')
-                if mtd.doesExist('tmpBkgDataMD'):
-                    PlusMD(LHSWorkspace='bkgDataMD', RHSWorkspace='tmpBkgDataMD', OutputWorkspace='bkgDataMD')
-                    PlusMD(LHSWorkspace='bkgNormMD', RHSWorkspace='tmpBkgNormMD', OutputWorkspace='bkgNormMD')
+    for (tag, proj), app in [(output, app) for output in outputs for app in apps]:
+
+        if mapping is not None and app != '':
+            for ws in ['dataMD', 'normMD', 'bkgDataMD', 'bkgNormMD']:
+                if mtd.doesExist(ws):
+                    symmetrize_histogram(ws, mapping)
+        else:
+            for ws, name in zip(['dataMD', 'normMD', 'bkgDataMD', 'bkgNormMD'], ['data', 'norm', 'bkg_data', 'bkg_norm']):
+                if parts.get(name+tag+app) is not None:
+                    load_partial(ws, os.path.join(dbgdir,name+tag+app), parts[name+tag+app][0], template)
 
         DivideMD(LHSWorkspace='dataMD', RHSWorkspace='normMD', OutputWorkspace='normData')
         if mtd.doesExist('bkgDataMD'):
@@ -510,7 +952,7 @@ if __name__ == '__main__':
 
         CreateSingleValuedWorkspace(OutputWorkspace='ws')
 
-        W = np.array([u_proj,v_proj,w_proj]).T
+        W = np.array(proj).T
 
         W_MATRIX = '{},{},{},{},{},{},{},{},{}'.format(*W.flatten())
 
@@ -531,29 +973,35 @@ if __name__ == '__main__':
                            CopyLattice=True,
                            CopyOrientationOnly=False)
 
-        SaveMD(Inputworkspace='normData', Filename=os.path.join(outdir,outname+app+'.nxs'), SaveHistory=False, SaveInstrument=True, SaveSample=True, SaveLogs=True)
+        SaveMD(Inputworkspace='normData', Filename=os.path.join(outdir,outname+tag+app+'.nxs'), SaveHistory=False, SaveInstrument=True, SaveSample=True, SaveLogs=True)
 
-        SaveMD(Inputworkspace='dataMD', Filename=os.path.join(outdir,outname+app+'_data.nxs'), SaveHistory=False, SaveInstrument=True, SaveSample=True, SaveLogs=True)
-        SaveMD(Inputworkspace='normMD', Filename=os.path.join(outdir,outname+app+'_norm.nxs'), SaveHistory=False, SaveInstrument=True, SaveSample=True, SaveLogs=True)
+        SaveMD(Inputworkspace='dataMD', Filename=os.path.join(outdir,outname+tag+app+'_data.nxs'), SaveHistory=False, SaveInstrument=True, SaveSample=True, SaveLogs=True)
+        SaveMD(Inputworkspace='normMD', Filename=os.path.join(outdir,outname+tag+app+'_norm.nxs'), SaveHistory=False, SaveInstrument=True, SaveSample=True, SaveLogs=True)
         if mtd.doesExist('bkgNormData'):
-            SaveMD(Inputworkspace='bkgDataMD', Filename=os.path.join(outdir,outname+app+'_bkg_data.nxs'), SaveHistory=False, SaveInstrument=True, SaveSample=True, SaveLogs=True)
-            SaveMD(Inputworkspace='bkgNormMD', Filename=os.path.join(outdir,outname+app+'_bkg_norm.nxs'), SaveHistory=False, SaveInstrument=True, SaveSample=True, SaveLogs=True)
-            SaveMD(Inputworkspace='bkgNormData', Filename=os.path.join(outdir,outname+app+'_bkg.nxs'), SaveHistory=False, SaveInstrument=True, SaveSample=True, SaveLogs=True)
-            SaveMD(Inputworkspace='normDataSub', Filename=os.path.join(outdir,outname+app+'_sub_bkg.nxs'), SaveHistory=False, SaveInstrument=True, SaveSample=True, SaveLogs=True)
-
-        for p in range(n_proc):
-            partfile = os.path.join(dbgdir,'data{}_p{}.nxs'.format(app,p))
-            if os.path.exists(partfile):
-                os.remove(partfile)
-            partfile = os.path.join(dbgdir,'norm{}_p{}.nxs'.format(app,p))
-            if os.path.exists(partfile):
-                os.remove(partfile)
-            partfile = os.path.join(dbgdir,'bkg_data{}_p{}.nxs'.format(app,p))
-            if os.path.exists(partfile):
-                os.remove(partfile)
-            partfile = os.path.join(dbgdir,'bkg_norm{}_p{}.nxs'.format(app,p))
-            if os.path.exists(partfile):
-                os.remove(partfile)
+            SaveMD(Inputworkspace='bkgDataMD', Filename=os.path.join(outdir,outname+tag+app+'_bkg_data.nxs'), SaveHistory=False, SaveInstrument=True, SaveSample=True, SaveLogs=True)
+            SaveMD(Inputworkspace='bkgNormMD', Filename=os.path.join(outdir,outname+tag+app+'_bkg_norm.nxs'), SaveHistory=False, SaveInstrument=True, SaveSample=True, SaveLogs=True)
+            SaveMD(Inputworkspace='bkgNormData', Filename=os.path.join(outdir,outname+tag+app+'_bkg.nxs'), SaveHistory=False, SaveInstrument=True, SaveSample=True, SaveLogs=True)
+            SaveMD(Inputworkspace='normDataSub', Filename=os.path.join(outdir,outname+tag+app+'_sub_bkg.nxs'), SaveHistory=False, SaveInstrument=True, SaveSample=True, SaveLogs=True)
+
+        pyramid_dir = os.path.join(outdir,outname+tag+app+'_pyramid')
+
+        if pyramid_levels is not None:
+
+            arrays = {}
+            for ws, name in zip(['dataMD', 'normMD', 'bkgDataMD', 'bkgNormMD'], ['data', 'norm', 'bkg_data', 'bkg_norm']):
+                if mtd.doesExist(ws):
+                    arrays[name] = mtd[ws].getSignalArray().copy()
+
+            dims = [mtd['dataMD'].getDimension(i) for i in range(mtd['dataMD'].getNumDims())]
+
+            extents = [limit for dim in dims for limit in [dim.getMinimum(), dim.getMaximum()]]
+
+            pyramid.write_pyramid(pyramid_dir, arrays, extents, pyramid_levels)
+
+        for name in ['data', 'norm', 'bkg_data', 'bkg_norm']:
+            for partfile in [os.path.join(dbgdir,name+tag+app+'.nxs')]+parts.get(name+tag+app, []):
+                if os.path.exists(partfile):
+                    os.remove(partfile)
 
         data = mtd['normData']
 
@@ -564,7 +1012,7 @@ if __name__ == '__main__':
             if app == '':
                 app += '_no_symm'
 
-            with PdfPages(os.path.join(outdir,outname+app+'.pdf')) as pdf:
+            with PdfPages(os.path.join(outdir,outname+tag+app+'.pdf')) as pdf:
 
                 ol = mtd['ws'].sample().getOrientedLattice()
 
@@ -575,20 +1023,37 @@ if __name__ == '__main__':
 
                 labels = [dim.getName().replace(',',' ').replace('[','(').replace(']',')').lower() for dim in dims]
 
-                proj = [u_proj,v_proj,w_proj]
-
                 for i in range(n):
 
-                    hslice = IntegrateMDHistoWorkspace(InputWorkspace='normData',
-                                                       P1Bin=[-0.0001,0.0001] if i == 0 else None, 
-                                                       P2Bin=[-0.0001,0.0001] if i == 1 else None, 
-                                                       P3Bin=[-0.0001,0.0001] if i == 2 else None)
+                    j, k = np.sort([(i+1) % n, (i+2) % n])
 
-                    signal = hslice.getSignalArray().copy().squeeze(axis=i)
+                    if dims[j].getNBins() == 1 or dims[k].getNBins() == 1:
+                        continue
 
-                    signal[signal <= 0] = np.nan
+                    value = 0 if dims[i].getNBins() > 1 else (dmin[i]+dmax[i])/2
 
-                    j, k = np.sort([(i+1) % n, (i+2) % n])
+                    if pyramid_levels is not None:
+
+                        ind = pyramid.level_index(pyramid_dir, 0, i, value)
+
+                        bounds = [(ind, ind+1) if axis == i else None for axis in range(n)]
+
+                        signal = pyramid.read_pyramid(pyramid_dir, 0, bounds).squeeze(axis=i)
+
+                    elif dims[i].getNBins() == 1:
+
+                        signal = data.getSignalArray().copy().squeeze(axis=i)
+
+                    else:
+
+                        hslice = IntegrateMDHistoWorkspace(InputWorkspace='normData',
+                                                           P1Bin=[-0.0001,0.0001] if i == 0 else None, 
+                                                           P2Bin=[-0.0001,0.0001] if i == 1 else None, 
+                                                           P3Bin=[-0.0001,0.0001] if i == 2 else None)
+
+                        signal = hslice.getSignalArray().copy().squeeze(axis=i)
+
+                    signal[signal <= 0] = np.nan
 
                     angle = ol.recAngle(*proj[j],*proj[k])
 
@@ -601,7 +1066,7 @@ if __name__ == '__main__':
                     im = ax.imshow(signal.T, extent=[dmin[j],dmax[j],dmin[k],dmax[k]], origin='lower', interpolation='nearest', vmin=vmin, vmax=vmax, rasterized=True)
                     ax.set_xlabel(labels[j])
                     ax.set_ylabel(labels[k])
-                    ax.set_title(labels[i]+' = 0')
+                    ax.set_title('{} = {:g}'.format(labels[i],value))
                     ax.minorticks_on()
 
                     ax.grid(which='both', alpha=0.5, transform=transform)
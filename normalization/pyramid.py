@@ -0,0 +1,109 @@
+import os
+import json
+
+import numpy as np
+
+def pad(array, size):
+
+    shape = [int(np.ceil(n/size))*size for n in array.shape]
+
+    padded = np.zeros(shape, dtype=array.dtype)
+    padded[tuple([slice(0,n) for n in array.shape])] = array
+
+    return padded
+
+def downsample(array, factor=2):
+
+    padded = pad(array, factor)
+
+    nu, nv, nw = [n//factor for n in padded.shape]
+
+    return padded.reshape(nu,factor,nv,factor,nw,factor).sum(axis=(1,3,5))
+
+def chunk(array, size):
+
+    padded = pad(array, size)
+
+    nu, nv, nw = [n//size for n in padded.shape]
+
+    return padded.reshape(nu,size,nv,size,nw,size).transpose(0,2,4,1,3,5)
+
+def write_pyramid(dirname, arrays, extents, levels=3, chunk_size=32):
+
+    if not os.path.exists(dirname):
+        os.mkdir(dirname)
+
+    shapes = []
+
+    for level in range(levels+1):
+
+        if level > 0:
+            arrays = {name: downsample(array) for name, array in arrays.items()}
+
+        for name, array in arrays.items():
+            np.save(os.path.join(dirname,'{}_{}.npy'.format(name,level)), chunk(array, chunk_size))
+
+        shapes.append(list(array.shape))
+
+    metadata = {'extents': extents, 'shapes': shapes, 'chunk-size': chunk_size, 'names': list(arrays.keys())}
+
+    with open(os.path.join(dirname,'pyramid.json'), 'w') as f:
+        json.dump(metadata, f)
+
+def load_metadata(dirname):
+
+    with open(os.path.join(dirname,'pyramid.json'), 'r') as f:
+        metadata = json.load(f)
+
+    return metadata
+
+def read_chunks(dirname, name, level, bounds, metadata):
+
+    size = metadata['chunk-size']
+
+    chunks = np.load(os.path.join(dirname,'{}_{}.npy'.format(name,level)), mmap_mode='r')
+
+    c0 = [start//size for start, stop in bounds]
+    c1 = [(stop-1)//size+1 for start, stop in bounds]
+
+    block = chunks[c0[0]:c1[0],c0[1]:c1[1],c0[2]:c1[2]]
+
+    nu, nv, nw = block.shape[0:3]
+
+    block = np.array(block).transpose(0,3,1,4,2,5).reshape(nu*size,nv*size,nw*size)
+
+    return block[tuple([slice(start-c*size,stop-c*size) for (start, stop), c in zip(bounds, c0)])]
+
+def read_pyramid(dirname, level=0, bounds=None, names=('data', 'norm')):
+
+    metadata = load_metadata(dirname)
+
+    shape = metadata['shapes'][level]
+
+    if bounds is None:
+        bounds = [None, None, None]
+
+    bounds = [(0, n) if bound is None else bound for bound, n in zip(bounds, shape)]
+
+    data = read_chunks(dirname, names[0], level, bounds, metadata)
+    norm = read_chunks(dirname, names[1], level, bounds, metadata)
+
+    signal = np.full(data.shape, np.nan)
+    mask = norm > 0
+    signal[mask] = data[mask]/norm[mask]
+
+    return signal
+
+def level_index(dirname, level, axis, value):
+
+    metadata = load_metadata(dirname)
+
+    lo, hi = metadata['extents'][2*axis:2*axis+2]
+
+    n = metadata['shapes'][0][axis]
+
+    step = (hi-lo)/n*2**level
+
+    ind = int(np.floor((value-lo)/step))
+
+    return min(max(ind, 0), metadata['shapes'][level][axis]-1)
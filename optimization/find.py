@@ -26,8 +26,12 @@ sys.path.append(directory)
 
 import imp
 import parameters
+import cache
 
 imp.reload(parameters)
+imp.reload(cache)
+
+from cache import WorkspaceCache
 
 dictionary = parameters.load_input_file(filename)
 
@@ -170,6 +174,11 @@ if cross_terms is None:
 
 gon_axis = 'BL9:Mot:Sample:Axis3.RBV'
 
+cache_directory = dictionary.get('cache-directory')
+cache_limit = dictionary.get('cache-limit')
+
+md_cache = WorkspaceCache(cache_directory, instrument, tube_calibration, detector_calibration, gon_axis, 'FilterByTimeStop=60')
+
 if tube_calibration is not None and not mtd.doesExist('tube_table'):
     LoadNexus(Filename=tube_calibration, OutputWorkspace='tube_table')
 
@@ -222,21 +231,29 @@ for r in runs:
     min_vals = [-20,-20,-20]
     max_vals = [20,20,20]
 
-    ConvertToMD(InputWorkspace='data_{}'.format(r), 
-                OutputWorkspace='md_{}'.format(r), 
-                QDimensions='Q3D',
-                dEAnalysisMode='Elastic',
-                Q3DFrames='Q_sample',
-                LorentzCorrection=True,
-                MinValues=min_vals,
-                MaxValues=max_vals,
-                Uproj='1,0,0',
-                Vproj='0,1,0',
-                Wproj='0,0,1')
+    key = md_cache.key('/{}/{}/IPTS-{}/nexus/{}_{}.nxs.h5'.format(facility,instrument,ipts,instrument,r), 'Q_sample', True, min_vals, max_vals)
+
+    if not md_cache.load(key, 'md_{}'.format(r)):
+
+        ConvertToMD(InputWorkspace='data_{}'.format(r), 
+                    OutputWorkspace='md_{}'.format(r), 
+                    QDimensions='Q3D',
+                    dEAnalysisMode='Elastic',
+                    Q3DFrames='Q_sample',
+                    LorentzCorrection=True,
+                    MinValues=min_vals,
+                    MaxValues=max_vals,
+                    Uproj='1,0,0',
+                    Vproj='0,1,0',
+                    Wproj='0,0,1')
+
+        md_cache.save('md_{}'.format(r), key)
 
     data_to_merge.append('data_{}'.format(r))
     md_to_merge.append('md_{}'.format(r))
 
+md_cache.prune(cache_limit)
+
 data = GroupWorkspaces(data_to_merge)
 
 md = MergeMD(md_to_merge)
@@ -31,8 +31,15 @@ sys.path.append(directory)
 
 import imp
 import parameters
+import prefetch
+import cache
 
 imp.reload(parameters)
+imp.reload(prefetch)
+imp.reload(cache)
+
+from prefetch import RunPrefetcher
+from cache import WorkspaceCache
 
 dictionary = parameters.load_input_file(filename)
 
@@ -172,6 +179,44 @@ else:
 
 gon_axis = 'BL9:Mot:Sample:Axis3.RBV'
 
+prefetch_lookahead = dictionary.get('prefetch-lookahead')
+if prefetch_lookahead is None:
+    prefetch_lookahead = 0
+
+prefetch_memory = dictionary.get('prefetch-memory')
+if prefetch_memory is None:
+    prefetch_memory = 70
+
+cache_directory = dictionary.get('cache-directory')
+cache_limit = dictionary.get('cache-limit')
+
+md_cache = WorkspaceCache(cache_directory, instrument, tube_calibration, detector_calibration, gon_axis, 'NormaliseByCurrent')
+
+def load_run(r, ws, facility, instrument, ipts, tube_calibration, detector_calibration, gon_axis):
+
+    LoadEventNexus(Filename='/{}/{}/IPTS-{}/nexus/{}_{}.nxs.h5'.format(facility,instrument,ipts,instrument,r), 
+                   OutputWorkspace=ws)
+
+    NormaliseByCurrent(InputWorkspace=ws, 
+                       OutputWorkspace=ws,
+                       RecalculatePCharge=True)
+
+    if tube_calibration is not None:
+        ApplyCalibration(Workspace=ws, CalibrationTable='tube_table')
+
+    if detector_calibration is not None:
+        if os.path.splitext(detector_calibration)[-1] == '.xml':
+            LoadParameterFile(Workspace=ws, Filename=detector_calibration)
+        else:
+            LoadIsawDetCal(InputWorkspace=ws, Filename=detector_calibration)
+
+    if instrument == 'CORELLI':
+        SetGoniometer(Workspace=ws, Axis0=str(gon_axis)+',0,1,0,1') 
+    elif instrument == 'SNAP':
+        SetGoniometer(Workspace=ws, Axis0='omega,0,1,0,1') 
+    else:
+        SetGoniometer(Workspace=ws, Goniometers='Universal') 
+
 def run_optimization(runs, p, facility, instrument, ipts, detector_calibration, tube_calibration, gon_axis, directory,
                      ub_file, a, b, c, alpha, beta, gamma, force_constants, cell_type, select_cell_type, centering, reflection_condition,
                      mod_vector_1, mod_vector_2, mod_vector_3, max_order, cross_terms):
@@ -197,56 +242,42 @@ def run_optimization(runs, p, facility, instrument, ipts, detector_calibration,
     if np.array([a,b,c,alpha,beta,gamma]).all():
         max_d = np.max([a,b,c])
 
-    for r in runs:
+    prefetcher = RunPrefetcher(lambda r, ws: load_run(r, ws, facility, instrument, ipts, tube_calibration, detector_calibration, gon_axis),
+                               runs, 'data', prefetch_lookahead, prefetch_memory)
 
-        LoadEventNexus(Filename='/{}/{}/IPTS-{}/nexus/{}_{}.nxs.h5'.format(facility,instrument,ipts,instrument,r), 
-                       OutputWorkspace='data')
+    for r in prefetcher:
 
-        NormaliseByCurrent(InputWorkspace='data', 
-                           OutputWorkspace='data',
-                           RecalculatePCharge=True)
+        key = md_cache.key('/{}/{}/IPTS-{}/nexus/{}_{}.nxs.h5'.format(facility,instrument,ipts,instrument,r), 'Q_sample', True)
 
-        if tube_calibration is not None:
-            ApplyCalibration(Workspace='data', CalibrationTable='tube_table')
+        if not md_cache.load(key, 'md'):
 
-        if detector_calibration is not None:
-            if os.path.splitext(detector_calibration)[-1] == '.xml':
-                LoadParameterFile(Workspace='data', Filename=detector_calibration)
-            else:
-                LoadIsawDetCal(InputWorkspace='data', Filename=detector_calibration)
+            min_vals, max_vals = ConvertToMDMinMaxLocal(InputWorkspace='data',
+                                                        QDimensions='Q3D',
+                                                        dEAnalysisMode='Elastic',
+                                                        Q3DFrames='Q_sample',
+                                                        LorentzCorrection=True,
+                                                        Uproj='1,0,0',
+                                                        Vproj='0,1,0',
+                                                        Wproj='0,0,1')
 
-        if instrument == 'CORELLI':
-            SetGoniometer(Workspace='data', Axis0=str(gon_axis)+',0,1,0,1') 
-        elif instrument == 'SNAP':
-            SetGoniometer(Workspace='data', Axis0='omega,0,1,0,1') 
-        else:
-            SetGoniometer(Workspace='data', Goniometers='Universal') 
-
-        min_vals, max_vals = ConvertToMDMinMaxLocal(InputWorkspace='data',
-                                                    QDimensions='Q3D',
-                                                    dEAnalysisMode='Elastic',
-                                                    Q3DFrames='Q_sample',
-                                                    LorentzCorrection=True,
-                                                    Uproj='1,0,0',
-                                                    Vproj='0,1,0',
-                                                    Wproj='0,0,1')
-
-        if not np.isfinite(min_vals).all():
-            min_vals = [-20,-20,-20]
-        if not np.isfinite(max_vals).all():
-            max_vals = [20,20,20]
-
-        ConvertToMD(InputWorkspace='data', 
-                    OutputWorkspace='md', 
-                    QDimensions='Q3D',
-                    dEAnalysisMode='Elastic',
-                    Q3DFrames='Q_sample',
-                    LorentzCorrection=True,
-                    MinValues=min_vals,
-                    MaxValues=max_vals,
-                    Uproj='1,0,0',
-                    Vproj='0,1,0',
-                    Wproj='0,0,1')
+            if not np.isfinite(min_vals).all():
+                min_vals = [-20,-20,-20]
+            if not np.isfinite(max_vals).all():
+                max_vals = [20,20,20]
+
+            ConvertToMD(InputWorkspace='data', 
+                        OutputWorkspace='md', 
+                        QDimensions='Q3D',
+                        dEAnalysisMode='Elastic',
+                        Q3DFrames='Q_sample',
+                        LorentzCorrection=True,
+                        MinValues=min_vals,
+                        MaxValues=max_vals,
+                        Uproj='1,0,0',
+                        Vproj='0,1,0',
+                        Wproj='0,0,1')
+
+            md_cache.save('md', key)
 
         if not mtd.doesExist('peaks'):
 
@@ -609,6 +640,8 @@ if __name__ == '__main__':
             pool.close()
             pool.join()
 
+        md_cache.prune(cache_limit)
+
         # run_optimization(*join_args[0])
 
         config['MultiThreaded.MaxCores'] == 4
@@ -0,0 +1,104 @@
+from mantid.simpleapi import SaveMD, LoadMD
+
+import os
+import json
+import hashlib
+
+def file_key(filename):
+
+    if filename is None or not os.path.isfile(filename):
+        return filename
+
+    stat = os.stat(filename)
+
+    return [os.path.abspath(filename), stat.st_size, stat.st_mtime_ns]
+
+def identity(item):
+
+    if type(item) is str:
+        return file_key(item)
+    elif type(item) is list or type(item) is tuple:
+        return [identity(value) for value in item]
+    elif type(item) is dict:
+        return {str(key): identity(value) for key, value in item.items()}
+    elif hasattr(item, 'tolist'):
+        return item.tolist()
+    else:
+        return item
+
+class WorkspaceCache:
+
+    def __init__(self, directory, *context):
+
+        self.directory = directory
+
+        self.context = identity(context)
+
+        self.hits = 0
+        self.misses = 0
+
+        if directory is not None and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, filename, *items):
+
+        items = [file_key(filename), self.context, identity(items)]
+
+        return hashlib.sha1(json.dumps(items, default=str).encode()).hexdigest()
+
+    def filename(self, key):
+
+        return os.path.join(self.directory, key+'.nxs')
+
+    def contains(self, key):
+
+        return self.directory is not None and os.path.exists(self.filename(key))
+
+    def load(self, key, ws):
+
+        if self.directory is None:
+            return False
+
+        if not self.contains(key):
+            self.misses += 1
+            return False
+
+        try:
+            LoadMD(Filename=self.filename(key), OutputWorkspace=ws, FileBackEnd=False, LoadHistory=False)
+        except Exception as e:
+            print('Cached workspace {} could not be loaded: {}'.format(key,e))
+            os.remove(self.filename(key))
+            self.misses += 1
+            return False
+
+        os.utime(self.filename(key))
+
+        self.hits += 1
+
+        return True
+
+    def save(self, ws, key):
+
+        if self.directory is None or self.contains(key):
+            return
+
+        tmp = os.path.join(self.directory, '{}_{}.nxs'.format(key,os.getpid()))
+
+        SaveMD(InputWorkspace=ws, Filename=tmp, SaveHistory=False)
+
+        os.replace(tmp, self.filename(key))
+
+    def prune(self, limit):
+
+        if self.directory is None or limit is None:
+            return
+
+        files = [os.path.join(self.directory, f) for f in os.listdir(self.directory) if f.endswith('.nxs') and len(f) == 44]
+        files.sort(key=os.path.getmtime)
+
+        size = sum([os.path.getsize(f) for f in files])
+
+        while size > limit*1e9 and len(files) > 0:
+            f = files.pop(0)
+            size -= os.path.getsize(f)
+            os.remove(f)
@@ -0,0 +1,156 @@
+import os
+import json
+
+import numpy as np
+
+import h5py
+
+from cache import file_key
+
+indices = {}
+
+def dataset_entry(dataset):
+
+    return {'path': dataset.name,
+            'dtype': dataset.dtype.str,
+            'length': int(dataset.shape[0]),
+            'offset': dataset.id.get_offset()}
+
+def build_index(filename):
+
+    banks = {}
+
+    with h5py.File(filename, 'r') as f:
+
+        entry = f['entry']
+
+        for name in entry.keys():
+
+            if not name.startswith('bank') or not name.endswith('_events'):
+                continue
+
+            group = entry[name]
+
+            if 'event_id' not in group.keys():
+                continue
+
+            bank = int(name[4:-7])
+
+            event_id = group['event_id']
+            event_time_offset = group['event_time_offset']
+            event_time_zero = group['event_time_zero']
+            event_index = group['event_index']
+
+            n_events = event_id.shape[0]
+            n_pulses = event_time_zero.shape[0]
+
+            tof = [float(np.min(event_time_offset[:])), float(np.max(event_time_offset[:]))] if n_events > 0 else None
+            pulse = [float(event_time_zero[0]), float(event_time_zero[-1])] if n_pulses > 0 else None
+
+            ids = event_id[:] if n_events > 0 else None
+
+            start = event_time_zero.attrs.get('offset')
+            if type(start) is bytes:
+                start = start.decode()
+
+            banks[bank] = {'events': int(n_events),
+                           'pulses': int(n_pulses),
+                           'tof': tof,
+                           'pulse': pulse,
+                           'start': str(start) if start is not None else None,
+                           'ids': [int(np.min(ids)), int(np.max(ids))] if ids is not None else None,
+                           'event_id': dataset_entry(event_id),
+                           'event_time_offset': dataset_entry(event_time_offset),
+                           'event_time_zero': dataset_entry(event_time_zero),
+                           'event_index': dataset_entry(event_index)}
+
+    return {'file': file_key(filename), 'banks': banks}
+
+def read_dataset(filename, f, entry):
+
+    if entry['offset'] is not None:
+        return np.array(np.memmap(filename, dtype=entry['dtype'], mode='r', offset=entry['offset'], shape=(entry['length'],)))
+
+    return f[entry['path']][:]
+
+class EventIndex:
+
+    def __init__(self, directory=None):
+
+        self.directory = directory
+
+        if directory is not None and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+
+    def filename(self, filename):
+
+        return os.path.join(self.directory, os.path.basename(filename).replace('.nxs.h5', '')+'_events.json')
+
+    def get(self, filename):
+
+        index = indices.get(filename)
+
+        if index is not None and index['file'] == file_key(filename):
+            return index
+
+        if self.directory is not None and os.path.exists(self.filename(filename)):
+
+            with open(self.filename(filename), 'r') as f:
+                index = json.load(f)
+
+            index['banks'] = {int(bank): value for bank, value in index['banks'].items()}
+
+            if index['file'] != file_key(filename):
+                index = None
+
+        if index is None:
+
+            index = build_index(filename)
+
+            if self.directory is not None:
+                tmp = self.filename(filename)+'.{}'.format(os.getpid())
+                with open(tmp, 'w') as f:
+                    json.dump(index, f)
+                os.replace(tmp, self.filename(filename))
+
+        indices[filename] = index
+
+        return index
+
+    def banks(self, filename, banks=None):
+
+        index = self.get(filename)
+
+        if banks is None:
+            banks = sorted(index['banks'].keys())
+
+        return [bank for bank in banks if index['banks'].get(bank) is not None and index['banks'][bank]['events'] > 0]
+
+    def bank_names(self, filename, banks=None):
+
+        return ','.join(['bank{}'.format(bank) for bank in self.banks(filename, banks)])
+
+    def load_events(self, filename, banks):
+
+        index = self.get(filename)
+
+        events = {}
+
+        with h5py.File(filename, 'r') as f:
+
+            for bank in self.banks(filename, banks):
+
+                entry = index['banks'][bank]
+
+                event_id = read_dataset(filename, f, entry['event_id'])
+                tof = read_dataset(filename, f, entry['event_time_offset'])
+                pulse_time = read_dataset(filename, f, entry['event_time_zero'])
+                event_index = read_dataset(filename, f, entry['event_index'])
+
+                counts = np.diff(np.append(event_index, entry['events']).astype(np.int64))
+
+                events[bank] = {'event_id': event_id,
+                                'tof': tof,
+                                'pulse_time': np.repeat(pulse_time, counts)}
+
+        return events
@@ -0,0 +1,126 @@
+from mantid.simpleapi import RenameWorkspace, DeleteWorkspace, mtd
+
+import time
+import psutil
+
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+class RunPrefetcher:
+
+    def __init__(self, load, runs, workspace, lookahead=1, memory_limit=70):
+
+        self.runs = list(runs)
+
+        self.lookahead = lookahead if lookahead is not None else 0
+        self.memory_limit = memory_limit if memory_limit is not None else 70
+
+        self.__load = load
+        self.__workspace = workspace
+
+        self.__executor = ThreadPoolExecutor(max_workers=1) if self.lookahead > 0 else None
+        self.__futures = {}
+
+        self.__index = 0
+
+        self.prefetch_time = 0
+        self.wait_time = 0
+        self.load_time = 0
+
+        self.n_prefetched = 0
+        self.n_skipped = 0
+
+    def workspace(self, run):
+
+        return self.__workspace(run) if callable(self.__workspace) else self.__workspace
+
+    def __prefetch_workspace(self, i):
+
+        return '__prefetch_{}_{}'.format(self.workspace(self.runs[i]),i)
+
+    def __timed_load(self, run, ws):
+
+        start = time.time()
+        self.__load(run, ws)
+        return time.time()-start
+
+    def __prefetch(self, i):
+
+        if self.__executor is None or i >= len(self.runs) or self.__futures.get(i) is not None:
+            return
+
+        if psutil.virtual_memory().percent > self.memory_limit:
+            self.n_skipped += 1
+            return
+
+        self.__futures[i] = self.__executor.submit(self.__timed_load, self.runs[i], self.__prefetch_workspace(i))
+
+    def load(self, run):
+
+        i = self.__index
+
+        future = None
+
+        if i < len(self.runs) and self.runs[i] == run:
+            self.__index += 1
+            future = self.__futures.pop(i, None)
+            for j in range(i+1, i+1+self.lookahead):
+                self.__prefetch(j)
+
+        ws = self.workspace(run)
+
+        if future is not None:
+            start = time.time()
+            try:
+                self.prefetch_time += future.result()
+                RenameWorkspace(InputWorkspace=self.__prefetch_workspace(i), OutputWorkspace=ws)
+                self.n_prefetched += 1
+                self.wait_time += time.time()-start
+                return
+            except Exception as e:
+                print('Prefetch of run {} failed: {}'.format(run,e))
+                if mtd.doesExist(self.__prefetch_workspace(i)):
+                    DeleteWorkspace(self.__prefetch_workspace(i))
+            self.wait_time += time.time()-start
+
+        start = time.time()
+        self.__load(run, ws)
+        self.load_time += time.time()-start
+
+    def __iter__(self):
+
+        try:
+            for run in self.runs:
+                self.load(run)
+                yield run
+        finally:
+            self.shutdown()
+
+    def hidden_time(self):
+
+        return np.max([self.prefetch_time-self.wait_time, 0])
+
+    def shutdown(self):
+
+        if self.__executor is not None:
+            for future in self.__futures.values():
+                future.cancel()
+            self.__executor.shutdown(wait=True)
+            for i in self.__futures.keys():
+                if mtd.doesExist(self.__prefetch_workspace(i)):
+                    DeleteWorkspace(self.__prefetch_workspace(i))
+            self.__executor = None
+            self.__futures = {}
+
+    def write_report(self, filename):
+
+        with open(filename, 'w') as f:
+            f.write('lookahead                  : {:12d}\n'.format(self.lookahead))
+            f.write('memory limit [%]           : {:12.1f}\n'.format(self.memory_limit))
+            f.write('prefetched runs            : {:12d}\n'.format(self.n_prefetched))
+            f.write('skipped (memory) runs      : {:12d}\n'.format(self.n_skipped))
+            f.write('prefetch load time [s]     : {:12.2f}\n'.format(self.prefetch_time))
+            f.write('prefetch wait time [s]     : {:12.2f}\n'.format(self.wait_time))
+            f.write('synchronous load time [s]  : {:12.2f}\n'.format(self.load_time))
+            f.write('hidden load time [s]       : {:12.2f}\n'.format(self.hidden_time()))
@@ -0,0 +1,149 @@
+import os
+import json
+import itertools
+
+import numpy as np
+
+def spread(x):
+
+    x = x.astype(np.uint64) & np.uint64(0x1fffff)
+
+    x = (x | (x << np.uint64(32))) & np.uint64(0x1f00000000ffff)
+    x = (x | (x << np.uint64(16))) & np.uint64(0x1f0000ff0000ff)
+    x = (x | (x << np.uint64(8))) & np.uint64(0x100f00f00f00f00f)
+    x = (x | (x << np.uint64(4))) & np.uint64(0x10c30c30c30c30c3)
+    x = (x | (x << np.uint64(2))) & np.uint64(0x1249249249249249)
+
+    return x
+
+def morton_keys(cells):
+
+    cells = np.atleast_2d(cells)
+
+    return spread(cells[:,0]) | (spread(cells[:,1]) << np.uint64(1)) | (spread(cells[:,2]) << np.uint64(2))
+
+def q_sample(tof, l1, l2, two_theta, azimuthal, R):
+
+    lamda = 3956.034*tof*1e-6/(l1+l2)
+
+    k = 2*np.pi/lamda
+
+    Q_lab = np.column_stack([-k*np.sin(two_theta)*np.cos(azimuthal),
+                             -k*np.sin(two_theta)*np.sin(azimuthal),
+                              k*(1-np.cos(two_theta))])
+
+    return np.dot(Q_lab, R), k
+
+def build_q_index(basename, Q, bank, metadata, cell=0.05, shift=4):
+
+    Q_min = np.min(Q, axis=0) if len(Q) > 0 else np.full(3, -cell)
+    Q_max = np.max(Q, axis=0) if len(Q) > 0 else np.full(3, cell)
+
+    origin = Q_min-cell
+
+    cells = np.floor((Q-origin)/cell).astype(np.int64)
+
+    keys = morton_keys(cells)
+
+    sort = np.argsort(keys, kind='stable')
+
+    keys, Q, bank = keys[sort], Q[sort], bank[sort]
+
+    coarse = keys >> np.uint64(3*shift)
+
+    directory, starts = np.unique(coarse, return_index=True)
+    stops = np.append(starts[1:], len(keys))
+
+    np.save(basename+'_Q.npy', Q.astype(np.float32))
+    np.save(basename+'_bank.npy', bank.astype(np.int16))
+    np.save(basename+'_dir.npy', np.column_stack([directory.astype(np.int64), starts, stops]))
+
+    metadata = dict(metadata)
+    metadata.update({'origin': origin.tolist(),
+                     'cell': cell,
+                     'shift': shift,
+                     'min': Q_min.tolist(),
+                     'max': Q_max.tolist(),
+                     'events': int(len(keys))})
+
+    tmp = basename+'_{}.json'.format(os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(metadata, f)
+    os.replace(tmp, basename+'.json')
+
+class QIndex:
+
+    def __init__(self, basename):
+
+        self.basename = basename
+
+        with open(basename+'.json', 'r') as f:
+            self.metadata = json.load(f)
+
+        self.origin = np.array(self.metadata['origin'])
+        self.cell = self.metadata['cell']
+        self.shift = self.metadata['shift']
+
+        self.__directory = np.load(basename+'_dir.npy')
+
+        self.__Q = np.load(basename+'_Q.npy', mmap_mode='r')
+        self.__bank = np.load(basename+'_bank.npy', mmap_mode='r')
+
+    def slices(self, Q_min, Q_max):
+
+        size = self.cell*2**self.shift
+
+        c0 = np.floor((np.array(Q_min)-self.origin)/size).astype(np.int64)
+        c1 = np.floor((np.array(Q_max)-self.origin)/size).astype(np.int64)
+
+        c0, c1 = np.maximum(c0, 0), np.maximum(c1, 0)
+
+        cells = np.array(list(itertools.product(*[range(lo, hi+1) for lo, hi in zip(c0, c1)])))
+
+        keys = np.sort(morton_keys(cells).astype(np.int64))
+
+        directory = self.__directory[:,0]
+
+        ind = np.searchsorted(directory, keys)
+
+        valid = ind < len(directory)
+        ind, keys = ind[valid], keys[valid]
+
+        ind = ind[directory[ind] == keys]
+
+        ranges = []
+
+        for start, stop in self.__directory[ind,1:]:
+            if len(ranges) > 0 and ranges[-1][1] == start:
+                ranges[-1][1] = stop
+            else:
+                ranges.append([start, stop])
+
+        return ranges
+
+    def query_box(self, Q_min, Q_max, banks=None):
+
+        ranges = self.slices(Q_min, Q_max)
+
+        if len(ranges) == 0:
+            return np.zeros((0,3))
+
+        Q = np.concatenate([self.__Q[start:stop] for start, stop in ranges]).astype(float)
+        bank = np.concatenate([self.__bank[start:stop] for start, stop in ranges])
+
+        mask = np.all((Q >= Q_min) & (Q <= Q_max), axis=1)
+
+        if banks is not None:
+            mask &= np.isin(bank, banks)
+
+        return Q[mask]
+
+    def query_ellipsoid(self, Q0, W, radii, banks=None):
+
+        dQ = np.sqrt(np.sum((np.array(W)*np.array(radii))**2, axis=1))
+
+        Q = self.query_box(Q0-dQ, Q0+dQ, banks)
+
+        x = np.dot(Q-Q0, W)/radii
+
+        return Q[np.sum(x**2, axis=1) <= 1]